@@ -0,0 +1,59 @@
+import docopt
+import sys
+import yaml
+
+import logging
+
+import teuthology
+import teuthology.benchmark
+
+doc = """
+usage: teuthology-benchmark --help
+       teuthology-benchmark [-v] [--jobs <count>] [--nodes <count>]
+                            [--roles <count>] [--machine-type <type>]
+                            [--stage <stage>...]
+
+Measure scheduling and dispatching throughput against in-memory beanstalk and
+paddles servers, and print the results as YAML. Nothing outside this process
+is contacted, and no tests are run: jobs "pass" as soon as they are
+dispatched.
+
+Stages are run in the order given:
+  schedule   Queue jobs one at a time, as teuthology-schedule does
+  suite      Queue a generated suite, as teuthology-suite does
+  dispatch   Run teuthology-dispatcher until the queue is empty
+
+Miscellaneous arguments:
+  -h, --help                  Show this help message and exit
+  -v, --verbose               Be more verbose
+
+Standard arguments:
+  -j, --jobs <count>          How many jobs each queueing stage queues
+                              [default: 1000]
+  -n, --nodes <count>         How many nodes the lock server has
+                              [default: 64]
+  -r, --roles <count>         How many nodes each job locks [default: 2]
+  -m, --machine-type <type>   Machine type, and queue tube [default: smithi]
+  -s, --stage <stage>         Run only this stage. May be given more than once.
+"""
+
+
+def main(argv=sys.argv[1:]):
+    args = docopt.docopt(doc, argv=argv)
+    if args['--verbose']:
+        teuthology.log.setLevel(logging.DEBUG)
+    else:
+        # The dispatcher sets its own log level, so quiet everything
+        logging.disable(logging.INFO)
+    stages = args['--stage'] or teuthology.benchmark.STAGES
+    for stage in stages:
+        if stage not in teuthology.benchmark.STAGES:
+            sys.exit("Unknown stage: %s" % stage)
+    benchmark = teuthology.benchmark.Benchmark(
+        jobs=int(args['--jobs']),
+        nodes=int(args['--nodes']),
+        roles=int(args['--roles']),
+        machine_type=args['--machine-type'],
+    )
+    results = benchmark.run(stages)
+    print(yaml.safe_dump(results, default_flow_style=False), end='')
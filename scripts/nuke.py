@@ -6,8 +6,10 @@ doc = """
 usage:
   teuthology-nuke --help
   teuthology-nuke [-v] [--owner OWNER] [-n NAME] [-u] [-i] [-r|-R] [-s] [-k]
-                       [-p PID] [--dry-run] (-t CONFIG... | -a DIR)
-  teuthology-nuke [-v] [-u] [-i] [-r] [-s] [--dry-run] --owner OWNER --stale
+                       [-p PID] [--dry-run] [--workers N] [--retries N]
+                       [--progress FILE] (-t CONFIG... | -a DIR)
+  teuthology-nuke [-v] [-u] [-i] [-r] [-s] [--dry-run] [--workers N]
+                       [--retries N] [--progress FILE] --owner OWNER --stale
   teuthology-nuke [-v] [--dry-run] --stale-openstack
 
 Reset test machines
@@ -35,10 +37,18 @@ optional arguments:
   -n NAME, --name NAME  Name of run to cleanup
   -i, --noipmi          Skip ipmi checking
   -k, --keep-logs       Preserve test directories and logs on the machines
+  --workers N           Nuke at most N machines at once
+                        [default from nuke_workers in teuthology.yaml]
+  --retries N           Try machines that fail to be nuked up to N more times
+                        [default from nuke_retries in teuthology.yaml]
+  --progress FILE       Record nuked machines in FILE, and skip machines
+                        already recorded there, so that an interrupted nuke
+                        can be run again to finish it
 
 Examples:
 teuthology-nuke -t target.yaml --unlock --owner user@host
 teuthology-nuke -t target.yaml --pid 1234 --unlock --owner user@host
+teuthology-nuke --stale --owner scheduled_user --unlock --progress sweep.txt
 """
 
 
@@ -27,9 +27,15 @@ optional arguments:
                         Negative values will skip this operation.
                         [default: 60]
   -z DAYS, --compress DAYS
-                        Compress (using gzip) any teuthology.log files older
-                        than DAYS. Negative values will skip this operation.
+                        Compress any teuthology.log files older than DAYS.
+                        Negative values will skip this operation.
                         [default: 30]
+  --codec CODEC         Compress logs using CODEC; either gzip or zstd. zstd
+                        requires the zstandard module. [default: gzip]
+  -w WORKERS, --workers WORKERS
+                        How many threads to examine and remove directories
+                        with, and processes to compress logs with
+                        [default: 8]
 """.format(archive_base=teuthology.config.config.archive_base)
 
 
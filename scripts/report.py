@@ -5,9 +5,9 @@ import teuthology.report
 doc = """
 usage:
     teuthology-report -h
-    teuthology-report [-v] [-R] [-n] [-s SERVER] [-a ARCHIVE] [-D] -r RUN ...
-    teuthology-report [-v] [-s SERVER] [-a ARCHIVE] [-D] -r RUN -j JOB ...
-    teuthology-report [-v] [-R] [-n] [-s SERVER] [-a ARCHIVE] --all-runs
+    teuthology-report [-v] [-R] [-n] [-s SERVER] [-a ARCHIVE] [-w WORKERS] [-b BATCH] [-D] -r RUN ...
+    teuthology-report [-v] [-s SERVER] [-a ARCHIVE] [-w WORKERS] [-b BATCH] [-D] -r RUN -j JOB ...
+    teuthology-report [-v] [-R] [-n] [-s SERVER] [-a ARCHIVE] [-w WORKERS] [-b BATCH] --all-runs
 
 Submit test results to a web service
 
@@ -33,6 +33,13 @@ optional arguments:
                         behavior.
   -D, --dead            Mark all given jobs (or entire runs) with status
                         'dead'. Implies --refresh.
+  -w WORKERS, --workers WORKERS
+                        How many jobs to read and post at once
+                        [default: 8]
+  -b BATCH, --batch BATCH
+                        Post up to BATCH jobs in each request, if the results
+                        server accepts lists of jobs. 0 disables batching.
+                        [default: 0]
   -v, --verbose         be more verbose
 """.format(archive_base=teuthology.config.config.archive_base)
 
@@ -0,0 +1,395 @@
+"""
+An SQLite index of the runs and jobs in the archive.
+
+Listing runs and jobs, and finding out how jobs went, would otherwise mean
+walking archive_base and parsing each job's YAML files. The index stores
+what those walks find and is kept up to date incrementally: the supervisor
+updates a job when it finishes, and a job is only re-read when its
+directory, info.yaml or summary.yaml has changed since it was last
+indexed. Deleting the index file is always safe; it is rebuilt from disk as
+it is used, or all at once by ArchiveIndex.rebuild().
+
+The index is kept on local disk, not in the archive: archives are usually
+shared over NFS, where SQLite's locking can't be relied on. Each host (and
+user) therefore has its own index of the shared archive.
+"""
+import contextlib
+import logging
+import os
+import re
+import sqlite3
+import urllib.parse
+
+import yaml
+
+from teuthology.config import config
+from teuthology.job_status import get_status
+from teuthology.util import cache
+from teuthology.util.fs import dir_size
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = [
+    """
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    mtime REAL
+)""",
+    """
+CREATE TABLE IF NOT EXISTS jobs (
+    run_name TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    finished INTEGER NOT NULL,
+    status TEXT,
+    owner TEXT,
+    description TEXT,
+    duration REAL,
+    failure_reason TEXT,
+    mtime REAL,
+    log_mtime REAL,
+    size INTEGER,
+    PRIMARY KEY (run_name, job_id)
+)""",
+]
+
+JOB_FIELDS = ('run_name', 'job_id', 'finished', 'status', 'owner',
+              'description', 'duration', 'failure_reason', 'mtime',
+              'log_mtime', 'size')
+
+
+def is_job_dir(name):
+    return re.match(r'\d+$', name) is not None
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _job_mtime(job_dir):
+    """
+    When a job directory, or the YAML files in it that the index is read
+    from, last changed; rewriting a file in place doesn't change the
+    directory's own mtime
+    """
+    mtime = _mtime(job_dir)
+    if mtime is None:
+        return None
+    for name in ('info.yaml', 'summary.yaml'):
+        mtime = max(mtime, _mtime(os.path.join(job_dir, name)) or 0)
+    return mtime
+
+
+def _load_yaml(path):
+    try:
+        with open(path) as f:
+            return yaml.safe_load(f) or dict()
+    except OSError:
+        return None
+    except yaml.YAMLError:
+        log.warning("Could not parse %s", path)
+        return dict()
+
+
+def default_path(archive_base):
+    """
+    Where to keep the index of archive_base when archive_index_path isn't
+    set: in the user's cache directory, named for the archive and the
+    schema version
+    """
+    return cache.cache_dir('archive-index-v%d-%s.sqlite' % (
+        SCHEMA_VERSION, cache.path_key(archive_base)))
+
+
+class ArchiveIndex(object):
+    """
+    The index of the archive below archive_base
+
+    :param archive_base: The archive directory; defaults to
+                         config.archive_base
+    :param path:         Where to keep the index; defaults to
+                         config.archive_index_path, or default_path(). It
+                         must be on a local filesystem.
+    :param readonly:     Only read the index, never updating it. Defaults to
+                         whether the index exists but can't be written to.
+    """
+    def __init__(self, archive_base=None, path=None, readonly=None):
+        self.archive_base = archive_base or config.archive_base
+        self.path = path or config.archive_index_path or \
+            default_path(self.archive_base)
+        if readonly is None:
+            readonly = os.path.exists(self.path) and \
+                not os.access(self.path, os.W_OK)
+        self.readonly = readonly
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(
+                'file:%s?mode=ro' % urllib.parse.quote(self.path),
+                uri=True, timeout=60)
+            conn.row_factory = sqlite3.Row
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                        exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.row_factory = sqlite3.Row
+            # Whoever gets here first creates the schema; everyone else
+            # waits for them and then finds it there
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version == 0:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                conn.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+                version = SCHEMA_VERSION
+            conn.commit()
+        if version != SCHEMA_VERSION:
+            conn.close()
+            raise sqlite3.DatabaseError(
+                "Archive index %s has schema version %s, not %s; remove it "
+                "to have it rebuilt" % (self.path, version, SCHEMA_VERSION))
+        return conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self.conn:
+            yield self.conn
+
+    def run_dir(self, run_name):
+        return os.path.join(self.archive_base, run_name)
+
+    def read_job(self, run_name, job_id, size=False):
+        """
+        Read a job's metadata from its archive directory
+
+        :param size: Whether to add up the size of the job's files, which
+                     means walking its whole directory; otherwise the size is
+                     left as None
+        :returns:    A dict of the index's job fields, or None if there is no
+                     such job directory
+        """
+        job_dir = os.path.join(self.run_dir(run_name), job_id)
+        mtime = _job_mtime(job_dir)
+        if mtime is None:
+            return None
+        info = _load_yaml(os.path.join(job_dir, 'info.yaml'))
+        summary = _load_yaml(os.path.join(job_dir, 'summary.yaml'))
+        if not isinstance(info, dict):
+            info = dict()
+        if isinstance(summary, dict):
+            info.update(summary)
+        duration = info.get('duration')
+        return dict(
+            run_name=run_name,
+            job_id=job_id,
+            finished=int(summary is not None),
+            status=get_status(info) if summary is not None else None,
+            owner=info.get('owner'),
+            description=info.get('description'),
+            duration=float(duration) if duration is not None else None,
+            failure_reason=info.get('failure_reason'),
+            mtime=mtime,
+            log_mtime=_mtime(os.path.join(job_dir, 'teuthology.log')),
+            size=dir_size(job_dir) if size else None,
+        )
+
+    def update_job(self, run_name, job_id, size=False):
+        """
+        Re-read a single job from disk; e.g. once it has finished
+
+        :param size: As for read_job()
+        """
+        if self.readonly:
+            return
+        job_id = str(job_id)
+        job = self.read_job(run_name, job_id, size=size)
+        with self._transaction() as conn:
+            if job is None:
+                conn.execute(
+                    "DELETE FROM jobs WHERE run_name = ? AND job_id = ?",
+                    (run_name, job_id))
+                return
+            conn.execute(
+                "INSERT OR IGNORE INTO runs (name) VALUES (?)", (run_name,))
+            self._store_job(conn, job)
+
+    def _store_job(self, conn, job):
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs ({fields}) VALUES ({marks})".format(
+                fields=', '.join(JOB_FIELDS),
+                marks=', '.join('?' * len(JOB_FIELDS))),
+            [job[field] for field in JOB_FIELDS])
+
+    def update_run(self, run_name, force=False):
+        """
+        Bring a run's jobs up to date. If the run directory has not changed
+        since it was last indexed, only the jobs already in the index are
+        checked; only those whose directories or YAML files have changed
+        are read again.
+
+        :param force: Re-read every job in the run
+        """
+        if self.readonly:
+            return
+        run_dir = self.run_dir(run_name)
+        mtime = _mtime(run_dir)
+        conn = self.conn
+        if mtime is None or not os.path.isdir(run_dir):
+            with self._transaction():
+                conn.execute("DELETE FROM jobs WHERE run_name = ?",
+                             (run_name,))
+                conn.execute("DELETE FROM runs WHERE name = ?", (run_name,))
+            return
+        row = conn.execute("SELECT mtime FROM runs WHERE name = ?",
+                           (run_name,)).fetchone()
+        indexed = dict(
+            (r['job_id'], r) for r in conn.execute(
+                "SELECT job_id, finished, mtime FROM jobs "
+                "WHERE run_name = ?", (run_name,)))
+        if force or row is None or row['mtime'] != mtime:
+            job_ids = [name for name in os.listdir(run_dir)
+                       if is_job_dir(name) and
+                       os.path.isdir(os.path.join(run_dir, name))]
+        else:
+            job_ids = list(indexed)
+        changed = list()
+        for job_id in job_ids:
+            known = indexed.get(job_id)
+            if force or known is None or known['mtime'] != \
+                    _job_mtime(os.path.join(run_dir, job_id)):
+                changed.append(job_id)
+        jobs = [self.read_job(run_name, job_id) for job_id in changed]
+        with self._transaction():
+            if force or row is None or row['mtime'] != mtime:
+                gone = set(indexed) - set(job_ids)
+                conn.executemany(
+                    "DELETE FROM jobs WHERE run_name = ? AND job_id = ?",
+                    [(run_name, job_id) for job_id in gone])
+            for job_id, job in zip(changed, jobs):
+                if job is None:
+                    conn.execute(
+                        "DELETE FROM jobs WHERE run_name = ? AND job_id = ?",
+                        (run_name, job_id))
+                else:
+                    self._store_job(conn, job)
+            conn.execute(
+                "INSERT OR REPLACE INTO runs (name, mtime) VALUES (?, ?)",
+                (run_name, mtime))
+
+    def update_runs(self):
+        """
+        Bring the list of runs up to date, without looking inside them
+        """
+        if self.readonly:
+            return
+        if os.path.isdir(self.archive_base):
+            names = set(
+                name for name in os.listdir(self.archive_base)
+                if os.path.isdir(os.path.join(self.archive_base, name)))
+        else:
+            names = set()
+        conn = self.conn
+        indexed = set(r['name'] for r in conn.execute("SELECT name FROM runs"))
+        with self._transaction():
+            for name in indexed - names:
+                conn.execute("DELETE FROM jobs WHERE run_name = ?", (name,))
+                conn.execute("DELETE FROM runs WHERE name = ?", (name,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO runs (name) VALUES (?)",
+                [(name,) for name in names - indexed])
+
+    def rebuild(self):
+        """
+        Re-read every run and job in the archive
+        """
+        if self.readonly:
+            raise sqlite3.OperationalError(
+                "Archive index %s is read-only" % self.path)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM jobs")
+            conn.execute("DELETE FROM runs")
+        self.update_runs()
+        for run_name in self.runs(update=False):
+            self.update_run(run_name, force=True)
+
+    def runs(self, update=True):
+        """
+        :returns: The names of the runs in the archive
+        """
+        if update:
+            self.update_runs()
+        return [r['name'] for r in
+                self.conn.execute("SELECT name FROM runs ORDER BY name")]
+
+    def jobs(self, run_name, finished=None, status=None, update=True):
+        """
+        :param finished: If not None, only return jobs that have (or have
+                         not) finished
+        :param status:   Only return jobs with this status
+        :returns:        A list of dicts of the run's jobs' metadata, ordered
+                         by job id
+        """
+        if update:
+            self.update_run(run_name)
+        query = "SELECT * FROM jobs WHERE run_name = ?"
+        params = [run_name]
+        if finished is not None:
+            query += " AND finished = ?"
+            params.append(int(finished))
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY CAST(job_id AS INTEGER)"
+        return [dict(r) for r in self.conn.execute(query, params)]
+
+    def job(self, run_name, job_id):
+        """
+        :returns: A dict of the job's metadata, or None
+        """
+        self.update_job(run_name, job_id)
+        row = self.conn.execute(
+            "SELECT * FROM jobs WHERE run_name = ? AND job_id = ?",
+            (run_name, str(job_id))).fetchone()
+        return dict(row) if row is not None else None
+
+
+def get_index(archive_base=None):
+    """
+    :returns: An ArchiveIndex if config.archive_index is set, otherwise None
+    """
+    if not config.archive_index:
+        return None
+    return ArchiveIndex(archive_base)
+
+
+def try_update_job(run_name, job_id, archive_base=None):
+    """
+    Update a job in the archive index, if there is one, logging instead of
+    raising any errors. As the job's writer, we also record its size.
+    """
+    try:
+        index = get_index(archive_base)
+        if index is None:
+            return
+        index.update_job(run_name, job_id, size=True)
+        index.close()
+    except (OSError, sqlite3.Error):
+        log.exception("Could not update the archive index for job %s",
+                      job_id)
@@ -2,15 +2,23 @@ import beanstalkc
 import json
 import yaml
 import logging
+import os
 import pprint
+import re
 import sys
 from collections import OrderedDict
+from collections.abc import Mapping
+from urllib.parse import quote, unquote
 
 from teuthology.config import config
 from teuthology import report
+from teuthology.parallel import parallel
 
 log = logging.getLogger(__name__)
 
+# How many connections to look up indexed jobs with at once
+PEEK_WORKERS = 4
+
 
 def connect():
     host = config.queue_host
@@ -35,11 +43,259 @@ def watch_tube(connection, tube_name):
     return tube_name
 
 
-def walk_jobs(connection, tube_name, processor, pattern=None):
+def index_dir(tube_name):
+    """
+    The directory holding the run index for a tube: one file per run, named
+    after it, listing the IDs of the run's jobs. None if queue_index_dir
+    isn't set.
+    """
+    if not config.queue_index_dir:
+        return None
+    return os.path.join(
+        config.queue_index_dir,
+        '{host}:{port}'.format(host=config.queue_host,
+                               port=config.queue_port),
+        tube_name)
+
+
+def index_job(tube_name, run_name, job_id):
+    """
+    Record that a job of run_name was put in tube_name with job_id. This is
+    best-effort: a run missing from the index is found by walking the tube.
+    """
+    path = index_dir(tube_name)
+    if path is None:
+        return
+    try:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, quote(run_name, safe='')), 'a') as f:
+            f.write('{}\n'.format(job_id))
+    except OSError:
+        log.warning("Could not index job %s", job_id, exc_info=True)
+
+
+def indexed_runs(tube_name):
+    """
+    :returns: A dict mapping each run indexed for tube_name to a sorted list
+              of its job IDs, some of which may no longer be in the queue
     """
-    def callback(jobs_dict)
+    path = index_dir(tube_name)
+    if path is None:
+        return dict()
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return dict()
+    runs = dict()
+    for name in names:
+        try:
+            with open(os.path.join(path, name)) as f:
+                runs[unquote(name)] = sorted(
+                    int(line) for line in f if line.strip().isdigit())
+        except OSError:
+            continue
+    return runs
+
+
+def forget_run(tube_name, run_name):
+    if index_dir(tube_name) is None:
+        return
+    try:
+        os.remove(os.path.join(index_dir(tube_name), quote(run_name, safe='')))
+    except OSError:
+        pass
+
+
+def _top_level_value(body, key):
+    """
+    Find a top-level string or integer in a job's YAML without parsing all
+    of it. Returns None if the value isn't a plain scalar.
+    """
+    match = re.search(r'^{key}: ([^\'"\s][^\n]*)$'.format(key=key), body,
+                      re.MULTILINE)
+    if match:
+        return match.group(1)
+    return None
+
+
+class LazyJobConfig(Mapping):
+    """
+    A job config which is only parsed when something other than its name is
+    looked up in it
+    """
+    def __init__(self, body, name=None):
+        self.body = body
+        self.name = name or _top_level_value(body, 'name')
+        self._config = None
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = yaml.safe_load(self.body)
+        return self._config
+
+    def __getitem__(self, key):
+        if key == 'name' and self.name is not None:
+            return self.name
+        return self.config[key]
+
+    def __iter__(self):
+        return iter(self.config)
+
+    def __len__(self):
+        return len(self.config)
+
+
+def _stat_jobs(job_ids):
+    """
+    Look up the states of jobs on a connection of its own
+
+    :returns: A dict mapping the ID of each of the jobs still in the queue to
+              its state: 'ready', 'reserved', 'delayed' or 'buried'
+    """
+    connection = connect()
+    try:
+        states = dict()
+        for job_id in job_ids:
+            try:
+                states[job_id] = connection.stats_job(job_id)['state']
+            except beanstalkc.CommandFailed:
+                continue
+        return states
+    finally:
+        connection.close()
+
+
+def _peek_jobs(job_ids):
+    """
+    Peek at jobs on a connection of its own
+
+    :returns: A list of (job ID, body) for each of the jobs still in the
+              queue
+    """
+    connection = connect()
+    try:
+        found = list()
+        for job_id in job_ids:
+            job = connection.peek(job_id)
+            if job is not None:
+                found.append((job_id, job.body))
+        return found
+    finally:
+        connection.close()
+
+
+def _in_parallel(func, job_ids):
+    """
+    Call func on slices of job_ids, on up to PEEK_WORKERS connections at
+    once
+
+    :returns: A list of what each call returned
+    """
+    size = max(-(-len(job_ids) // PEEK_WORKERS), 1)
+    results = list()
+    with parallel() as p:
+        for i in range(0, len(job_ids), size):
+            p.spawn(func, job_ids[i:i + size])
+        for result in p:
+            results.append(result)
+    return results
+
+
+def ready_indexed_jobs(tube_name, runs):
+    """
+    Find which of the indexed jobs of runs are ready to be reserved, without
+    reserving them. Runs with no jobs left in the queue at all are dropped
+    from the index.
+
+    :param runs: A dict mapping run names to job IDs, as returned by
+                 indexed_runs()
+    :returns:    A dict mapping the name of each run with ready jobs to
+                 their sorted IDs
+    """
+    states = dict()
+    for result in _in_parallel(
+            _stat_jobs, [job_id for job_ids in runs.values()
+                         for job_id in job_ids]):
+        states.update(result)
+    ready = dict()
+    for run_name, job_ids in runs.items():
+        if not any(job_id in states for job_id in job_ids):
+            forget_run(tube_name, run_name)
+            continue
+        ready_ids = [job_id for job_id in job_ids
+                     if states.get(job_id) == 'ready']
+        if ready_ids:
+            ready[run_name] = sorted(ready_ids)
+    return ready
+
+
+def find_indexed_jobs(connection, tube_name, runs, first_only=False):
+    """
+    Look up the indexed jobs of the given runs that are ready in the queue,
+    without reserving them
+
+    :param runs:       A dict mapping run names to the IDs of their ready
+                       jobs, as returned by ready_indexed_jobs()
+    :param first_only: Only find each run's first ready job
+    :returns:          A list of (job ID, job config, job) sorted by job ID
+    """
+    names = dict()
+    for run_name, job_ids in runs.items():
+        for job_id in job_ids[:1] if first_only else job_ids:
+            names[job_id] = run_name
+    found = list()
+    for result in _in_parallel(_peek_jobs, sorted(names)):
+        found.extend(result)
+    return [
+        (job_id, LazyJobConfig(body, name=names[job_id]),
+         beanstalkc.Job(connection, job_id, body, reserved=False))
+        for job_id, body in sorted(found)
+    ]
+
+
+def walk_jobs(connection, tube_name, processor, pattern=None, run_name=None,
+              runs_only=False):
+    """
+    Hand the jobs in a tube to processor.add_job(), then call
+    processor.complete().
+
+    If the queue index accounts for every ready job in the tube, the
+    matching jobs are looked up by job ID, without reserving them; only the
+    states of the indexed jobs and the bodies of the matching ones are
+    fetched. Otherwise - some jobs weren't indexed, or a dispatcher took or
+    queued a job meanwhile - every job in the tube is reserved and looked
+    at, and then released again.
+
+    :param pattern:   Only process jobs with pattern in their run's name
+    :param run_name:  Only process the jobs of this run
+    :param runs_only: Only the runs are wanted, so just process the first
+                      job of each run
     """
     log.info("Checking Beanstalk Queue...")
+    runs = indexed_runs(tube_name)
+    if runs:
+        ready = ready_indexed_jobs(tube_name, runs)
+        ready_count = sum(len(job_ids) for job_ids in ready.values())
+        if ready_count == \
+                connection.stats_tube(tube_name)['current-jobs-ready']:
+            if run_name is not None:
+                ready = {name: ids for name, ids in ready.items()
+                         if name == run_name}
+            elif pattern is not None:
+                ready = {name: ids for name, ids in ready.items()
+                         if pattern in name}
+            jobs = find_indexed_jobs(connection, tube_name, ready,
+                                     first_only=runs_only)
+            if not jobs:
+                log.info('No jobs in Beanstalk Queue')
+            for job_id, job_config, job in jobs:
+                processor.add_job(job_id, job_config, job)
+            processor.complete()
+            return
+        log.info("The queue index doesn't account for every job in the "
+                 "tube; looking at each of them")
+
     job_count = connection.stats_tube(tube_name)['current-jobs-ready']
     if job_count == 0:
         log.info('No jobs in Beanstalk Queue')
@@ -47,19 +303,31 @@ def walk_jobs(connection, tube_name, processor, pattern=None):
 
     # Try to figure out a sane timeout based on how many jobs are in the queue
     timeout = job_count / 2000.0 * 60
-    for i in range(1, job_count + 1):
-        print_progress(i, job_count, "Loading")
-        job = connection.reserve(timeout=timeout)
-        if job is None or job.body is None:
-            continue
-        job_config = yaml.safe_load(job.body)
-        job_name = job_config['name']
-        job_id = job.stats()['id']
-        if pattern is not None and pattern not in job_name:
-            continue
-        processor.add_job(job_id, job_config, job)
-    end_progress()
-    processor.complete()
+    reserved = list()
+    try:
+        for i in range(1, job_count + 1):
+            print_progress(i, job_count, "Loading")
+            job = connection.reserve(timeout=timeout)
+            if job is None:
+                continue
+            reserved.append(job)
+            if job.body is None:
+                continue
+            job_config = LazyJobConfig(job.body)
+            job_name = job_config['name']
+            if run_name is not None and job_name != run_name:
+                continue
+            if pattern is not None and pattern not in job_name:
+                continue
+            processor.add_job(job.jid, job_config, job)
+        end_progress()
+        processor.complete()
+    finally:
+        for job in reserved:
+            if job.reserved:
+                priority = _top_level_value(job.body or '', 'priority')
+                job.release(priority=int(priority) if priority and
+                            priority.isdigit() else None)
 
 
 def print_progress(index, total, message=None):
@@ -117,7 +385,7 @@ class JobPrinter(JobProcessor):
             job_name=job_name,
             ))
         if self.full:
-            pprint.pprint(job_config)
+            pprint.pprint(dict(job_config))
         elif job_desc and self.show_desc:
             for desc in job_desc.split():
                 print('\t {}'.format(desc))
@@ -154,7 +422,12 @@ class JobDeleter(JobProcessor):
             ))
         job_obj = self.jobs[job_id].get('job_obj')
         if job_obj:
-            job_obj.delete()
+            try:
+                job_obj.delete()
+            except beanstalkc.CommandFailed:
+                # A dispatcher reserved it first
+                log.warning("Job %s is no longer queued", job_id)
+                return
         report.try_delete_jobs(job_name, job_id)
 
 
@@ -202,10 +475,10 @@ def main(args):
             pause_tube(connection, machine_type, pause_duration)
         elif delete:
             walk_jobs(connection, machine_type,
-                      JobDeleter(delete))
+                      JobDeleter(delete), pattern=delete)
         elif runs:
             walk_jobs(connection, machine_type,
-                      RunPrinter())
+                      RunPrinter(), runs_only=True)
         else:
             walk_jobs(connection, machine_type,
                       JobPrinter(show_desc=show_desc, full=full))
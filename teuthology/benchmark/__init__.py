@@ -0,0 +1,300 @@
+"""
+Measure how fast jobs move through scheduling and dispatching, against the
+in-memory beanstalk and paddles stand-ins in this package
+
+Each stage runs the real code path in-process. Only what would leave the
+machine or take over the process is replaced: supervisors are not spawned
+(a fake one reports the job passed and unlocks its nodes), and nothing is
+fetched from git.
+"""
+import contextlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from unittest.mock import patch
+
+import yaml
+
+from teuthology import beanstalk
+from teuthology import dispatcher
+from teuthology import report
+from teuthology import safepath
+from teuthology import schedule
+from teuthology.config import config, FakeNamespace, JobConfig
+from teuthology.lock import ops, query
+from teuthology.suite import util as suite_util
+from teuthology.suite.run import Run
+from teuthology.util import http_client
+
+from teuthology.benchmark.beanstalkd import FakeBeanstalkd
+from teuthology.benchmark.paddles import FakePaddles
+
+log = logging.getLogger(__name__)
+
+STAGES = ('schedule', 'suite', 'dispatch')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class TimedConnection(object):
+    """
+    Wrap a beanstalkc connection, timing each reserve that returns a job.
+    Reserves don't wait for more jobs than are already queued.
+    """
+    def __init__(self, connection, latencies):
+        self.connection = connection
+        self.latencies = latencies
+
+    def reserve(self, timeout=None):
+        start = time.time()
+        job = self.connection.reserve(timeout=0)
+        if job is not None:
+            self.latencies.append(time.time() - start)
+        return job
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class FakeSupervisor(object):
+    """
+    Stands in for the teuthology-dispatcher --supervisor process: marks the
+    job passed and unlocks its nodes, then exits at once
+    """
+    pid = 0
+    returncode = 0
+
+    def __init__(self, args, **kwargs):
+        with open(args[args.index('--job-config') + 1]) as f:
+            job_config = yaml.safe_load(f)
+        report.try_push_job_info(job_config, dict(status='pass'))
+        targets = job_config.get('targets')
+        if targets:
+            ops.unlock_many(list(targets), job_config['owner'])
+
+    def poll(self):
+        return self.returncode
+
+
+class Benchmark(object):
+    """
+    :param jobs:         How many jobs the schedule and suite stages each
+                         queue
+    :param nodes:        How many nodes the fake lock server has
+    :param roles:        How many nodes each job locks
+    :param machine_type: The machine type (and tube) to use
+    """
+    def __init__(self, jobs=1000, nodes=64, roles=2, machine_type='smithi'):
+        self.jobs = jobs
+        self.nodes = nodes
+        self.roles = [['mon.%d' % i, 'osd.%d' % i] for i in range(roles)]
+        self.machine_type = machine_type
+        self.owner = 'scheduled_benchmark'
+        self.results = dict()
+        self.reserve_latencies = list()
+
+    def run(self, stages=STAGES):
+        """
+        :returns: A dict of results: for each stage, how many jobs it
+                  handled in how long; how long reserves took; and how many
+                  requests each fake server saw
+        """
+        self.tmp = tempfile.mkdtemp(prefix='teuthology-benchmark-')
+        try:
+            with FakeBeanstalkd() as beanstalkd, \
+                    FakePaddles(self.nodes, self.machine_type,
+                                config.lab_domain) as paddles, \
+                    self.configured(beanstalkd, paddles), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                for stage in stages:
+                    start = time.time()
+                    count = getattr(self, 'run_' + stage)()
+                    seconds = time.time() - start
+                    self.results[stage] = dict(
+                        jobs=count,
+                        seconds=round(seconds, 3),
+                        jobs_per_sec=round(count / seconds, 1)
+                        if seconds else 0.0,
+                    )
+                    log.info("%s: %d jobs in %.2fs", stage, count, seconds)
+                latencies = self.reserve_latencies
+                self.results['reserve_latency'] = dict(
+                    count=len(latencies),
+                    mean=sum(latencies) / len(latencies) if latencies
+                    else 0.0,
+                    p50=percentile(latencies, 0.5),
+                    p99=percentile(latencies, 0.99),
+                    max=max(latencies or [0.0]),
+                )
+                self.results['http_calls'] = dict(paddles.calls)
+                self.results['beanstalk_commands'] = beanstalkd.commands
+        finally:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+        return self.results
+
+    @contextlib.contextmanager
+    def configured(self, beanstalkd, paddles):
+        archive_dir = os.path.join(self.tmp, 'archive')
+        os.mkdir(archive_dir)
+        with patch.multiple(
+                config,
+                queue_host=beanstalkd.host,
+                queue_port=beanstalkd.port,
+                queue_index_dir=None,
+                pid_registry_dir=os.path.join(self.tmp, 'pids'),
+                lock_server=paddles.url,
+                results_server=paddles.url,
+                archive_base=archive_dir,
+                reserve_machines=0,
+                suite_verify_ceph_hash=False,
+                teuthology_path=self.tmp):
+            http_client.reset()
+            query.forget_status()
+            try:
+                yield
+            finally:
+                http_client.reset()
+                query.forget_status()
+
+    def job_config(self, name, index):
+        return dict(
+            name=name,
+            owner=self.owner,
+            priority=100,
+            machine_type=self.machine_type,
+            tube=self.machine_type,
+            description='benchmark/%d' % index,
+            roles=self.roles,
+            os_type='ubuntu',
+            os_version='22.04',
+        )
+
+    def run_schedule(self):
+        """
+        Queue jobs one at a time with schedule_job(), as
+        teuthology-schedule does
+        """
+        name = 'benchmark-schedule'
+        for i in range(self.jobs):
+            schedule.schedule_job(self.job_config(name, i))
+        return self.jobs
+
+    def make_suite(self):
+        """
+        Write out a suite whose matrix has at least self.jobs jobs
+        """
+        suite_repo = os.path.join(self.tmp, 'suite-repo')
+        suite_dir = os.path.join(suite_repo, 'suites', 'benchmark')
+        width = 1
+        while width * width < self.jobs:
+            width += 1
+        for facet in ('a', 'b'):
+            facet_dir = os.path.join(suite_dir, facet)
+            os.makedirs(facet_dir)
+            for i in range(width):
+                path = os.path.join(facet_dir, '%s%d.yaml' % (facet, i))
+                with open(path, 'w') as f:
+                    yaml.safe_dump(dict(overrides={facet: i}), f)
+        open(os.path.join(suite_dir, '%'), 'w').close()
+        return suite_repo
+
+    def make_run(self, suite_repo):
+        """
+        Build a Run without the git and package lookups its constructor
+        makes
+        """
+        run = Run.__new__(Run)
+        run.name = 'benchmark-suite'
+        run.args = FakeNamespace(dict(
+            arch='x86_64', suite_relpath='', subset=None,
+            no_nested_subset=False, seed=1, filter_in=None, filter_out=None,
+            filter_all=None, filter_fragments=False, dry_run=False,
+            limit=self.jobs, sleep_before_teardown=0, newest=0,
+            priority=100, force_priority=True, job_threshold=0, num=1,
+            throttle=None, verbose=0, machine_type=self.machine_type,
+            owner=self.owner, queue_backend=None, non_interactive=True,
+        ))
+        run.base_config = JobConfig.from_dict(dict(
+            suite='benchmark', sha1='0' * 40, branch='main',
+            os_type='ubuntu', os_version='22.04',
+            machine_type=self.machine_type, roles=self.roles,
+        ))
+        run.suite_repo_path = suite_repo
+        run.base_yaml_paths = list()
+        run.package_versions = dict()
+        run.config_input = dict()
+        run.base_args = run.build_base_args()
+        return run
+
+    def run_suite(self):
+        """
+        Queue a suite with Run.schedule_suite(), running teuthology-schedule
+        in-process for each job
+        """
+        from scripts import schedule as schedule_script
+
+        def teuthology_schedule(args, verbose, dry_run, log_prefix='',
+                                stdin=None):
+            with patch('teuthology.misc.stdin', io.StringIO(stdin or '')):
+                schedule_script.main(list(args))
+
+        run = self.make_run(self.make_suite())
+        with patch.object(suite_util, 'teuthology_schedule',
+                          teuthology_schedule):
+            return run.schedule_suite()
+
+    def run_dispatch(self):
+        """
+        Run the dispatcher until the queue is empty
+        """
+        log_dir = os.path.join(self.tmp, 'log')
+        os.mkdir(log_dir)
+        queued = beanstalk.connect()
+        try:
+            queued.watch(self.machine_type)
+            count = queued.stats_tube(self.machine_type)['current-jobs-ready']
+        finally:
+            queued.close()
+
+        latencies = self.reserve_latencies
+        real_connect = beanstalk.connect
+
+        def prep_job(job_config, log_file_path, archive_dir):
+            job_config['worker_log'] = log_file_path
+            job_config['archive_path'] = os.path.join(
+                archive_dir, safepath.munge(job_config['name']),
+                str(job_config['job_id']))
+            job_config['suite_path'] = self.tmp
+            return job_config, self.tmp
+
+        with patch.multiple(
+                dispatcher,
+                find_dispatcher_processes=lambda tube: [],
+                setup_log_file=lambda path: None,
+                install_except_hook=lambda: None,
+                load_config=lambda archive_dir=None: None,
+                fetch_teuthology=lambda *args, **kwargs: self.tmp,
+                fetch_qa_suite=lambda *args, **kwargs: self.tmp,
+                prep_job=prep_job), \
+                patch.object(dispatcher.subprocess, 'Popen', FakeSupervisor), \
+                patch.object(beanstalk, 'connect',
+                             lambda: TimedConnection(real_connect(),
+                                                     latencies)):
+            dispatcher.main({
+                '--supervisor': False,
+                '--verbose': False,
+                '--tube': self.machine_type,
+                '--log-dir': log_dir,
+                '--archive-dir': config.archive_base,
+                '--exit-on-empty-queue': True,
+            })
+        return count
@@ -0,0 +1,407 @@
+"""
+An in-memory server speaking enough of the beanstalk protocol for
+teuthology's own use of it, so that scheduling and dispatching can be
+exercised without a real beanstalkd
+
+Delays and time-to-run are accepted but ignored: jobs are ready as soon as
+they are put, and stay reserved until they are deleted, released or buried
+or the connection that reserved them closes.
+"""
+import heapq
+import itertools
+import socketserver
+import threading
+import time
+
+import yaml
+
+
+class Job(object):
+    def __init__(self, jid, tube, priority, body):
+        self.jid = jid
+        self.tube = tube
+        self.priority = priority
+        self.body = body
+        self.state = 'ready'
+        self.owner = None
+        self.created = time.time()
+        self.reserves = 0
+        self.releases = 0
+        self.buries = 0
+
+    def stats(self):
+        return {
+            'id': self.jid,
+            'tube': self.tube,
+            'state': self.state,
+            'pri': self.priority,
+            'age': int(time.time() - self.created),
+            'delay': 0,
+            'ttr': 0,
+            'time-left': 0,
+            'reserves': self.reserves,
+            'timeouts': 0,
+            'releases': self.releases,
+            'buries': self.buries,
+            'kicks': 0,
+        }
+
+
+class Queue(object):
+    """
+    The state of the server, shared by all its connections
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.jobs = dict()
+        # tube -> heap of (priority, jid) for jobs that may be ready; jobs
+        # that have since left the ready state are skipped when popped
+        self.ready = dict()
+        self.paused = dict()
+        self.ids = itertools.count(1)
+        self.commands = dict()
+
+    def push_ready(self, job):
+        job.state = 'ready'
+        job.owner = None
+        heapq.heappush(self.ready.setdefault(job.tube, []),
+                       (job.priority, job.jid))
+        self.cond.notify_all()
+
+    def ready_jobs(self, tube):
+        return [jid for _, jid in self.ready.get(tube, [])
+                if self.jobs.get(jid) is not None and
+                self.jobs[jid].state == 'ready']
+
+    def next_ready(self, tubes):
+        """
+        :returns: The most urgent ready job in any of tubes that isn't
+                  paused, or None
+        """
+        now = time.time()
+        best = None
+        for tube in tubes:
+            if self.paused.get(tube, 0) > now:
+                continue
+            heap = self.ready.get(tube, [])
+            while heap:
+                jid = heap[0][1]
+                job = self.jobs.get(jid)
+                if job is not None and job.state == 'ready':
+                    break
+                heapq.heappop(heap)
+            if heap and (best is None or heap[0] < best):
+                best = heap[0]
+        if best is None:
+            return None
+        return self.jobs[best[1]]
+
+    def tube_stats(self, tube):
+        jobs = [job for job in self.jobs.values() if job.tube == tube]
+
+        def count(state):
+            return len([job for job in jobs if job.state == state])
+        pause = self.paused.get(tube, 0)
+        return {
+            'name': tube,
+            'current-jobs-urgent': 0,
+            'current-jobs-ready': count('ready'),
+            'current-jobs-reserved': count('reserved'),
+            'current-jobs-delayed': 0,
+            'current-jobs-buried': count('buried'),
+            'total-jobs': len(jobs),
+            'pause': 1 if pause > time.time() else 0,
+            'pause-time-left': max(int(pause - time.time()), 0),
+        }
+
+
+class Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super(Handler, self).setup()
+        self.queue = self.server.queue
+        self.using = 'default'
+        self.watching = ['default']
+
+    def finish(self):
+        with self.queue.cond:
+            for job in self.queue.jobs.values():
+                if job.owner is self:
+                    self.queue.push_ready(job)
+        super(Handler, self).finish()
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            words = line.decode().split()
+            if not words:
+                continue
+            command, args = words[0], words[1:]
+            if command == 'quit':
+                return
+            with self.queue.cond:
+                self.queue.commands[command] = \
+                    self.queue.commands.get(command, 0) + 1
+            method = getattr(self, 'do_' + command.replace('-', '_'), None)
+            try:
+                if method is None:
+                    self.reply('UNKNOWN_COMMAND')
+                else:
+                    method(*args)
+            except (TypeError, ValueError):
+                self.reply('BAD_FORMAT')
+
+    def reply(self, line, data=None):
+        out = line.encode() + b'\r\n'
+        if data is not None:
+            out += data + b'\r\n'
+        self.wfile.write(out)
+
+    def reply_yaml(self, obj):
+        data = b'---\n' + yaml.safe_dump(obj, default_flow_style=False).encode()
+        self.reply('OK %d' % len(data), data)
+
+    def reply_job(self, word, job):
+        self.reply('%s %d %d' % (word, job.jid, len(job.body)), job.body)
+
+    def do_use(self, tube):
+        self.using = tube
+        self.reply('USING ' + tube)
+
+    def do_watch(self, tube):
+        if tube not in self.watching:
+            self.watching.append(tube)
+        self.reply('WATCHING %d' % len(self.watching))
+
+    def do_ignore(self, tube):
+        if self.watching == [tube]:
+            self.reply('NOT_IGNORED')
+            return
+        if tube in self.watching:
+            self.watching.remove(tube)
+        self.reply('WATCHING %d' % len(self.watching))
+
+    def do_put(self, priority, delay, ttr, size):
+        body = self.rfile.read(int(size) + 2)[:-2]
+        with self.queue.cond:
+            job = Job(next(self.queue.ids), self.using, int(priority), body)
+            self.queue.jobs[job.jid] = job
+            self.queue.push_ready(job)
+        self.reply('INSERTED %d' % job.jid)
+
+    def do_reserve(self):
+        self.do_reserve_with_timeout(None)
+
+    def do_reserve_with_timeout(self, timeout):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + int(timeout)
+        with self.queue.cond:
+            while True:
+                job = self.queue.next_ready(self.watching)
+                if job is not None:
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.reply('TIMED_OUT')
+                        return
+                # Wake up now and then in case a tube is unpaused
+                self.queue.cond.wait(min(remaining or 1, 1))
+            job.state = 'reserved'
+            job.owner = self
+            job.reserves += 1
+        self.reply_job('RESERVED', job)
+
+    def _own_job(self, jid):
+        job = self.queue.jobs.get(int(jid))
+        if job is None or job.state == 'reserved' and job.owner is not self:
+            return None
+        return job
+
+    def do_delete(self, jid):
+        with self.queue.cond:
+            job = self._own_job(jid)
+            if job is None:
+                self.reply('NOT_FOUND')
+                return
+            del self.queue.jobs[job.jid]
+        self.reply('DELETED')
+
+    def do_release(self, jid, priority, delay):
+        with self.queue.cond:
+            job = self._own_job(jid)
+            if job is None or job.state != 'reserved':
+                self.reply('NOT_FOUND')
+                return
+            job.priority = int(priority)
+            job.releases += 1
+            self.queue.push_ready(job)
+        self.reply('RELEASED')
+
+    def do_bury(self, jid, priority):
+        with self.queue.cond:
+            job = self._own_job(jid)
+            if job is None or job.state != 'reserved':
+                self.reply('NOT_FOUND')
+                return
+            job.priority = int(priority)
+            job.state = 'buried'
+            job.owner = None
+            job.buries += 1
+        self.reply('BURIED')
+
+    def do_touch(self, jid):
+        with self.queue.cond:
+            job = self._own_job(jid)
+        self.reply('NOT_FOUND' if job is None else 'TOUCHED')
+
+    def do_kick_job(self, jid):
+        with self.queue.cond:
+            job = self.queue.jobs.get(int(jid))
+            if job is None or job.state != 'buried':
+                self.reply('NOT_FOUND')
+                return
+            self.queue.push_ready(job)
+        self.reply('KICKED')
+
+    def do_kick(self, bound):
+        with self.queue.cond:
+            buried = sorted(
+                jid for jid, job in self.queue.jobs.items()
+                if job.tube == self.using and job.state == 'buried')
+            for jid in buried[:int(bound)]:
+                self.queue.push_ready(self.queue.jobs[jid])
+        self.reply('KICKED %d' % len(buried[:int(bound)]))
+
+    def do_peek(self, jid):
+        with self.queue.cond:
+            job = self.queue.jobs.get(int(jid))
+        if job is None:
+            self.reply('NOT_FOUND')
+        else:
+            self.reply_job('FOUND', job)
+
+    def do_peek_ready(self):
+        with self.queue.cond:
+            job = self.queue.next_ready([self.using])
+        if job is None:
+            self.reply('NOT_FOUND')
+        else:
+            self.reply_job('FOUND', job)
+
+    def do_peek_buried(self):
+        with self.queue.cond:
+            buried = sorted(
+                jid for jid, job in self.queue.jobs.items()
+                if job.tube == self.using and job.state == 'buried')
+            job = self.queue.jobs[buried[0]] if buried else None
+        if job is None:
+            self.reply('NOT_FOUND')
+        else:
+            self.reply_job('FOUND', job)
+
+    def do_peek_delayed(self):
+        self.reply('NOT_FOUND')
+
+    def do_stats_job(self, jid):
+        with self.queue.cond:
+            job = self.queue.jobs.get(int(jid))
+            stats = None if job is None else job.stats()
+        if stats is None:
+            self.reply('NOT_FOUND')
+        else:
+            self.reply_yaml(stats)
+
+    def do_stats_tube(self, tube):
+        with self.queue.cond:
+            known = tube in self.queue.ready or any(
+                job.tube == tube for job in self.queue.jobs.values())
+            stats = self.queue.tube_stats(tube)
+        if not known and tube not in self.watching and tube != self.using:
+            self.reply('NOT_FOUND')
+        else:
+            self.reply_yaml(stats)
+
+    def do_stats(self):
+        with self.queue.cond:
+            jobs = list(self.queue.jobs.values())
+            stats = {
+                'current-jobs-ready':
+                    len([job for job in jobs if job.state == 'ready']),
+                'current-jobs-reserved':
+                    len([job for job in jobs if job.state == 'reserved']),
+                'current-jobs-buried':
+                    len([job for job in jobs if job.state == 'buried']),
+                'total-jobs': next(self.queue.ids) - 1,
+            }
+            for command, count in self.queue.commands.items():
+                stats['cmd-' + command] = count
+        self.reply_yaml(stats)
+
+    def do_list_tubes(self):
+        with self.queue.cond:
+            tubes = set(self.queue.ready) | set(['default'])
+        self.reply_yaml(sorted(tubes))
+
+    def do_list_tube_used(self):
+        self.reply('USING ' + self.using)
+
+    def do_list_tubes_watched(self):
+        self.reply_yaml(list(self.watching))
+
+    def do_pause_tube(self, tube, delay):
+        with self.queue.cond:
+            self.queue.paused[tube] = time.time() + int(delay)
+            self.queue.cond.notify_all()
+        self.reply('PAUSED')
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeBeanstalkd(object):
+    """
+    A beanstalk server listening on localhost, to be pointed at with
+    queue_host and queue_port::
+
+        with FakeBeanstalkd() as beanstalkd:
+            config.queue_host = beanstalkd.host
+            config.queue_port = beanstalkd.port
+    """
+    def __init__(self, port=0):
+        self.queue = Queue()
+        self.server = Server(('127.0.0.1', port), Handler)
+        self.server.queue = self.queue
+        self.host, self.port = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def commands(self):
+        """
+        How many times each command has been received
+        """
+        with self.queue.cond:
+            return dict(self.queue.commands)
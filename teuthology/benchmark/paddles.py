@@ -0,0 +1,248 @@
+"""
+An in-memory stand-in for paddles, with just the node locking and job
+reporting endpoints that scheduling and dispatching use
+"""
+import http.server
+import json
+import threading
+
+from urllib.parse import parse_qs, urlparse
+
+
+def make_node(name, machine_type):
+    return dict(
+        name=name,
+        machine_type=machine_type,
+        up=True,
+        locked=False,
+        locked_by=None,
+        locked_since=None,
+        description=None,
+        is_vm=False,
+        os_type='ubuntu',
+        os_version='22.04',
+        arch='x86_64',
+        ssh_pub_key='ssh-ed25519 AAAA%s' % name.split('.')[0],
+        mac_address=None,
+        vm_host=None,
+    )
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; don't let Nagle's algorithm
+    # hold the body back waiting for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, obj=None):
+        body = json.dumps(obj).encode() if obj is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        return json.loads(data) if data else dict()
+
+    def route(self, method):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = {key: values[-1] for key, values in
+                 parse_qs(url.query).items()}
+        data = self.read_json() if method in ('POST', 'PUT') else None
+        paddles = self.server.paddles
+        paddles.count(method, parts[0] if parts else '')
+        handler = getattr(paddles, '%s_%s' % (method.lower(), parts[0]),
+                          None) if parts else None
+        if handler is None:
+            self.respond(404, dict(message='not found'))
+            return
+        with paddles.lock:
+            status, obj = handler(parts[1:], query, data)
+        self.respond(status, obj)
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_HEAD(self):
+        self.route('HEAD')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+
+class FakePaddles(object):
+    """
+    Serve nodes and runs from memory on localhost, to be pointed at with
+    lock_server and results_server::
+
+        with FakePaddles(nodes=16, machine_type='smithi') as paddles:
+            config.lock_server = config.results_server = paddles.url
+    """
+    def __init__(self, nodes=0, machine_type='smithi', domain='example.com'):
+        self.lock = threading.Lock()
+        self.nodes = dict()
+        for i in range(nodes):
+            name = '%s%03d.%s' % (machine_type, i + 1, domain)
+            self.nodes[name] = make_node(name, machine_type)
+        self.runs = dict()
+        self.calls = dict()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        self.server.paddles = self
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, method, endpoint):
+        key = '%s /%s/' % (method, endpoint)
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    # Nodes
+
+    def _matches(self, node, query):
+        for key, value in query.items():
+            if key == 'count':
+                continue
+            if key == 'machine_type':
+                if node['machine_type'] not in value.split('|'):
+                    return False
+            elif key in ('up', 'locked', 'is_vm'):
+                if node[key] != (value in ('1', 'true', 'True')):
+                    return False
+            elif str(node.get(key)) != value:
+                return False
+        return True
+
+    def get_nodes(self, parts, query, data):
+        if parts:
+            node = self.nodes.get(parts[0])
+            if node is None:
+                return 404, dict(message='no such node')
+            if parts[1:] == ['jobs']:
+                return 200, []
+            return 200, node
+        nodes = [node for node in self.nodes.values()
+                 if self._matches(node, query)]
+        if 'count' in query:
+            nodes = nodes[:int(query['count'])]
+        return 200, nodes
+
+    def post_nodes(self, parts, query, data):
+        if parts == ['lock_many']:
+            candidates = [
+                node for node in self.nodes.values()
+                if not node['locked'] and node['up'] and
+                node['machine_type'] in data['machine_type'].split('|')]
+            if len(candidates) < data['count']:
+                return 503, dict(message='not enough free nodes')
+            locked = candidates[:data['count']]
+            for node in locked:
+                node.update(locked=True, locked_by=data['locked_by'],
+                            description=data.get('description'))
+            return 200, locked
+        if parts == ['unlock_many']:
+            for name in data['names']:
+                node = self.nodes.get(name)
+                if node is None or node['locked_by'] != data['locked_by']:
+                    return 403, dict(message='cannot unlock %s' % name)
+            for name in data['names']:
+                self.nodes[name].update(locked=False, locked_by=None,
+                                        description=None)
+            return 200, dict()
+        name = data['name']
+        self.nodes[name] = dict(make_node(name, data.get('machine_type')),
+                                **data)
+        return 200, self.nodes[name]
+
+    def put_nodes(self, parts, query, data):
+        node = self.nodes.get(parts[0]) if parts else None
+        if node is None:
+            return 404, dict(message='no such node')
+        if parts[1:] == ['lock']:
+            if data['locked'] == node['locked']:
+                return 403, dict(message='already %s' % (
+                    'locked' if node['locked'] else 'unlocked'))
+            if not data['locked'] and node['locked_by'] != data['locked_by']:
+                return 403, dict(message='locked by someone else')
+        node.update(data)
+        return 200, node
+
+    # Runs and jobs
+
+    def get_runs(self, parts, query, data):
+        if not parts:
+            return 200, [dict(name=name) for name in self.runs]
+        jobs = self.runs.get(parts[0])
+        if jobs is None:
+            return 404, dict(message='no such run')
+        if parts[1:] == ['jobs']:
+            return 200, list(jobs.values())
+        if len(parts) == 3:
+            job = jobs.get(parts[2])
+            return (200, job) if job else (404, dict(message='no such job'))
+        return 200, dict(name=parts[0])
+
+    def head_runs(self, parts, query, data):
+        status, obj = self.get_runs(parts, query, data)
+        return status, None
+
+    def post_runs(self, parts, query, data):
+        if not parts:
+            self.runs.setdefault(data['name'], dict())
+            return 200, dict(name=data['name'])
+        jobs = self.runs.setdefault(parts[0], dict())
+        for job in data if isinstance(data, list) else [data]:
+            job_id = str(job['job_id'])
+            if job_id in jobs:
+                return 400, dict(
+                    message='job with job_id %s already exists' % job_id)
+            jobs[job_id] = job
+        return 200, dict()
+
+    def put_runs(self, parts, query, data):
+        jobs = self.runs.setdefault(parts[0], dict())
+        job = jobs.setdefault(parts[2], dict())
+        job.update(data)
+        return 200, job
+
+    def delete_runs(self, parts, query, data):
+        if len(parts) == 3:
+            self.runs.get(parts[0], dict()).pop(parts[2], None)
+        else:
+            self.runs.pop(parts[0], None)
+        return 200, dict()
+
+    def jobs_with_status(self, status):
+        with self.lock:
+            return [job for jobs in self.runs.values()
+                    for job in jobs.values() if job.get('status') == status]
@@ -139,6 +139,8 @@ class TeuthologyConfig(YamlConfig):
     yaml_path = os.path.join(os.path.expanduser('~/.teuthology.yaml'))
     _defaults = {
         'archive_base': '/home/teuthworker/archive',
+        'archive_index': False,
+        'archive_index_path': None,
         'archive_upload': None,
         'archive_upload_key': None,
         'archive_upload_url': None,
@@ -153,11 +155,25 @@ class TeuthologyConfig(YamlConfig):
         'conserver_port': 3109,
         'gitbuilder_host': 'gitbuilder.ceph.com',
         'githelper_base_url': 'http://githelper.ceph.com',
+        'http_pool_size': 10,
+        'http_retries': 3,
+        'http_backoff': 0.5,
         'check_package_signatures': True,
         'job_threshold': 500,
         'lab_domain': 'front.sepia.ceph.com',
         'lock_server': 'http://paddles.front.sepia.ceph.com/',
+        'lock_broker_dir': None,
+        'lock_inventory': False,
+        'lock_inventory_ttl': 60,
+        'lock_poll_interval': 10,
+        'lock_poll_max_interval': 120,
         'max_job_time': 259200,  # 3 days
+        'nuke_workers': 20,
+        'nuke_ipmi_workers': 5,
+        'nuke_retries': 0,
+        'nuke_backoff': 30,
+        'queue_index_dir': None,
+        'pid_registry_dir': None,
         'nsupdate_url': 'http://nsupdate.front.sepia.ceph.com/update',
         'results_server': 'http://paddles.front.sepia.ceph.com/',
         'results_ui_server': 'http://pulpito.ceph.com/',
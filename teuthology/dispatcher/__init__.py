@@ -18,6 +18,7 @@ from teuthology.lock.ops import block_and_lock_machines
 from teuthology.dispatcher import supervisor
 from teuthology.worker import prep_job
 from teuthology import safepath
+from teuthology.util import pid_registry
 from teuthology.nuke import nuke
 
 log = logging.getLogger(__name__)
@@ -171,6 +172,8 @@ def main(args):
             job_proc = subprocess.Popen(run_args)
             job_procs.add(job_proc)
             log.info('Job supervisor PID: %s', job_proc.pid)
+            pid_registry.register(job_config['name'], job_config['job_id'],
+                                  job_proc.pid)
         except Exception:
             error_message = "Saw error while trying to spawn supervisor."
             log.exception(error_message)
@@ -3,12 +3,12 @@ import os
 import subprocess
 import time
 import yaml
-import requests
 
 from urllib.parse import urljoin
 from datetime import datetime
 
 import teuthology
+from teuthology import archive_index
 from teuthology import report
 from teuthology import safepath
 from teuthology.config import config as teuth_config
@@ -23,6 +23,7 @@ from teuthology.kill import kill_job
 from teuthology.task.internal import add_remotes
 from teuthology.misc import decanonicalize_hostname as shortname
 from teuthology.lock import query
+from teuthology.util import http_client, pid_registry
 
 log = logging.getLogger(__name__)
 
@@ -133,25 +134,31 @@ def run_job(job_config, teuth_bin_path, archive_dir, verbose):
     p = subprocess.Popen(args=arg)
     log.info("Job archive: %s", job_config['archive_path'])
     log.info("Job PID: %s", str(p.pid))
+    pid_registry.register(job_config['name'], job_config['job_id'], p.pid)
 
-    if teuth_config.results_server:
-        log.info("Running with watchdog")
-        try:
-            run_with_watchdog(p, job_config)
-        except Exception:
-            log.exception("run_with_watchdog had an unhandled exception")
-            raise
-    else:
-        log.info("Running without watchdog")
-        # This sleep() is to give the child time to start up and create the
-        # archive dir.
-        time.sleep(5)
-        p.wait()
+    try:
+        if teuth_config.results_server:
+            log.info("Running with watchdog")
+            try:
+                run_with_watchdog(p, job_config)
+            except Exception:
+                log.exception("run_with_watchdog had an unhandled exception")
+                raise
+        else:
+            log.info("Running without watchdog")
+            # This sleep() is to give the child time to start up and create
+            # the archive dir.
+            time.sleep(5)
+            p.wait()
+    finally:
+        pid_registry.unregister(job_config['name'], job_config['job_id'])
 
     if p.returncode != 0:
         log.error('Child exited with code %d', p.returncode)
     else:
         log.info('Success!')
+    archive_index.try_update_job(job_config['name'], job_config['job_id'],
+                                 teuth_config.archive_base)
     if 'targets' in job_config:
         unlock_targets(job_config)
     return p.returncode
@@ -177,7 +184,7 @@ def check_for_reimage_failures_and_mark_down(targets, count=10):
                 '/nodes/{0}/jobs/?count={1}'.format(
                 machine, count)
         )
-        resp = requests.get(url)
+        resp = http_client.get(url)
         jobs = resp.json()
         if len(jobs) < count:
             continue
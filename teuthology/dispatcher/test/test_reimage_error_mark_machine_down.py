@@ -19,19 +19,19 @@ class TestCheckReImageFailureMarkDown(object):
 
     @patch('teuthology.dispatcher.supervisor.shortname')
     @patch('teuthology.lock.ops.update_lock')
-    @patch('teuthology.dispatcher.supervisor.requests')
+    @patch('teuthology.dispatcher.supervisor.http_client')
     @patch('teuthology.dispatcher.supervisor.urljoin')
     @patch('teuthology.dispatcher.supervisor.teuth_config')
     def test_one_machine_ten_reimage_failed_jobs(
         self,
         m_t_config,
         m_urljoin,
-        m_requests,
+        m_http_client,
         mark_down,
         shortname
         ):
         targets = {'fakeos@rmachine061.front.sepia.ceph.com': 'ssh-ed25519'}
-        m_requests.get.return_value.json.return_value = \
+        m_http_client.get.return_value.json.return_value = \
             self.create_n_out_of_10_reimage_failed_jobs(10)
         shortname.return_value = 'rmachine061'
         self.the_function(targets)
@@ -39,19 +39,19 @@ class TestCheckReImageFailureMarkDown(object):
 
     @patch('teuthology.dispatcher.supervisor.shortname')
     @patch('teuthology.lock.ops.update_lock')
-    @patch('teuthology.dispatcher.supervisor.requests')
+    @patch('teuthology.dispatcher.supervisor.http_client')
     @patch('teuthology.dispatcher.supervisor.urljoin')
     @patch('teuthology.dispatcher.supervisor.teuth_config')
     def test_one_machine_seven_reimage_failed_jobs(
         self,
         m_t_config,
         m_urljoin,
-        m_requests,
+        m_http_client,
         mark_down,
         shortname,
         ):
         targets = {'fakeos@rmachine061.front.sepia.ceph.com': 'ssh-ed25519'}
-        m_requests.get.return_value.json.return_value = \
+        m_http_client.get.return_value.json.return_value = \
             self.create_n_out_of_10_reimage_failed_jobs(7)
         shortname.return_value = 'rmachine061'
         self.the_function(targets)
@@ -59,20 +59,20 @@ class TestCheckReImageFailureMarkDown(object):
 
     @patch('teuthology.dispatcher.supervisor.shortname')
     @patch('teuthology.lock.ops.update_lock')
-    @patch('teuthology.dispatcher.supervisor.requests')
+    @patch('teuthology.dispatcher.supervisor.http_client')
     @patch('teuthology.dispatcher.supervisor.urljoin')
     @patch('teuthology.dispatcher.supervisor.teuth_config')
     def test_two_machine_all_reimage_failed_jobs(
         self,
         m_t_config,
         m_urljoin,
-        m_requests,
+        m_http_client,
         mark_down,
         shortname,
         ):
         targets = {'fakeos@rmachine061.front.sepia.ceph.com': 'ssh-ed25519',
                    'fakeos@rmachine179.back.sepia.ceph.com': 'ssh-ed45333'}
-        m_requests.get.return_value.json.side_effect = \
+        m_http_client.get.return_value.json.side_effect = \
             [self.create_n_out_of_10_reimage_failed_jobs(10),
             self.create_n_out_of_10_reimage_failed_jobs(10)]
         shortname.return_value.side_effect = ['rmachine061', 'rmachine179']
@@ -81,20 +81,20 @@ class TestCheckReImageFailureMarkDown(object):
 
     @patch('teuthology.dispatcher.supervisor.shortname')
     @patch('teuthology.lock.ops.update_lock')
-    @patch('teuthology.dispatcher.supervisor.requests')
+    @patch('teuthology.dispatcher.supervisor.http_client')
     @patch('teuthology.dispatcher.supervisor.urljoin')
     @patch('teuthology.dispatcher.supervisor.teuth_config')
     def test_two_machine_one_healthy_one_reimage_failure(
         self,
         m_t_config,
         m_urljoin,
-        m_requests,
+        m_http_client,
         mark_down,
         shortname,
         ):
         targets = {'fakeos@rmachine061.front.sepia.ceph.com': 'ssh-ed25519',
                    'fakeos@rmachine179.back.sepia.ceph.com': 'ssh-ed45333'}
-        m_requests.get.return_value.json.side_effect = \
+        m_http_client.get.return_value.json.side_effect = \
             [self.create_n_out_of_10_reimage_failed_jobs(0),
             self.create_n_out_of_10_reimage_failed_jobs(10)]
         shortname.return_value.side_effect = ['rmachine061', 'rmachine179']
@@ -1,18 +1,23 @@
 #!/usr/bin/python
 import os
+import re
 import sys
 import yaml
+import beanstalkc
 import psutil
 import subprocess
 import tempfile
 import logging
 import getpass
+import requests
 
 
 from teuthology import beanstalk
 from teuthology import report
 from teuthology.config import config
 from teuthology import misc
+from teuthology.lock import ops, query
+from teuthology.util import pid_registry
 
 log = logging.getLogger(__name__)
 
@@ -32,8 +37,7 @@ def main(args):
         job = [split_spec[1]]
 
     if job:
-        for job_id in job:
-            kill_job(run_name, job_id, archive_base, owner)
+        kill_jobs(run_name, job, archive_base, owner)
     else:
         kill_run(run_name, archive_base, owner, machine_type,
                  preserve_queue=preserve_queue)
@@ -75,21 +79,38 @@ def kill_run(run_name, archive_base=None, owner=None, machine_type=None,
 
 
 def kill_job(run_name, job_id, archive_base=None, owner=None, skip_nuke=False):
+    kill_jobs(run_name, [job_id], archive_base, owner, skip_nuke)
+
+
+def kill_jobs(run_name, job_ids, archive_base=None, owner=None,
+              skip_nuke=False):
+    """
+    Kill some of a run's jobs, then look up all of their targets at once to
+    nuke them
+    """
     serializer = report.ResultsSerializer(archive_base)
-    job_info = serializer.job_info(run_name, job_id)
-    if not owner:
-        if 'owner' not in job_info:
-            raise RuntimeError(
-                "I could not figure out the owner of the requested job. "
-                "Please pass --owner <owner>.")
-        owner = job_info['owner']
-    kill_processes(run_name, [job_info.get('pid')])
-    # Because targets can be missing for some cases, for example, when all
-    # the necessary nodes ain't locked yet, we do not use job_info to get them,
-    # but use find_targets():
-    targets = find_targets(run_name, owner, job_id)
-    if not skip_nuke:
-        nuke_targets(targets, owner)
+    jobs_by_owner = dict()
+    for job_id in job_ids:
+        job_info = serializer.job_info(run_name, job_id)
+        job_owner = owner
+        if not job_owner:
+            if 'owner' not in job_info:
+                raise RuntimeError(
+                    "I could not figure out the owner of the requested job. "
+                    "Please pass --owner <owner>.")
+            job_owner = job_info['owner']
+        kill_processes(run_name,
+                       pid_registry.find_pids(run_name, job_id) or
+                       [job_info.get('pid')])
+        jobs_by_owner.setdefault(job_owner, []).append(job_id)
+    if skip_nuke:
+        return
+    for job_owner, owned_job_ids in jobs_by_owner.items():
+        # Because targets can be missing for some cases, for example, when
+        # all the necessary nodes ain't locked yet, we do not use job_info
+        # to get them, but use find_targets():
+        targets = find_targets(run_name, job_owner, job_ids=owned_job_ids)
+        nuke_targets(targets, job_owner)
 
 
 def find_run_info(serializer, run_name):
@@ -135,39 +156,58 @@ def remove_beanstalk_jobs(run_name, tube_name):
         raise RuntimeError(
             'Beanstalk queue information not found in {conf_path}'.format(
                 conf_path=config.yaml_path))
-    log.info("Checking Beanstalk Queue...")
     beanstalk_conn = beanstalk.connect()
-    real_tube_name = beanstalk.watch_tube(beanstalk_conn, tube_name)
-
-    curjobs = beanstalk_conn.stats_tube(real_tube_name)['current-jobs-ready']
-    if curjobs != 0:
-        x = 1
-        while x != curjobs:
-            x += 1
-            job = beanstalk_conn.reserve(timeout=20)
-            if job is None:
-                continue
-            job_config = yaml.safe_load(job.body)
-            if run_name == job_config['name']:
-                job_id = job.stats()['id']
-                msg = "Deleting job from queue. ID: " + \
-                    "{id} Name: {name} Desc: {desc}".format(
-                        id=str(job_id),
-                        name=job_config['name'],
-                        desc=job_config['description'],
-                    )
-                log.info(msg)
-                job.delete()
-    else:
-        print("No jobs in Beanstalk Queue")
-    beanstalk_conn.close()
+    try:
+        real_tube_name = beanstalk.watch_tube(beanstalk_conn, tube_name)
+        beanstalk.walk_jobs(beanstalk_conn, real_tube_name,
+                            BeanstalkJobRemover(), run_name=run_name)
+    finally:
+        beanstalk_conn.close()
+
+
+class BeanstalkJobRemover(beanstalk.JobProcessor):
+    """
+    Delete jobs from the queue; remove_paddles_jobs() takes care of paddles
+    """
+    def process_job(self, job_id):
+        job_config = self.jobs[job_id]['job_config']
+        log.info("Deleting job from queue. ID: %s Name: %s Desc: %s",
+                 job_id, job_config['name'], job_config.get('description'))
+        try:
+            self.jobs[job_id]['job_obj'].delete()
+        except beanstalkc.CommandFailed:
+            log.warning("Job %s is no longer queued", job_id)
+
+
+def registered_pids(run_name):
+    """
+    The dispatcher and supervisors register the processes they start.
+
+    :returns: The PIDs registered for run_name, if every one of the run's
+              running or waiting jobs is registered; otherwise None
+    """
+    pids = pid_registry.find_pids(run_name)
+    if not pids or not config.results_server:
+        return None
+    try:
+        jobs = report.ResultsReporter().get_jobs(run_name, fields=['status'])
+    except (requests.exceptions.RequestException, ValueError):
+        log.warning("Could not get the jobs of %s; looking at every process",
+                    run_name, exc_info=True)
+        return None
+    active = set(str(job['job_id']) for job in jobs
+                 if job.get('status') in ('running', 'waiting'))
+    if not active.issubset(pid_registry.job_ids(run_name)):
+        return None
+    return pids
 
 
 def kill_processes(run_name, pids=None):
-    if pids:
-        to_kill = set(pids).intersection(psutil.pids())
-    else:
-        to_kill = find_pids(run_name)
+    if not pids:
+        pids = registered_pids(run_name)
+        if pids is None:
+            pids = find_pids(run_name)
+    to_kill = set(pid for pid in pids if pid and psutil.pid_exists(pid))
 
     # Remove processes that don't match run-name from the set
     to_check = set(to_kill)
@@ -213,24 +253,33 @@ def find_pids(run_name):
     return run_pids
 
 
-def find_targets(run_name, owner, job_id=None):
-    lock_args = [
-        'teuthology-lock',
-        '--list-targets',
-        '--desc-pattern',
-        '/' + run_name + '/' + str(job_id or ''),
-        '--status',
-        'up',
-        '--owner',
-        owner
-    ]
-    proc = subprocess.Popen(lock_args, stdout=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-    out_obj = yaml.safe_load(stdout)
-    if not out_obj or 'targets' not in out_obj:
-        return {}
+def find_targets(run_name, owner, job_id=None, job_ids=None):
+    """
+    Find the machines owner has locked for run_name; or for only its job_id,
+    or only its job_ids, all with one query.
 
-    return out_obj
+    :returns: {'targets': {name: ssh_pub_key}}, or {} if there are none
+    """
+    if job_id is not None:
+        job_ids = [job_id]
+    # Machines are locked with the job's archive path as their description
+    desc_pattern = '/' + re.escape(run_name) + '/'
+    if job_ids:
+        desc_pattern += '(%s)(/|$)' % '|'.join(
+            re.escape(str(job_id)) for job_id in job_ids)
+    nodes = query.list_locks(desc_pattern=desc_pattern, locked_by=owner,
+                             up=True)
+    if not nodes:
+        return {}
+    # teuthology-lock --list-targets refreshed VMs' host keys; so do we
+    vms = [node['name'] for node in nodes if query.is_vm(status=node)]
+    if vms:
+        log.info("updating host keys for %s", ' '.join(sorted(vms)))
+        keys = misc.ssh_keyscan(vms, _raise=False)
+        ops.push_new_keys(keys, {node['name']: node for node in nodes})
+        for node in nodes:
+            node['ssh_pub_key'] = keys.get(node['name'], node['ssh_pub_key'])
+    return dict(targets={node['name']: node['ssh_pub_key'] for node in nodes})
 
 
 def nuke_targets(targets_dict, owner):
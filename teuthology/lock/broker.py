@@ -0,0 +1,192 @@
+"""
+Take turns polling the lock server for machines
+
+Every process on a host that is blocked waiting for machines of some type
+queues a ticket in a directory below lock_broker_dir. Only the process
+holding the first ticket polls the lock server, so however many processes
+are waiting, the lock server sees one query per interval from the host;
+and machines go, as they are freed, to the most urgent waiter, then to the
+one that has waited longest.
+
+Without a lock_broker_dir, each process polls on its own, as it always has.
+"""
+import errno
+import itertools
+import logging
+import os
+import random
+import time
+
+import psutil
+
+from teuthology.config import config
+from teuthology.util.flock import FileLock
+
+log = logging.getLogger(__name__)
+
+# The priority of waiters whose jobs don't have one; jobs' priorities are
+# well below this
+DEFAULT_PRIORITY = 1000
+
+_ticket_ids = itertools.count()
+
+
+def jittered(seconds):
+    """
+    :returns: seconds, give or take half, so that waiters don't all wake up
+              at once
+    """
+    return seconds * random.uniform(0.5, 1.5)
+
+
+def _holds_ticket(pid, taken):
+    """
+    Whether the process that took a ticket at time taken is still running:
+    pid exists, and isn't a later process that has reused the PID of one
+    that exited without leaving the queue (e.g. because it was killed)
+    """
+    try:
+        return psutil.Process(pid).create_time() <= taken
+    except psutil.NoSuchProcess:
+        return False
+    except psutil.Error:
+        return True
+
+
+def waiter(machine_type, priority=None, block=True):
+    """
+    :returns: A Ticket if block and lock_broker_dir is set; otherwise a Waiter
+    """
+    if block and config.lock_broker_dir:
+        return Ticket(machine_type, priority)
+    return Waiter(machine_type, priority)
+
+
+class Waiter(object):
+    """
+    Waits between polls for the given number of seconds
+    """
+    def __init__(self, machine_type, priority=None):
+        self.machine_type = machine_type
+        if priority is None:
+            priority = DEFAULT_PRIORITY
+        self.priority = int(priority)
+        # How many polls in a row haven't locked everything that's needed
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.leave()
+
+    def turn(self):
+        """
+        Block until it's this waiter's turn to poll the lock server
+        """
+
+    def wait(self, seconds):
+        """
+        A poll didn't lock everything that's needed; wait until the next
+        """
+        self.misses += 1
+        time.sleep(seconds)
+
+    def leave(self):
+        """
+        Stop waiting, letting the next waiter have its turn
+        """
+
+    def reset(self):
+        """
+        A poll locked some machines; stop backing off
+        """
+        self.misses = 0
+
+
+class Ticket(Waiter):
+    """
+    A place in the queue of waiters for machine_type in lock_broker_dir.
+    Waits between polls back off exponentially, from lock_poll_interval up
+    to lock_poll_max_interval, with jitter.
+    """
+    def __init__(self, machine_type, priority=None):
+        super(Ticket, self).__init__(machine_type, priority)
+        self.directory = os.path.join(config.lock_broker_dir, machine_type)
+        self.name = None
+        self.next_poll = 0
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.directory, '.lock')
+
+    def __enter__(self):
+        if not os.path.isdir(self.directory):
+            # Like /tmp, so that every user's processes may queue
+            for path in (config.lock_broker_dir, self.directory):
+                if not os.path.isdir(path):
+                    os.makedirs(path, exist_ok=True)
+                    os.chmod(path, 0o1777)
+        if not os.path.exists(self.lock_path):
+            open(self.lock_path, 'a').close()
+            os.chmod(self.lock_path, 0o666)
+        # Tickets sort by priority, then by when they were taken
+        self.name = '%06d-%017.6f-%d-%d' % (
+            self.priority, time.time(), os.getpid(), next(_ticket_ids))
+        open(os.path.join(self.directory, self.name), 'w').close()
+        log.info("Waiting for %s machines with priority %d",
+                 self.machine_type, self.priority)
+        return self
+
+    def leave(self):
+        if self.name is None:
+            return
+        try:
+            os.remove(os.path.join(self.directory, self.name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.name = None
+
+    def queue(self):
+        """
+        :returns: The names of the tickets in the queue, in turn order,
+                  after removing those of processes that have gone away
+        """
+        tickets = []
+        for name in sorted(os.listdir(self.directory)):
+            try:
+                taken, pid = name.split('-')[1:3]
+                taken, pid = float(taken), int(pid)
+            except ValueError:
+                continue
+            if pid != os.getpid() and not _holds_ticket(pid, taken):
+                log.debug("Removing ticket %s of exited process", name)
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                continue
+            tickets.append(name)
+        return tickets
+
+    def turn(self):
+        while True:
+            with FileLock(self.lock_path):
+                queue = self.queue()
+            if queue and queue[0] == self.name:
+                delay = self.next_poll - time.time()
+                if delay <= 0:
+                    return
+            else:
+                delay = jittered(config.lock_poll_interval)
+            time.sleep(delay)
+
+    def wait(self, seconds):
+        """
+        Back off instead of waiting for the given number of seconds
+        """
+        self.misses += 1
+        interval = min(config.lock_poll_interval * 2 ** (self.misses - 1),
+                       config.lock_poll_max_interval)
+        self.next_poll = time.time() + jittered(interval)
@@ -10,7 +10,7 @@ import teuthology
 import teuthology.parallel
 import teuthology.provision
 from teuthology import misc
-from teuthology.config import set_config_attr
+from teuthology.config import config, set_config_attr
 
 from teuthology.lock import (
     ops,
@@ -79,7 +79,8 @@ def main(ctx):
         # to the CLI (machines), or any owned by the specified owner or
         # invoking user if no machines are specified.
         vmachines = []
-        statuses = query.get_statuses(machines)
+        statuses = query.get_statuses(machines,
+                                      max_age=config.lock_inventory_ttl)
         owner = ctx.owner or misc.get_user()
         for machine in statuses:
             if query.is_vm(status=machine) and machine['locked'] and \
@@ -252,9 +253,10 @@ def main(ctx):
 def do_summary(ctx):
     lockd = collections.defaultdict(lambda: [0, 0, 'unknown'])
     if ctx.machine_type:
-        locks = query.list_locks(machine_type=ctx.machine_type)
+        locks = query.list_locks(machine_type=ctx.machine_type,
+                                 max_age=config.lock_inventory_ttl)
     else:
-        locks = query.list_locks()
+        locks = query.list_locks(max_age=config.lock_inventory_ttl)
     for l in locks:
         who = l['locked_by'] if l['locked'] == 1 \
             else '(free)', l['machine_type']
@@ -0,0 +1,87 @@
+"""
+A snapshot of every node the lock server knows about, kept on local disk so
+that listing and summarizing nodes needn't fetch them all each time
+
+The snapshot names the nodes' fields once, with a row of values per node,
+to keep it small. Nodes whose locks are changed from this host are marked
+stale in it, so that only they need fetching again until the whole
+snapshot is older than the caller allows. Only reads use the snapshot;
+locking and unlocking always go to the lock server.
+"""
+import hashlib
+import os
+
+from teuthology.config import config
+from teuthology.util import cache
+from teuthology.util.flock import FileLock
+
+VERSION = 1
+
+
+def default_path():
+    """
+    A file below the user's cache directory, named for the lock server
+    """
+    server = hashlib.sha1(config.lock_server.encode()).hexdigest()[:12]
+    return cache.cache_dir('lock-inventory-v%d-%s.json' % (VERSION, server))
+
+
+class Inventory(object):
+    """
+    :param path: Where the snapshot is kept; default_path() by default
+    """
+    def __init__(self, path=None):
+        self.path = path or default_path()
+
+    def lock(self):
+        """
+        Hold this while reading the snapshot in order to update it
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return FileLock(self.path + '.lock')
+
+    def read(self):
+        """
+        :returns: A dict with the time the snapshot was fetched, its nodes,
+                  and the names of those that are stale; or None if there
+                  is no usable snapshot
+        """
+        saved = cache.load_json(self.path)
+        if not isinstance(saved, dict) or saved.get('version') != VERSION:
+            return None
+        columns = saved['columns']
+        return dict(
+            fetched=saved['fetched'],
+            nodes=[dict(zip(columns, row)) for row in saved['rows']],
+            stale=set(saved['stale']),
+        )
+
+    def write(self, nodes, fetched, stale=()):
+        columns = sorted(set(key for node in nodes for key in node))
+        return cache.save_json(self.path, dict(
+            version=VERSION,
+            fetched=fetched,
+            columns=columns,
+            rows=[[node.get(column) for column in columns]
+                  for node in nodes],
+            stale=sorted(stale),
+        ))
+
+    def forget(self, name=None):
+        """
+        Mark a node stale, or throw the whole snapshot away if name is None.
+        Like the rest of the cache, failures are ignored.
+        """
+        try:
+            with self.lock():
+                if name is None:
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                    return
+                saved = self.read()
+                if saved is None or name in saved['stale']:
+                    return
+                saved['stale'].add(name)
+                self.write(saved['nodes'], saved['fetched'], saved['stale'])
+        except OSError:
+            pass
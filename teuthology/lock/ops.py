@@ -17,11 +17,17 @@ from teuthology.contextutil import safe_while
 from teuthology.task import console_log
 from teuthology.misc import canonicalize_hostname
 from teuthology.job_status import set_status
+from teuthology.util import http_client
 
-from teuthology.lock import util, query
+from teuthology.lock import broker, util, query
 
 log = logging.getLogger(__name__)
 
+# How many virtual machines to create, or scan for keys, at once
+VM_WORKERS = 10
+# How long a virtual machine has to come up before it is recreated
+VM_BOOT_TIMEOUT = 400
+
 
 def update_nodes(nodes, reset_os=False):
     for node in nodes:
@@ -110,7 +116,7 @@ def lock_many(ctx, num, machine_type, user=None, description=None,
         if arch:
             data['arch'] = arch
         log.debug("lock_many request: %s", repr(data))
-        response = requests.post(
+        response = http_client.post(
             uri,
             data=json.dumps(data),
             headers={'content-type': 'application/json'},
@@ -118,6 +124,7 @@ def lock_many(ctx, num, machine_type, user=None, description=None,
         if response.ok:
             machines = dict()
             for machine in response.json():
+                query.forget_status(machine['name'])
                 key = misc.canonicalize_hostname(
                     machine['name'],
                     user=machine.get('user'),
@@ -126,16 +133,8 @@ def lock_many(ctx, num, machine_type, user=None, description=None,
             log.debug('locked {machines}'.format(
                 machines=', '.join(machines.keys())))
             if machine_type in vm_types:
-                ok_machs = {}
                 update_nodes(machines, True)
-                for machine in machines:
-                    if teuthology.provision.create_if_vm(ctx, machine):
-                        ok_machs[machine] = machines[machine]
-                    else:
-                        log.error('Unable to create virtual machine: %s',
-                                  machine)
-                        unlock_one(ctx, machine, user)
-                    ok_machs = do_update_keys(list(ok_machs.keys()))[1]
+                ok_machs = create_vms(ctx, machines, user)
                 update_nodes(ok_machs)
                 return ok_machs
             elif reimage and machine_type in reimage_types:
@@ -158,7 +157,8 @@ def lock_one(name, user=None, description=None):
     request = dict(name=name, locked=True, locked_by=user,
                    description=description)
     uri = os.path.join(config.lock_server, 'nodes', name, 'lock', '')
-    response = requests.put(uri, json.dumps(request))
+    response = http_client.put(uri, json.dumps(request))
+    query.forget_status(name)
     success = response.ok
     if success:
         log.debug('locked %s as %s', name, user)
@@ -184,12 +184,14 @@ def unlock_many(names, user):
     with safe_while(
             sleep=1, increment=0.5, action=f'unlock_many {names}') as proceed:
         while proceed():
-            response = requests.post(
+            response = http_client.post(
                 uri,
                 data=json.dumps(data),
                 headers={'content-type': 'application/json'},
             )
             if response.ok:
+                for name in names:
+                    query.forget_status(name)
                 log.debug("Unlocked: %s", ', '.join(names))
                 return True
     log.error("Failed to unlock: %s", ', '.join(names))
@@ -208,8 +210,9 @@ def unlock_one(ctx, name, user, description=None):
             sleep=1, increment=0.5, action="unlock %s" % name) as proceed:
         while proceed():
             try:
-                response = requests.put(uri, json.dumps(request))
+                response = http_client.put(uri, json.dumps(request))
                 if response.ok:
+                    query.forget_status(name)
                     log.info('unlocked: %s', name)
                     return response.ok
             # Work around https://github.com/kennethreitz/requests/issues/2364
@@ -240,10 +243,11 @@ def update_lock(name, description=None, status=None, ssh_pub_key=None):
         with safe_while(
                 sleep=1, increment=inc, action=f'update lock {name}') as proceed:
             while proceed():
-                response = requests.put(
+                response = http_client.put(
                     uri,
                     json.dumps(updated))
                 if response.ok:
+                    query.forget_status(name)
                     return True
         return response.ok
     return True
@@ -265,7 +269,7 @@ def update_inventory(node_dict):
     with safe_while(
             sleep=1, increment=inc, action=f'update inventory {name}') as proceed:
         while proceed():
-            response = requests.put(
+            response = http_client.put(
                 uri,
                 json.dumps(node_dict),
                 headers={'content-type': 'application/json'},
@@ -273,7 +277,7 @@ def update_inventory(node_dict):
             if response.status_code == 404:
                 log.info("Creating new node %s on lock server", name)
                 uri = os.path.join(config.lock_server, 'nodes', '')
-                response = requests.post(
+                response = http_client.post(
                     uri,
                     json.dumps(node_dict),
                     headers={'content-type': 'application/json'},
@@ -301,6 +305,79 @@ def push_new_keys(keys_dict, reference):
     return ret
 
 
+def _create_vm(ctx, machine):
+    return machine, teuthology.provision.create_if_vm(ctx, machine)
+
+
+def create_vms(ctx, machines, user):
+    """
+    Create the virtual machines for the nodes in machines, VM_WORKERS at a
+    time, unlocking any that can't be created
+
+    :returns: A dict of the created machines' names to their host keys
+    """
+    created = list()
+    with teuthology.parallel.parallel(size=VM_WORKERS) as p:
+        for machine in machines:
+            p.spawn(_create_vm, ctx, machine)
+        for machine, ok in p:
+            if ok:
+                created.append(machine)
+            else:
+                log.error('Unable to create virtual machine: %s', machine)
+                unlock_one(ctx, machine, user)
+    if not created:
+        return dict()
+    return do_update_keys(created)[1]
+
+
+def _scan_vm(vm):
+    return vm, misc.ssh_keyscan([vm], _raise=False)
+
+
+def _recreate_vm(ctx, vm):
+    log.info('recreating: %s', vm)
+    full_name = misc.canonicalize_hostname(vm)
+    teuthology.provision.destroy_if_vm(ctx, full_name)
+    teuthology.provision.create_if_vm(ctx, full_name)
+
+
+def wait_for_vms(ctx, vms, timeout=VM_BOOT_TIMEOUT, interval=10):
+    """
+    Wait for each of vms to answer ssh-keyscan, recreating any that hasn't
+    within timeout seconds of being created
+
+    :returns: A dict of the host keys of vms
+    """
+    keys_dict = dict()
+    deadlines = dict.fromkeys(vms, time.time() + timeout)
+    while True:
+        waiting = [vm for vm in vms if vm not in keys_dict]
+        with teuthology.parallel.parallel(size=VM_WORKERS) as p:
+            for vm in waiting:
+                p.spawn(_scan_vm, vm)
+            for vm, keys in p:
+                if keys:
+                    keys_dict[vm] = list(keys.values())[0]
+        waiting = [vm for vm in vms if vm not in keys_dict]
+        if not waiting:
+            break
+        log.info('virtual machine(s) still unavailable: %s',
+                 ', '.join(waiting))
+        late = [vm for vm in waiting if time.time() >= deadlines[vm]]
+        if late:
+            log.info('virtual machine(s) still not up, '
+                     'recreating unresponsive ones.')
+            with teuthology.parallel.parallel(size=VM_WORKERS) as p:
+                for vm in late:
+                    p.spawn(_recreate_vm, ctx, vm)
+            for vm in late:
+                deadlines[vm] = time.time() + timeout
+        time.sleep(interval)
+    return {misc.canonicalize_hostname(vm, user=None): key
+            for vm, key in keys_dict.items()}
+
+
 def reimage_machines(ctx, machines, machine_type):
     reimage_types = teuthology.provision.get_reimage_types()
     if machine_type not in reimage_types:
@@ -345,105 +422,98 @@ def block_and_lock_machines(ctx, total_requested, machine_type, reimage=True):
 
     all_locked = dict()
     requested = total_requested
-    while True:
-        # get a candidate list of machines
-        machines = query.list_locks(machine_type=machine_type, up=True,
-                                    locked=False, count=requested + reserved)
-        if machines is None:
-            if ctx.block:
-                log.error('Error listing machines, trying again')
-                time.sleep(20)
-                continue
-            else:
-                raise RuntimeError('Error listing machines')
-
-        # make sure there are machines for non-automated jobs to run
-        if len(machines) < reserved + requested \
-                and ctx.owner.startswith('scheduled'):
-            if ctx.block:
-                log.info(
-                    'waiting for more %s machines to be free (need %s + %s, have %s)...',
-                    machine_type,
-                    reserved,
-                    requested,
-                    len(machines),
-                )
-                time.sleep(10)
-                continue
-            else:
-                assert 0, ('not enough machines free; need %s + %s, have %s' %
-                           (reserved, requested, len(machines)))
+    # Take turns with the other processes here that are waiting for these
+    # machines, if there is a lock broker
+    with broker.waiter(machine_type, ctx.config.get('priority'),
+                       block=ctx.block) as waiter:
+        while True:
+            waiter.turn()
+            # get a candidate list of machines
+            machines = query.list_locks(machine_type=machine_type, up=True,
+                                        locked=False, count=requested + reserved)
+            if machines is None:
+                if ctx.block:
+                    log.error('Error listing machines, trying again')
+                    waiter.wait(20)
+                    continue
+                else:
+                    raise RuntimeError('Error listing machines')
+
+            # make sure there are machines for non-automated jobs to run
+            if len(machines) < reserved + requested \
+                    and ctx.owner.startswith('scheduled'):
+                if ctx.block:
+                    log.info(
+                        'waiting for more %s machines to be free (need %s + %s, have %s)...',
+                        machine_type,
+                        reserved,
+                        requested,
+                        len(machines),
+                    )
+                    waiter.wait(10)
+                    continue
+                else:
+                    assert 0, ('not enough machines free; need %s + %s, have %s' %
+                               (reserved, requested, len(machines)))
 
-        try:
-            newly_locked = lock_many(ctx, requested, machine_type,
-                                     ctx.owner, ctx.archive, os_type,
-                                     os_version, arch, reimage=reimage)
-        except Exception:
-            # Lock failures should map to the 'dead' status instead of 'fail'
-            if 'summary' in ctx:
-                set_status(ctx.summary, 'dead')
-            raise
-        all_locked.update(newly_locked)
-        log.info(
-            '{newly_locked} {mtype} machines locked this try, '
-            '{total_locked}/{total_requested} locked so far'.format(
-                newly_locked=len(newly_locked),
-                mtype=machine_type,
-                total_locked=len(all_locked),
-                total_requested=total_requested,
+            try:
+                newly_locked = lock_many(ctx, requested, machine_type,
+                                         ctx.owner, ctx.archive, os_type,
+                                         os_version, arch, reimage=reimage)
+            except Exception:
+                # Lock failures should map to the 'dead' status instead of 'fail'
+                if 'summary' in ctx:
+                    set_status(ctx.summary, 'dead')
+                raise
+            all_locked.update(newly_locked)
+            if newly_locked:
+                waiter.reset()
+            log.info(
+                '{newly_locked} {mtype} machines locked this try, '
+                '{total_locked}/{total_requested} locked so far'.format(
+                    newly_locked=len(newly_locked),
+                    mtype=machine_type,
+                    total_locked=len(all_locked),
+                    total_requested=total_requested,
+                )
             )
-        )
-        if len(all_locked) == total_requested:
-            vmlist = []
-            for lmach in all_locked:
-                if teuthology.lock.query.is_vm(lmach):
-                    vmlist.append(lmach)
-            if vmlist:
-                log.info('Waiting for virtual machines to come up')
-                keys_dict = dict()
-                loopcount = 0
-                while len(keys_dict) != len(vmlist):
-                    loopcount += 1
-                    time.sleep(10)
-                    keys_dict = misc.ssh_keyscan(vmlist)
-                    log.info('virtual machine is still unavailable')
-                    if loopcount == 40:
-                        loopcount = 0
-                        log.info('virtual machine(s) still not up, ' +
-                                 'recreating unresponsive ones.')
-                        for guest in vmlist:
-                            if guest not in keys_dict.keys():
-                                log.info('recreating: ' + guest)
-                                full_name = misc.canonicalize_hostname(guest)
-                                teuthology.provision.destroy_if_vm(ctx, full_name)
-                                teuthology.provision.create_if_vm(ctx, full_name)
-                if teuthology.lock.ops.do_update_keys(keys_dict)[0]:
-                    log.info("Error in virtual machine keys")
-                newscandict = {}
-                for dkey in all_locked.keys():
-                    stats = teuthology.lock.query.get_status(dkey)
-                    newscandict[dkey] = stats['ssh_pub_key']
-                ctx.config['targets'] = newscandict
+            if len(all_locked) == total_requested:
+                waiter.leave()
+                vmlist = []
+                for lmach in all_locked:
+                    if teuthology.lock.query.is_vm(lmach):
+                        vmlist.append(lmach)
+                if vmlist:
+                    log.info('Waiting for virtual machines to come up')
+                    keys_dict = wait_for_vms(ctx, vmlist)
+                    if push_new_keys(keys_dict,
+                                     query.list_locks(keyed_by_name=True)):
+                        log.info("Error in virtual machine keys")
+                    newscandict = {}
+                    for dkey in all_locked.keys():
+                        stats = teuthology.lock.query.get_status(dkey)
+                        newscandict[dkey] = stats['ssh_pub_key']
+                    ctx.config['targets'] = newscandict
+                else:
+                    ctx.config['targets'] = all_locked
+                locked_targets = yaml.safe_dump(
+                    ctx.config['targets'],
+                    default_flow_style=False
+                ).splitlines()
+                log.info('\n  '.join(['Locked targets:', ] + locked_targets))
+                # successfully locked machines, change status back to running
+                report.try_push_job_info(ctx.config, dict(status='running'))
+                break
+            elif not ctx.block:
+                assert 0, 'not enough machines are available'
             else:
-                ctx.config['targets'] = all_locked
-            locked_targets = yaml.safe_dump(
-                ctx.config['targets'],
-                default_flow_style=False
-            ).splitlines()
-            log.info('\n  '.join(['Locked targets:', ] + locked_targets))
-            # successfully locked machines, change status back to running
-            report.try_push_job_info(ctx.config, dict(status='running'))
-            break
-        elif not ctx.block:
-            assert 0, 'not enough machines are available'
-        else:
-            requested = requested - len(newly_locked)
-            assert requested > 0, "lock_machines: requested counter went" \
-                                  "negative, this shouldn't happen"
+                requested = requested - len(newly_locked)
+                assert requested > 0, "lock_machines: requested counter went" \
+                                      "negative, this shouldn't happen"
 
-        log.info(
-            "{total} machines locked ({new} new); need {more} more".format(
-                total=len(all_locked), new=len(newly_locked), more=requested)
-        )
-        log.warning('Could not lock enough machines, waiting...')
-        time.sleep(10)
+            log.info(
+                "{total} machines locked ({new} new); need {more} more".format(
+                    total=len(all_locked), new=len(newly_locked), more=requested)
+            )
+            log.warning('Could not lock enough machines, waiting...')
+            waiter.wait(10)
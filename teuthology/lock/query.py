@@ -1,44 +1,173 @@
 import logging
 import os
+import re
+import time
 
 import requests
 
 from teuthology import misc
 from teuthology.config import config
 from teuthology.contextutil import safe_while
+from teuthology.lock import inventory
+from teuthology.parallel import parallel
+from teuthology.util import http_client
 from teuthology.util.compat import urlencode
 
 
 log = logging.getLogger(__name__)
 
+# How many seconds callers that pass max_age=STATUS_TTL may reuse a status
+STATUS_TTL = 30
+# Asking for more nodes than this fetches every node in a single request
+BULK_STATUS_THRESHOLD = 10
+# How many single-node requests to make at once otherwise
+STATUS_WORKERS = 10
 
-def get_status(name):
+# Canonical node name -> (time fetched, status)
+_status_cache = dict()
+
+
+def _cache_status(status, now=None):
+    if status and status.get('name'):
+        _status_cache[status['name']] = (now or time.time(), status)
+
+
+def _cached_status(name, max_age):
+    if not max_age:
+        return None
+    cached = _status_cache.get(name)
+    if cached is None or time.time() - cached[0] > max_age:
+        return None
+    return cached[1]
+
+
+def forget_status(name=None):
+    """
+    Drop a node's cached status, or every cached status if name is None.
+    Called whenever we change a node's lock.
+    """
+    if name is None:
+        _status_cache.clear()
+    else:
+        name = misc.canonicalize_hostname(name, user=None)
+        _status_cache.pop(name, None)
+    if config.lock_inventory:
+        inventory.Inventory().forget(name)
+
+
+def get_status(name, max_age=0):
+    """
+    Ask the lock server for a node's status
+
+    :param max_age: If nonzero, a status fetched (by this or any other call
+                    in this process) less than this many seconds ago may be
+                    returned instead
+    """
     name = misc.canonicalize_hostname(name, user=None)
+    cached = _cached_status(name, max_age)
+    if cached is not None:
+        return cached
     uri = os.path.join(config.lock_server, 'nodes', name, '')
     with safe_while(
             sleep=1, increment=0.5, action=f'get_status {name}') as proceed:
         while proceed():
-            response = requests.get(uri)
+            response = http_client.get(uri)
             if response.ok:
-                return response.json()
+                status = response.json()
+                _cache_status(status)
+                return status
     log.warning(
         "Failed to query lock server for status of {name}".format(name=name))
     return dict()
 
 
-def get_statuses(machines):
+def _get_named_status(name):
+    return name, get_status(name)
+
+
+def _get_statuses(names):
+    """
+    Fetch the statuses of the given canonical node names concurrently, one
+    request per node
+
+    :returns: A dict mapping each name the lock server knows to its status
+    """
+    found = dict()
+    with parallel(size=STATUS_WORKERS) as p:
+        for name in names:
+            p.spawn(_get_named_status, name)
+        for name, status in p:
+            if status:
+                found[name] = status
+    return found
+
+
+def get_status_map(machines, max_age=0, machine_type=None):
+    """
+    Look up the statuses of many nodes at once. Small numbers of nodes are
+    fetched with concurrent requests; larger ones with a single request for
+    every node of their machine type. Any node the bulk request doesn't
+    return - e.g. because it failed - is then fetched on its own.
+
+    :param machines:     Node names, in any form canonicalize_hostname()
+                         accepts
+    :param max_age:      As for get_status()
+    :param machine_type: The nodes' machine type(s), used to filter the bulk
+                         request. If None, the type of one of the nodes is
+                         used.
+    :returns:            A dict mapping each of the names given to its
+                         status, or an empty dict if the lock server doesn't
+                         know the node
+    """
+    names = {machine: misc.canonicalize_hostname(machine, user=None)
+             for machine in machines}
+    found = dict()
+    for name in set(names.values()):
+        cached = _cached_status(name, max_age)
+        if cached is not None:
+            found[name] = cached
+    missing = set(names.values()) - set(found)
+    if len(missing) > BULK_STATUS_THRESHOLD:
+        if machine_type is None:
+            name = sorted(missing)[0]
+            status = get_status(name)
+            missing.discard(name)
+            if status:
+                found[name] = status
+                machine_type = status.get('machine_type')
+        if machine_type:
+            now = time.time()
+            for status in list_locks(machine_type=machine_type):
+                _cache_status(status, now)
+                if status.get('name') in missing:
+                    found[status['name']] = status
+                    missing.discard(status['name'])
+            if len(missing) > BULK_STATUS_THRESHOLD:
+                log.warning(
+                    "Bulk status query for %s nodes didn't return %d of "
+                    "them; querying them individually", machine_type,
+                    len(missing))
+    if missing:
+        found.update(_get_statuses(missing))
+    return {machine: found.get(name, dict())
+            for machine, name in names.items()}
+
+
+def get_statuses(machines, max_age=0):
+    """
+    :param max_age: As for get_status(), or for list_locks() if machines is
+                    empty
+    """
     if machines:
         statuses = []
-        for machine in machines:
-            machine = misc.canonicalize_hostname(machine)
-            status = get_status(machine)
+        for machine, status in get_status_map(machines, max_age).items():
             if status:
                 statuses.append(status)
             else:
                 log.error("Lockserver doesn't know about machine: %s" %
-                          machine)
+                          misc.canonicalize_hostname(machine))
     else:
-        statuses = list_locks()
+        statuses = list_locks(max_age=max_age)
     return statuses
 
 
@@ -51,7 +180,27 @@ def is_vm(name=None, status=None):
     return status.get('is_vm', False)
 
 
-def list_locks(keyed_by_name=False, **kwargs):
+def _node_matches(node, filters):
+    """
+    Whether node matches filters as the lock server would
+    """
+    for key, value in filters.items():
+        if key == 'machine_type':
+            if node.get(key) not in value.replace(',', '|').split('|'):
+                return False
+        elif isinstance(value, bool):
+            if bool(node.get(key)) != value:
+                return False
+        elif str(node.get(key)) != str(value):
+            return False
+    return True
+
+
+def _fetch_nodes(**kwargs):
+    """
+    :returns: The nodes the lock server lists for the filters in kwargs, or
+              None if it can't be reached
+    """
     uri = os.path.join(config.lock_server, 'nodes', '')
     for key, value in kwargs.items():
         if kwargs[key] is False:
@@ -66,28 +215,95 @@ def list_locks(keyed_by_name=False, **kwargs):
             sleep=1, increment=0.5, action='list_locks') as proceed:
         while proceed():
             try:
-                response = requests.get(uri)
+                response = http_client.get(uri)
                 if response.ok:
                     break
             except requests.ConnectionError:
                 log.exception("Could not contact lock server: %s, retrying...", config.lock_server)
     if response.ok:
+        return response.json()
+    return None
+
+
+def _inventory_nodes(max_age):
+    """
+    :returns: Every node, from the local inventory snapshot if it was
+              fetched less than max_age seconds ago, after fetching again
+              any nodes marked stale in it; or None if the lock server
+              can't be reached
+    """
+    snapshot = inventory.Inventory()
+    try:
+        with snapshot.lock():
+            saved = snapshot.read()
+            now = time.time()
+            if saved is None or now - saved['fetched'] > max_age:
+                nodes = _fetch_nodes()
+                if nodes is not None:
+                    snapshot.write(nodes, now)
+                return nodes
+            nodes = saved['nodes']
+            if saved['stale']:
+                log.debug("Refreshing %d stale nodes in the inventory",
+                          len(saved['stale']))
+                fresh = _get_statuses(saved['stale'])
+                # Nodes that couldn't be fetched keep their rows, and stay
+                # stale so that they are tried again next time
+                failed = saved['stale'].difference(fresh)
+                nodes = [fresh.pop(node['name'], node) for node in nodes]
+                nodes.extend(fresh.values())
+                snapshot.write(nodes, saved['fetched'], failed)
+            return nodes
+    except OSError:
+        log.warning("Could not use the lock inventory at %s", snapshot.path,
+                    exc_info=True)
+        return _fetch_nodes()
+
+
+def list_locks(keyed_by_name=False, desc_pattern=None, max_age=0, **kwargs):
+    """
+    List the nodes matching kwargs, which the lock server filters on.
+
+    :param desc_pattern: A regular expression; only nodes whose descriptions
+                         it matches (anywhere) are returned. The lock server
+                         can't do this, so it's done here.
+    :param max_age:      If nonzero and lock_inventory is set, the nodes may
+                         be listed from a local snapshot fetched less than
+                         this many seconds ago, and filtered here
+    """
+    if max_age and config.lock_inventory:
+        nodes = _inventory_nodes(max_age)
+        if nodes is not None:
+            count = kwargs.pop('count', None)
+            nodes = [node for node in nodes if _node_matches(node, kwargs)]
+            if count is not None:
+                nodes = nodes[:int(count)]
+    else:
+        nodes = _fetch_nodes(**kwargs)
+    if nodes is not None:
+        if desc_pattern is not None:
+            regex = re.compile(desc_pattern)
+            nodes = [node for node in nodes
+                     if regex.search(node.get('description') or '')]
         if not keyed_by_name:
-            return response.json()
+            return nodes
         else:
-            return {node['name']: node
-                    for node in response.json()}
+            return {node['name']: node for node in nodes}
     return dict()
 
 
-def find_stale_locks(owner=None):
+def find_stale_locks(owner=None, workers=STATUS_WORKERS):
     """
     Return a list of node dicts corresponding to nodes that were locked to run
     a job, but the job is no longer running. The purpose of this is to enable
     us to nuke nodes that were left locked due to e.g. infrastructure failures
     and return them to the pool.
 
-    :param owner: If non-None, return nodes locked by owner. Default is None.
+    The jobs the nodes were locked for are looked up concurrently, once per
+    run; a run with several such jobs is fetched in a single request.
+
+    :param owner:   If non-None, return nodes locked by owner. Default is None.
+    :param workers: How many requests to the results server to make at once
     """
     def might_be_stale(node_dict):
         """
@@ -111,43 +327,79 @@ def find_stale_locks(owner=None):
     nodes = list_locks(locked=True)
     if owner is not None:
         nodes = [node for node in nodes if node['locked_by'] == owner]
-    nodes = filter(might_be_stale, nodes)
+    nodes = list(filter(might_be_stale, nodes))
 
-    def node_job_is_active(node, cache):
-        """
-        Is this node's job active (e.g. running or waiting)?
+    # Which jobs are those, grouped by run?
+    runs = dict()
+    for node in nodes:
+        (name, job_id) = node['description'].split('/')[-2:]
+        runs.setdefault(name, set()).add(job_id)
 
-        :param node:  The node dict as returned from the lock server
-        :param cache: A set() used for caching results
-        :returns:     True or False
-        """
-        description = node['description']
-        if description in cache:
-            return True
-        (name, job_id) = description.split('/')[-2:]
-        url = os.path.join(config.results_server, 'runs', name, 'jobs', job_id,
-                           '')
-        with safe_while(
-                sleep=1, increment=0.5, action='node_is_active') as proceed:
-            while proceed():
-                resp = requests.get(url)
-                if resp.ok:
-                    break
-        if not resp.ok:
-            return False
-        job_info = resp.json()
-        if job_info['status'] in ('running', 'waiting'):
-            cache.add(description)
-            return True
-        return False
+    # (run name, job id) -> whether the job is active (e.g. running or
+    # waiting)
+    active = dict()
+    with parallel(size=workers) as p:
+        for name, job_ids in runs.items():
+            p.spawn(_jobs_active, name, job_ids)
+        for result in p:
+            active.update(result)
 
-    result = list()
     # Here we build the list of of nodes that are locked, for a job (as opposed
     # to being locked manually for random monkeying), where the job is not
     # running
-    active_jobs = set()
+    result = list()
     for node in nodes:
-        if node_job_is_active(node, active_jobs):
+        if active[tuple(node['description'].split('/')[-2:])]:
             continue
         result.append(node)
     return result
+
+
+def _run_exists(name):
+    """
+    :returns: False only if the results server says that the run is gone
+    """
+    url = os.path.join(config.results_server, 'runs', name, '')
+    with safe_while(
+            sleep=1, increment=0.5, action='run_exists') as proceed:
+        while proceed():
+            resp = http_client.get(url)
+            if resp.ok or resp.status_code == 404:
+                return resp.ok
+
+
+def _jobs_active(name, job_ids):
+    """
+    Find out which of a run's jobs are active (e.g. running or waiting).
+    Unless the run itself is gone, jobs the results server doesn't know
+    about are assumed to be active, so that their nodes aren't nuked.
+
+    :returns: A dict mapping (name, job_id) to True or False for each job
+    """
+    if len(job_ids) == 1:
+        (job_id,) = job_ids
+        url = os.path.join(config.results_server, 'runs', name, 'jobs',
+                           job_id, '')
+    else:
+        url = os.path.join(config.results_server, 'runs', name, 'jobs',
+                           '') + '?fields=job_id,status'
+    with safe_while(
+            sleep=1, increment=0.5, action='node_is_active') as proceed:
+        while proceed():
+            resp = http_client.get(url)
+            if resp.ok or resp.status_code == 404:
+                break
+    if not resp.ok and not _run_exists(name):
+        return {(name, job_id): False for job_id in job_ids}
+    statuses = dict()
+    if resp.ok:
+        if len(job_ids) == 1:
+            statuses[job_id] = resp.json()['status']
+        else:
+            for job in resp.json():
+                statuses[str(job['job_id'])] = job['status']
+    return {
+        (name, job_id):
+            statuses.get(job_id, 'running') in ('running', 'waiting')
+        for job_id in job_ids
+    }
@@ -0,0 +1,122 @@
+import os
+
+from unittest.mock import patch
+
+from teuthology.config import config, FakeNamespace
+from teuthology.lock import broker, ops
+
+
+class TestBroker(object):
+    def setup_method(self):
+        self.patcher = patch.multiple(
+            config,
+            lock_poll_interval=10,
+            lock_poll_max_interval=60,
+        )
+        self.patcher.start()
+
+    def teardown_method(self):
+        self.patcher.stop()
+
+    def test_waiter_without_broker(self):
+        with patch.object(config, 'lock_broker_dir', None):
+            assert type(broker.waiter('smithi')) is broker.Waiter
+
+    def test_waiter_not_blocking(self, tmp_path):
+        with patch.object(config, 'lock_broker_dir', str(tmp_path)):
+            assert type(broker.waiter('smithi', block=False)) is \
+                broker.Waiter
+            assert type(broker.waiter('smithi')) is broker.Ticket
+
+    def test_queue_order(self, tmp_path):
+        with patch.object(config, 'lock_broker_dir', str(tmp_path)):
+            with broker.Ticket('smithi', 100) as first, \
+                    broker.Ticket('smithi') as second, \
+                    broker.Ticket('smithi', 50) as third:
+                assert first.queue() == [third.name, first.name, second.name]
+            assert os.listdir(str(tmp_path / 'smithi')) == ['.lock']
+
+    def test_queue_drops_exited(self, tmp_path):
+        with patch.object(config, 'lock_broker_dir', str(tmp_path)):
+            with broker.Ticket('smithi', 100) as ticket:
+                stale = '000001-0000000001.000000-999999-0'
+                open(str(tmp_path / 'smithi' / stale), 'w').close()
+                with patch.object(broker.psutil, 'Process',
+                                  side_effect=broker.psutil.NoSuchProcess(
+                                      999999)):
+                    assert ticket.queue() == [ticket.name]
+                assert not os.path.exists(str(tmp_path / 'smithi' / stale))
+
+    def test_queue_drops_reused_pid(self, tmp_path):
+        # Our parent is running, but started long after this ticket was
+        # taken, so the process that took it must have gone
+        reused = '000001-0000000001.000000-%d-0' % os.getppid()
+        live = '000002-%017.6f-%d-0' % (broker.time.time(), os.getppid())
+        with patch.object(config, 'lock_broker_dir', str(tmp_path)):
+            with broker.Ticket('smithi', 100) as ticket:
+                for name in (reused, live):
+                    open(str(tmp_path / 'smithi' / name), 'w').close()
+                assert ticket.queue() == [live, ticket.name]
+                assert not os.path.exists(str(tmp_path / 'smithi' / reused))
+
+    def test_turn_waits_for_head(self, tmp_path):
+        with patch.object(config, 'lock_broker_dir', str(tmp_path)):
+            with broker.Ticket('smithi', 50) as head, \
+                    broker.Ticket('smithi', 100) as ticket:
+                with patch.object(broker.time, 'sleep',
+                                  side_effect=lambda s: head.leave()) \
+                        as m_sleep:
+                    ticket.turn()
+                assert m_sleep.call_count == 1
+
+    def test_wait_backs_off(self, tmp_path):
+        with patch.object(config, 'lock_broker_dir', str(tmp_path)), \
+                patch.object(broker.random, 'uniform', return_value=1), \
+                patch.object(broker.time, 'time', return_value=1000):
+            with broker.Ticket('smithi') as ticket:
+                polls = list()
+                for _ in range(5):
+                    ticket.wait(10)
+                    polls.append(ticket.next_poll - 1000)
+        assert polls == [10, 20, 40, 60, 60]
+
+    def test_reset(self, tmp_path):
+        with patch.object(config, 'lock_broker_dir', str(tmp_path)), \
+                patch.object(broker.random, 'uniform', return_value=1), \
+                patch.object(broker.time, 'time', return_value=1000):
+            with broker.Ticket('smithi') as ticket:
+                for _ in range(3):
+                    ticket.wait(10)
+                ticket.reset()
+                ticket.wait(10)
+                assert ticket.next_poll == 1010
+
+    @patch('teuthology.lock.ops.report')
+    @patch('teuthology.lock.ops.lock_many')
+    @patch('teuthology.lock.query.list_locks')
+    def test_block_and_lock_machines(self, m_list_locks, m_lock_many,
+                                     m_report, tmp_path):
+        names = ['smithi001.front.sepia.ceph.com',
+                 'smithi002.front.sepia.ceph.com']
+        m_list_locks.side_effect = [None, [dict(name=n) for n in names]]
+        m_lock_many.return_value = {name: 'key' for name in names}
+        ctx = FakeNamespace(dict(
+            block=True, owner='scheduled_user', archive=None,
+            config=dict(priority=50)))
+        clock = [1000.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        with patch.multiple(config, lock_broker_dir=str(tmp_path),
+                            reserve_machines=0), \
+                patch.object(broker.time, 'time', lambda: clock[0]), \
+                patch.object(broker.time, 'sleep', side_effect=sleep) \
+                as m_sleep, \
+                patch('teuthology.lock.query.is_vm', return_value=False):
+            ops.block_and_lock_machines(ctx, 2, 'smithi')
+        assert ctx.config['targets'] == m_lock_many.return_value
+        # The failed listing was retried after a backoff, not a fixed sleep
+        assert m_sleep.call_count == 1
+        assert 5 <= m_sleep.call_args[0][0] <= 15
+        assert os.listdir(str(tmp_path / 'smithi')) == ['.lock']
@@ -1,7 +1,302 @@
+import gevent
+import os
+import time
+
+from unittest.mock import Mock, patch
+
+import teuthology.lock.query
 import teuthology.lock.util
 
+from teuthology.config import config
+from teuthology.lock import inventory, ops, query
+
+
+def make_status(shortname):
+    return dict(name='%s.front.sepia.ceph.com' % shortname, locked=True,
+                up=True, description='/run/1', machine_type='smithi')
+
+
 class TestLock(object):
 
     def test_locked_since_seconds(self):
         node = { "locked_since": "2013-02-07 19:33:55.000000" }
         assert teuthology.lock.util.locked_since_seconds(node) > 3600
+
+
+class TestQuery(object):
+    def setup_method(self):
+        query.forget_status()
+
+    def teardown_method(self):
+        query.forget_status()
+
+    def fake_get(self, shortnames):
+        statuses = {s['name']: s for s in map(make_status, shortnames)}
+
+        def get(name, max_age=0):
+            name = teuthology.misc.canonicalize_hostname(name, user=None)
+            status = statuses.get(name, dict())
+            query._cache_status(status)
+            return status
+        return get
+
+    @patch('teuthology.lock.query.list_locks')
+    def test_get_status_map_few(self, m_list_locks):
+        with patch.object(query, 'get_status',
+                          side_effect=self.fake_get(['node1', 'node2'])) \
+                as m_get_status:
+            statuses = query.get_status_map(
+                ['ubuntu@node1.front.sepia.ceph.com', 'node2', 'node3'])
+        assert m_get_status.call_count == 3
+        m_list_locks.assert_not_called()
+        assert statuses == {
+            'ubuntu@node1.front.sepia.ceph.com': make_status('node1'),
+            'node2': make_status('node2'),
+            'node3': dict(),
+        }
+
+    @patch('teuthology.lock.query.get_status')
+    @patch('teuthology.lock.query.list_locks')
+    def test_get_status_map_many(self, m_list_locks, m_get_status):
+        shortnames = ['node%d' % i for i in range(50)]
+        m_list_locks.return_value = [make_status(s) for s in shortnames]
+        statuses = query.get_status_map(shortnames[:20],
+                                        machine_type='smithi')
+        m_list_locks.assert_called_once_with(machine_type='smithi')
+        m_get_status.assert_not_called()
+        assert list(statuses.values()) == \
+            [make_status(s) for s in shortnames[:20]]
+        # Every node fetched is cached, not just those asked for
+        statuses = query.get_statuses(shortnames[20:],
+                                      max_age=query.STATUS_TTL)
+        assert m_list_locks.call_count == 1
+        assert statuses == [make_status(s) for s in shortnames[20:]]
+
+    @patch('teuthology.lock.query.list_locks')
+    def test_get_status_map_many_machine_type(self, m_list_locks):
+        shortnames = ['node%d' % i for i in range(20)]
+        m_list_locks.return_value = [make_status(s) for s in shortnames]
+        with patch.object(query, 'get_status',
+                          side_effect=self.fake_get(shortnames)) \
+                as m_get_status:
+            statuses = query.get_status_map(shortnames)
+        # One node is fetched to find out which machine type to ask for
+        assert m_get_status.call_count == 1
+        m_list_locks.assert_called_once_with(machine_type='smithi')
+        assert list(statuses.values()) == \
+            [make_status(s) for s in shortnames]
+
+    @patch('teuthology.lock.query.list_locks')
+    def test_get_status_map_many_bulk_fails(self, m_list_locks):
+        shortnames = ['node%d' % i for i in range(20)]
+        m_list_locks.return_value = dict()
+        with patch.object(query, 'get_status',
+                          side_effect=self.fake_get(shortnames[:-1])) \
+                as m_get_status:
+            statuses = query.get_status_map(shortnames,
+                                            machine_type='smithi')
+        assert m_list_locks.call_count == 1
+        assert m_get_status.call_count == 20
+        assert list(statuses.values()) == \
+            [make_status(s) for s in shortnames[:-1]] + [dict()]
+
+    @patch('teuthology.util.http_client.get')
+    def test_get_status_cache(self, m_get):
+        m_get.return_value.ok = True
+        m_get.return_value.json.return_value = make_status('node1')
+        assert query.get_status('node1') == make_status('node1')
+        assert query.get_status('node1', max_age=query.STATUS_TTL) == \
+            make_status('node1')
+        assert m_get.call_count == 1
+        query.get_status('node1')
+        assert m_get.call_count == 2
+        query.forget_status('ubuntu@node1.front.sepia.ceph.com')
+        query.get_status('node1', max_age=query.STATUS_TTL)
+        assert m_get.call_count == 3
+
+    @patch('teuthology.util.http_client.get')
+    def test_list_locks_desc_pattern(self, m_get):
+        m_get.return_value.ok = True
+        m_get.return_value.json.return_value = [
+            dict(make_status('node1'), description='/archive/run1/1'),
+            dict(make_status('node2'), description='/archive/run1/10'),
+            dict(make_status('node3'), description=None),
+        ]
+        nodes = query.list_locks(keyed_by_name=True, desc_pattern='/run1/1$',
+                                 locked_by='me')
+        assert list(nodes) == ['node1.front.sepia.ceph.com']
+        assert m_get.call_args[0][0].endswith('/nodes/?locked_by=me')
+
+    @patch('teuthology.util.http_client.get')
+    @patch('teuthology.lock.query.list_locks')
+    def test_find_stale_locks(self, m_list_locks, m_get):
+        def node(shortname, description, locked_by='me'):
+            return dict(make_status(shortname), description=description,
+                        locked_by=locked_by)
+        m_list_locks.return_value = [
+            node('node1', '/archive/run1/1'),
+            node('node2', '/archive/run1/1'),
+            node('node3', '/archive/run1/2'),
+            node('node4', '/archive/run2/3'),
+            node('node5', '/archive/run3/4'),
+            node('node6', 'manual'),
+            node('node7', '/archive/run2/3', locked_by='other'),
+            node('node8', '/archive/run1/5'),
+            node('node9', '/archive/run4/6'),
+        ]
+        responses = {
+            'run1/jobs/?fields=job_id,status': (200, [
+                dict(job_id='1', status='running'),
+                dict(job_id='2', status='dead'),
+            ]),
+            'run2/jobs/3/': (200, dict(job_id='3', status='pass')),
+            'run3/jobs/4/': (404, None),
+            'run3/': (404, None),
+            # Not reported yet, perhaps
+            'run4/jobs/6/': (404, None),
+            'run4/': (200, dict(name='run4')),
+        }
+
+        def get(url):
+            status_code, body = responses[url.split('/runs/')[-1]]
+            response = Mock(ok=status_code == 200, status_code=status_code)
+            response.json.return_value = body
+            return response
+        m_get.side_effect = get
+        stale = query.find_stale_locks(owner='me')
+        assert m_get.call_count == 6
+        # Only jobs that are known to have finished, or whose runs are
+        # gone, are stale; node8's job is missing from its run's listing
+        assert [n['name'].split('.')[0] for n in stale] == \
+            ['node3', 'node4', 'node5']
+
+
+class TestInventory(object):
+    def setup_method(self):
+        query.forget_status()
+
+    def teardown_method(self):
+        query.forget_status()
+
+    def fake_get(self, nodes):
+        def get(uri):
+            response = Mock(ok=True)
+            name = uri.rstrip('/').split('/')[-1]
+            if name == 'nodes':
+                response.json.return_value = list(nodes.values())
+            else:
+                response.json.return_value = nodes[name]
+            return response
+        return get
+
+    @patch('teuthology.util.http_client.get')
+    def test_list_locks_max_age(self, m_get, tmp_path):
+        nodes = {s['name']: s for s in map(make_status, ['node1', 'node2'])}
+        nodes['node2.front.sepia.ceph.com']['machine_type'] = 'mira'
+        m_get.side_effect = self.fake_get(nodes)
+        with patch.dict(os.environ, XDG_CACHE_HOME=str(tmp_path)), \
+                patch.object(config, 'lock_inventory', True):
+            assert len(query.list_locks(max_age=60)) == 2
+            assert m_get.call_count == 1
+            # Filtered here, without asking the lock server again
+            mira = query.list_locks(machine_type='mira', max_age=60)
+            assert [n['name'] for n in mira] == ['node2.front.sepia.ceph.com']
+            assert query.list_locks(locked=False, max_age=60) == []
+            assert m_get.call_count == 1
+            # Only the node that changed is fetched again
+            nodes['node1.front.sepia.ceph.com']['locked'] = False
+            query.forget_status('node1')
+            unlocked = query.list_locks(locked=False, max_age=60)
+            assert [n['name'] for n in unlocked] == \
+                ['node1.front.sepia.ceph.com']
+            assert m_get.call_count == 2
+            assert m_get.call_args[0][0].endswith(
+                '/nodes/node1.front.sepia.ceph.com/')
+            # Without max_age, the lock server is always asked
+            query.list_locks()
+            assert m_get.call_count == 3
+
+    @patch('teuthology.util.http_client.get')
+    def test_list_locks_refetch_fails(self, m_get, tmp_path):
+        nodes = {s['name']: s for s in map(make_status, ['node1', 'node2'])}
+        m_get.side_effect = self.fake_get(nodes)
+        with patch.dict(os.environ, XDG_CACHE_HOME=str(tmp_path)), \
+                patch.object(config, 'lock_inventory', True):
+            query.list_locks(max_age=60)
+            query.forget_status('node1')
+            with patch.object(query, 'get_status', return_value=dict()):
+                listed = query.list_locks(max_age=60)
+            # The old row is kept, until node1 can be fetched again
+            assert len(listed) == 2
+            saved = inventory.Inventory().read()
+            assert saved['stale'] == {'node1.front.sepia.ceph.com'}
+            query.list_locks(max_age=60)
+            assert inventory.Inventory().read()['stale'] == set()
+        assert m_get.call_count == 2
+
+    @patch('teuthology.util.http_client.get')
+    def test_list_locks_expired(self, m_get, tmp_path):
+        nodes = {s['name']: s for s in map(make_status, ['node1'])}
+        m_get.side_effect = self.fake_get(nodes)
+        with patch.dict(os.environ, XDG_CACHE_HOME=str(tmp_path)), \
+                patch.object(config, 'lock_inventory', True), \
+                patch.object(query.time, 'time', return_value=1000):
+            query.list_locks(max_age=60)
+            query.time.time.return_value = 1061
+            query.list_locks(max_age=60)
+        assert m_get.call_count == 2
+
+    def test_list_locks_disabled(self, tmp_path):
+        with patch.dict(os.environ, XDG_CACHE_HOME=str(tmp_path)), \
+                patch.object(config, 'lock_inventory', False), \
+                patch.object(query, '_fetch_nodes', return_value=[]) \
+                as m_fetch_nodes:
+            query.list_locks(max_age=60)
+            query.list_locks(max_age=60)
+        assert m_fetch_nodes.call_count == 2
+        assert not os.listdir(str(tmp_path))
+
+
+class TestVMs(object):
+    names = ['ubuntu@vpm%03d.front.sepia.ceph.com' % i for i in range(1, 5)]
+
+    @patch('teuthology.lock.ops.unlock_one')
+    @patch('teuthology.lock.ops.do_update_keys')
+    @patch('teuthology.provision.create_if_vm')
+    def test_create_vms(self, m_create_if_vm, m_do_update_keys,
+                        m_unlock_one):
+        def create_if_vm(ctx, machine):
+            gevent.sleep(0.2)
+            return machine != self.names[-1]
+        m_create_if_vm.side_effect = create_if_vm
+        m_do_update_keys.return_value = (0, dict(keys=True))
+        start = time.time()
+        created = ops.create_vms(None, dict.fromkeys(self.names), 'user')
+        # They were created at the same time, not one after the other
+        assert time.time() - start < 0.6
+        assert created == dict(keys=True)
+        assert sorted(m_do_update_keys.call_args[0][0]) == self.names[:-1]
+        m_unlock_one.assert_called_once_with(None, self.names[-1], 'user')
+
+    @patch('teuthology.lock.ops.time.sleep')
+    @patch('teuthology.provision.destroy_if_vm')
+    @patch('teuthology.provision.create_if_vm')
+    @patch('teuthology.misc.ssh_keyscan')
+    def test_wait_for_vms(self, m_ssh_keyscan, m_create_if_vm,
+                          m_destroy_if_vm, m_sleep):
+        slow = self.names[-1]
+        recreated = list()
+
+        def ssh_keyscan(hostnames, _raise=True):
+            name = hostnames[0]
+            if name == slow and not recreated:
+                return dict()
+            return {name.split('@')[1]: 'key'}
+        m_ssh_keyscan.side_effect = ssh_keyscan
+        m_create_if_vm.side_effect = lambda ctx, name: recreated.append(name)
+        keys = ops.wait_for_vms(None, self.names, timeout=0)
+        assert keys == {name.split('@')[1]: 'key' for name in self.names}
+        # Only the machine that didn't come up was recreated
+        m_destroy_if_vm.assert_called_once_with(None, slow)
+        assert recreated == [slow]
+        assert m_sleep.call_count == 1
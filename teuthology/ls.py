@@ -1,32 +1,48 @@
 from __future__ import print_function
 
+import logging
 import os
+import sqlite3
 import yaml
 import errno
 import re
 
+import gevent.threadpool
+
+from teuthology import archive_index
 from teuthology.job_status import get_status
+from teuthology.util import cache, seekable_log
+
+log = logging.getLogger(__name__)
+
+# The C loader is many times faster than the pure Python one
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 
 def main(args):
     return ls(args["<archive_dir>"], args["--verbose"])
 
 
-def ls(archive_dir, verbose):
-    for j in get_jobs(archive_dir):
+def ls(archive_dir, verbose, workers=16):
+    """
+    Print a line for each job in a run's archive directory, in job order.
+    Jobs are read by a pool of threads, since on network filesystems the
+    time is mostly spent waiting for reads. Without the archive index,
+    finished jobs' summaries are cached locally, and only re-read when they
+    change.
+
+    :param workers: How many threads to read jobs with
+    """
+    jobs = get_summaries(archive_dir)
+    if jobs is None:
+        jobs = read_summaries(archive_dir, workers)
+    for j, summary in jobs:
+        if isinstance(summary, Exception):
+            raise summary
         job_dir = os.path.join(archive_dir, j)
-        summary = {}
-        try:
-            with open(os.path.join(job_dir, 'summary.yaml')) as f:
-                g = yaml.safe_load_all(f)
-                for new in g:
-                    summary.update(new)
-        except IOError as e:
-            if e.errno == errno.ENOENT:
-                print_debug_info(j, job_dir, archive_dir)
-                continue
-            else:
-                raise
+        if summary is None:
+            print_debug_info(j, job_dir, archive_dir)
+            continue
 
         print("{job} {status} {owner} {desc} {duration}s".format(
             job=j,
@@ -39,16 +55,109 @@ def ls(archive_dir, verbose):
             print('    {reason}'.format(reason=summary['failure_reason']))
 
 
-def get_jobs(archive_dir):
-    dir_contents = os.listdir(archive_dir)
+def read_summary(job_dir):
+    """
+    Read a job's summary.yaml
 
-    def is_job_dir(parent, subdir):
-        if (os.path.isdir(os.path.join(parent, subdir)) and re.match(r'\d+$',
-                                                                     subdir)):
-            return True
-        return False
+    :returns: A tuple of the job's id and either its summary, None if it has
+              no summary yet, or the exception raised reading it
+    """
+    job = os.path.basename(job_dir)
+    summary = {}
+    try:
+        with open(os.path.join(job_dir, 'summary.yaml')) as f:
+            for new in yaml.load_all(f, Loader=SafeLoader):
+                summary.update(new)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return job, None
+        return job, e
+    except Exception as e:
+        return job, e
+    return job, summary
+
+
+def read_summaries(archive_dir, workers=16):
+    """
+    Read the summaries of a run's jobs, reusing those in the run's summary
+    cache whose summary.yaml hasn't changed since
+
+    :returns: A list like read_summary() would return for each job
+    """
+    cache_path = cache.cache_dir(
+        'ls', cache.path_key(archive_dir) + '.json')
+    cached = cache.load_json(cache_path)
+    if not isinstance(cached, dict):
+        cached = dict()
+
+    def read(job):
+        job_dir = os.path.join(archive_dir, job)
+        try:
+            mtime = os.stat(os.path.join(job_dir, 'summary.yaml')).st_mtime
+        except OSError:
+            mtime = None
+        entry = cached.get(job)
+        if mtime is not None and entry and entry[0] == mtime:
+            return job, entry[1], mtime
+        return read_summary(job_dir) + (mtime,)
 
-    jobs = [job for job in dir_contents if is_job_dir(archive_dir, job)]
+    pool = gevent.threadpool.ThreadPool(workers)
+    try:
+        results = list(pool.imap(read, get_jobs(archive_dir)))
+    finally:
+        pool.kill()
+    new_cache = dict(
+        (job, (mtime, summary)) for job, summary, mtime in results
+        if isinstance(summary, dict) and mtime is not None)
+    if new_cache != cached:
+        cache.save_json(cache_path, new_cache)
+    return [(job, summary) for job, summary, mtime in results]
+
+
+def get_summaries(archive_dir):
+    """
+    Look the run's jobs up in the archive index, if there is one
+
+    :returns: A list like read_summary() would return for each job, or None
+              if there is no index or it can't be read
+    """
+    archive_dir = os.path.abspath(archive_dir)
+    try:
+        return _get_summaries(archive_dir)
+    except (OSError, sqlite3.Error) as e:
+        log.warning("Could not read the archive index; listing %s: %s",
+                    archive_dir, e)
+        return None
+
+
+def _get_summaries(archive_dir):
+    index = archive_index.get_index(os.path.dirname(archive_dir))
+    if index is None:
+        return None
+    jobs = list()
+    try:
+        for job in sorted(index.jobs(os.path.basename(archive_dir)),
+                          key=lambda job: job['job_id']):
+            if not job['finished']:
+                jobs.append((job['job_id'], None))
+                continue
+            summary = dict(
+                status=job['status'],
+                owner=job['owner'] or '-',
+                description=job['description'] or '-',
+                duration=job['duration'] or 0,
+            )
+            if job['failure_reason'] is not None:
+                summary['failure_reason'] = job['failure_reason']
+            jobs.append((job['job_id'], summary))
+    finally:
+        index.close()
+    return jobs
+
+
+def get_jobs(archive_dir):
+    jobs = [entry.name for entry in os.scandir(archive_dir)
+            if re.match(r'\d+$', entry.name) and entry.is_dir()]
     return sorted(jobs)
 
 
@@ -56,12 +165,11 @@ def print_debug_info(job, job_dir, archive_dir):
     print('%s      ' % job, end='')
 
     try:
-        log_path = os.path.join(archive_dir, job, 'teuthology.log')
-        if os.path.exists(log_path):
-            tail = os.popen(
-                'tail -1 %s' % log_path
-            ).read().rstrip()
-            print(tail, end='')
+        log_path = seekable_log.find_log(
+            os.path.join(archive_dir, job, 'teuthology.log'))
+        if log_path is not None:
+            lines = seekable_log.tail(log_path)
+            print(lines[-1].decode(errors='replace') if lines else '', end='')
         else:
             print('<no teuthology.log yet>', end='')
     except IOError:
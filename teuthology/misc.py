@@ -22,6 +22,11 @@ from types import MappingProxyType
 
 from tarfile import ReadError
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from teuthology.util.compat import urljoin, urlopen, HTTPError
 
 from netaddr.strategy.ipv4 import valid_str as _is_ipv4
@@ -572,41 +577,19 @@ def move_file(remote, from_path, to_path, sudo=False, preserve_perms=True):
     source file (from_path) and the permissions of to_path are preserved. If
     preserve_perms is false, to_path does not need to exist, and is simply
     clobbered if it does.
-    """
-    if preserve_perms:
-        args = []
-        if sudo:
-            args.append('sudo')
-        args.extend([
-            'stat',
-            '-c',
-            '\"%a\"',
-            to_path
-        ])
-        perms = remote.sh(args).rstrip().strip('\"')
-
-    args = []
-    if sudo:
-        args.append('sudo')
-    args.extend([
-        'mv',
-        '--',
-        from_path,
-        to_path,
-    ])
-    remote.sh(args)
 
+    This runs a single remote command, and is recorded if a batch is active
+    on the remote (see Remote.batch()).
+    """
+    sudo_ = 'sudo ' if sudo else ''
+    args = '{sudo}mv -- {src} {dst}'.format(
+        sudo=sudo_, src=run.quote([from_path]), dst=run.quote([to_path]))
     if preserve_perms:
         # reset the file back to the original permissions
-        args = []
-        if sudo:
-            args.append('sudo')
-        args.extend([
-            'chmod',
-            perms,
-            to_path,
-        ])
-        remote.sh(args)
+        args = ('perms=$({sudo}stat -c %a {dst}) && {mv} && '
+                '{sudo}chmod "$perms" {dst}').format(
+            sudo=sudo_, dst=run.quote([to_path]), mv=args)
+    remote.run_or_batch(args)
 
 
 def delete_file(remote, path, sudo=False, force=False, check=True):
@@ -624,7 +607,7 @@ def delete_file(remote, path, sudo=False, force=False, check=True):
         '--',
         path,
     ])
-    remote.sh(args, check_status=check)
+    remote.run_or_batch(args, check_status=check)
 
 
 def remove_lines_from_file(remote, path, line_is_valid_test,
@@ -653,16 +636,17 @@ def remove_lines_from_file(remote, path, line_is_valid_test,
         else:
             log.info('removing line: {bad_line}'.format(bad_line=line))
 
-    # get a temp file path on the remote host to write to,
-    # we don't want to blow away the remote file and then have the
-    # network drop out
-    temp_file_path = remote.mktemp()
+    with remote.batch():
+        # get a temp file path on the remote host to write to,
+        # we don't want to blow away the remote file and then have the
+        # network drop out
+        temp_file_path = remote.mktemp()
 
-    # write out the data to a temp file
-    write_file(remote, temp_file_path, out_data)
+        # write out the data to a temp file
+        write_file(remote, temp_file_path, out_data)
 
-    # then do a 'mv' to the actual file location
-    move_file(remote, temp_file_path, path)
+        # then do a 'mv' to the actual file location
+        move_file(remote, temp_file_path, path)
 
 
 def append_lines_to_file(remote, path, lines, sudo=False):
@@ -678,10 +662,11 @@ def prepend_lines_to_file(remote, path, lines, sudo=False):
     Remove_lines_from_list.
     """
 
-    temp_file_path = remote.mktemp()
-    remote.write_file(temp_file_path, lines)
-    remote.copy_file(path, temp_file_path, append=True, sudo=sudo)
-    remote.move_file(temp_file_path, path, sudo=sudo)
+    with remote.batch():
+        temp_file_path = remote.mktemp()
+        remote.write_file(temp_file_path, lines)
+        remote.copy_file(path, temp_file_path, append=True, sudo=sudo)
+        remote.move_file(temp_file_path, path, sudo=sudo)
 
 
 def create_file(remote, path, data="", permissions=str(644), sudo=False):
@@ -704,10 +689,11 @@ def create_file(remote, path, data="", permissions=str(644), sudo=False):
         '--',
         path
     ])
-    remote.sh(args)
-    # now write out the data if any was passed in
-    if "" != data:
-        append_lines_to_file(remote, path, data, sudo)
+    with remote.batch():
+        remote.run_or_batch(args)
+        # now write out the data if any was passed in
+        if "" != data:
+            append_lines_to_file(remote, path, data, sudo)
 
 
 def get_file(remote, path, sudo=False, dest_dir='/tmp'):
@@ -727,7 +713,34 @@ def copy_fileobj(src, tarinfo, local_path):
         shutil.copyfileobj(src, dest)
 
 
-def pull_directory(remote, remotedir, localdir, write_to=copy_fileobj):
+# Compressors usable for remote archive streams, in order of preference.
+# pigz produces gzip streams, so it only needs to be present on the remote.
+ARCHIVE_CODECS = ('zstd', 'pigz', 'gzip')
+
+
+def get_archive_codecs():
+    """
+    Return the archive codecs that can be decompressed locally, in order of
+    preference. zstd requires the optional ``zstandard`` module.
+    """
+    return [codec for codec in ARCHIVE_CODECS
+            if codec != 'zstd' or zstandard is not None]
+
+
+def open_tar_stream(fileobj, codec='gzip'):
+    """
+    Open a streamed tar archive compressed with codec for reading.
+    """
+    if codec == 'zstd':
+        # Like gzip, zstd streams may be a series of concatenated frames
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True)
+        return tarfile.open(mode='r|', fileobj=reader)
+    return tarfile.open(mode='r|gz', fileobj=fileobj)
+
+
+def pull_directory(remote, remotedir, localdir, write_to=copy_fileobj,
+                   codec=None):
     """
     Copy a remote directory to a local directory.
 
@@ -740,13 +753,18 @@ def pull_directory(remote, remotedir, localdir, write_to=copy_fileobj):
                      func(src: fileobj,
                           tarinfo: tarfile.TarInfo,
                           local_path: str)
-    """
-    log.debug('Transferring archived files from %s:%s to %s',
-              remote.shortname, remotedir, localdir)
+    :param codec: the compressor used for the stream; one of ARCHIVE_CODECS.
+                  By default the best codec supported by both ends is used.
+    :raises: CommandFailedError if the remote end fails to archive remotedir
+    """
+    if codec is None:
+        codec = remote.choose_archive_codec(get_archive_codecs())
+    log.debug('Transferring archived files from %s:%s to %s using %s',
+              remote.shortname, remotedir, localdir, codec)
     if not os.path.exists(localdir):
         os.mkdir(localdir)
-    r = remote.get_tar_stream(remotedir, sudo=True)
-    tar = tarfile.open(mode='r|gz', fileobj=r.stdout)
+    r = remote.get_tar_stream(remotedir, sudo=True, codec=codec)
+    tar = open_tar_stream(r.stdout, codec)
     while True:
         ti = tar.next()
         if ti is None:
@@ -771,6 +789,8 @@ def pull_directory(remote, remotedir, localdir, write_to=copy_fileobj):
             else:
                 type_ = 'unknown'
             log.info('Ignoring tar entry: %r type %r', ti.name, type_)
+    # Raise if tar failed, e.g. because it couldn't read the whole directory
+    r.wait()
 
 
 def pull_directory_tarball(remote, remotedir, localfile):
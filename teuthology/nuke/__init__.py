@@ -4,22 +4,20 @@ import json
 import logging
 import os
 import subprocess
+import time
 
 import yaml
 
+from gevent.lock import BoundedSemaphore
+
 import teuthology
 from teuthology import provision
 from teuthology.lock.ops import unlock_one
 from teuthology.lock.query import is_vm, list_locks, \
-    find_stale_locks, get_status
+    find_stale_locks, get_status, get_status_map, STATUS_TTL
 from teuthology.lock.util import locked_since_seconds
 from teuthology.nuke.actions import (
-    check_console, clear_firewall, shutdown_daemons, remove_installed_packages,
-    reboot, remove_osd_mounts, remove_osd_tmpfs, kill_hadoop,
-    remove_ceph_packages, synch_clocks, unlock_firmware_repo,
-    remove_configuration_files, undo_multipath, reset_syslog_dir,
-    remove_ceph_data, remove_testing_tree, remove_yum_timedhosts,
-    kill_valgrind,
+    check_console, cleanup, remove_installed_packages, reboot,
 )
 from teuthology.config import config, FakeNamespace
 from teuthology.misc import (
@@ -232,17 +230,63 @@ def main(args):
         else:
             subprocess.check_call(["kill", "-9", str(ctx.pid)])
 
-    nuke(ctx, ctx.unlock, ctx.synch_clocks, ctx.noipmi, ctx.keep_logs, not ctx.no_reboot)
+    nuke(ctx, ctx.unlock, ctx.synch_clocks, ctx.noipmi, ctx.keep_logs,
+         not ctx.no_reboot, workers=ctx.workers and int(ctx.workers),
+         retries=ctx.retries and int(ctx.retries), progress=ctx.progress)
+
+
+def read_progress(path):
+    """
+    :returns: The set of targets a previous nuke() recorded as nuked in the
+              progress file at path
+    """
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def record_progress(path, target):
+    with open(path, 'a') as f:
+        f.write(target + '\n')
 
 
-def nuke(ctx, should_unlock, sync_clocks=True, noipmi=False, keep_logs=False, should_reboot=True):
+def nuke(ctx, should_unlock, sync_clocks=True, noipmi=False, keep_logs=False,
+         should_reboot=True, workers=None, retries=None, progress=None):
+    """
+    Nuke ctx.config['targets'], config.nuke_workers (or workers) at a time,
+    with at most config.nuke_ipmi_workers of them using their consoles at
+    once.
+
+    :param retries:  How many more times to try a target whose nuke failed,
+                     waiting config.nuke_backoff * 2 ** n seconds between
+                     tries. Defaults to config.nuke_retries.
+    :param progress: A file in which to record each target once it has been
+                     nuked. Targets already recorded there are skipped, so
+                     that an interrupted nuke can be resumed; it is removed
+                     once every target has been nuked.
+    """
     if 'targets' not in ctx.config:
         return
+    if workers is None:
+        workers = config.nuke_workers
+    if retries is None:
+        retries = config.nuke_retries
+    ipmi_slots = BoundedSemaphore(config.nuke_ipmi_workers)
+    done = read_progress(progress)
+    if done:
+        log.info('Skipping %d targets already nuked according to %s',
+                 len(done), progress)
     total_unnuked = {}
     log.info('Checking targets against current locks')
-    with parallel() as p:
+    statuses = get_status_map(ctx.config['targets'].keys(),
+                              max_age=STATUS_TTL,
+                              machine_type=ctx.config.get('machine_type'))
+    with parallel(size=workers) as p:
         for target, hostkey in ctx.config['targets'].items():
-            status = get_status(target)
+            if target in done:
+                continue
+            status = statuses[target]
             if ctx.name and ctx.name not in status.get('description', ""):
                 total_unnuked[target] = hostkey
                 log.info(
@@ -264,10 +308,15 @@ def nuke(ctx, should_unlock, sync_clocks=True, noipmi=False, keep_logs=False, sh
                 noipmi,
                 keep_logs,
                 should_reboot,
+                retries=retries,
+                ipmi_slots=ipmi_slots,
+                progress=progress,
             )
         for unnuked in p:
             if unnuked:
                 total_unnuked.update(unnuked)
+    if progress and not total_unnuked and os.path.exists(progress):
+        os.remove(progress)
     if total_unnuked:
         log.error('Could not nuke the following targets:\n' +
                   '\n  '.join(['targets:', ] +
@@ -277,8 +326,8 @@ def nuke(ctx, should_unlock, sync_clocks=True, noipmi=False, keep_logs=False, sh
 
 
 def nuke_one(ctx, target, should_unlock, synch_clocks,
-             check_locks, noipmi, keep_logs, should_reboot):
-    ret = None
+             check_locks, noipmi, keep_logs, should_reboot, retries=0,
+             ipmi_slots=None, progress=None):
     ctx = argparse.Namespace(
         config=dict(targets=target),
         owner=ctx.owner,
@@ -287,17 +336,26 @@ def nuke_one(ctx, target, should_unlock, synch_clocks,
         teuthology_config=config.to_dict(),
         name=ctx.name,
         noipmi=noipmi,
+        ipmi_slots=ipmi_slots or BoundedSemaphore(1),
     )
-    try:
-        nuke_helper(ctx, should_unlock, keep_logs, should_reboot)
-    except Exception:
-        log.exception('Could not nuke %s' % target)
-        # not re-raising the so that parallel calls aren't killed
-        ret = target
-    else:
-        if should_unlock:
-            unlock_one(ctx, list(target.keys())[0], ctx.owner)
-    return ret
+    for attempt in range(retries + 1):
+        try:
+            nuke_helper(ctx, should_unlock, keep_logs, should_reboot)
+            break
+        except Exception:
+            log.exception('Could not nuke %s' % target)
+            if attempt == retries:
+                # not re-raising the so that parallel calls aren't killed
+                return target
+            delay = config.nuke_backoff * 2 ** attempt
+            log.info('Trying to nuke %s again in %ss', target, delay)
+            time.sleep(delay)
+    (name,) = target.keys()
+    if should_unlock:
+        unlock_one(ctx, name, ctx.owner)
+    if progress:
+        record_progress(progress, name)
+    return None
 
 
 def nuke_helper(ctx, should_unlock, keep_logs, should_reboot):
@@ -305,8 +363,10 @@ def nuke_helper(ctx, should_unlock, keep_logs, should_reboot):
     (target,) = ctx.config['targets'].keys()
     host = target.split('@')[-1]
     shortname = host.split('.')[0]
+    # nuke() has just looked the targets up
+    status = get_status(host, max_age=STATUS_TTL)
     if should_unlock:
-        if is_vm(shortname):
+        if is_vm(status=status):
             return
     log.debug('shortname: %s' % shortname)
     remote = Remote(host)
@@ -314,9 +374,9 @@ def nuke_helper(ctx, should_unlock, keep_logs, should_reboot):
         # does not check to ensure if the node is 'up'
         # we want to be able to nuke a downed node
         check_lock.check_lock(ctx, None, check_up=False)
-    status = get_status(host)
     if status['machine_type'] in provision.fog.get_types():
-        remote.console.power_off()
+        with ctx.ipmi_slots:
+            remote.console.power_off()
         return
     elif status['machine_type'] in provision.pelagos.get_types():
         provision.pelagos.park_node(host)
@@ -330,7 +390,8 @@ def nuke_helper(ctx, should_unlock, keep_logs, should_reboot):
     if (not ctx.noipmi and 'ipmi_user' in config and
             'vpm' not in shortname):
         try:
-            check_console(host)
+            with ctx.ipmi_slots:
+                check_console(host)
         except Exception:
             log.exception('')
             log.info("Will attempt to connect via SSH")
@@ -338,29 +399,15 @@ def nuke_helper(ctx, should_unlock, keep_logs, should_reboot):
             remote.connect()
     add_remotes(ctx, None)
     connect(ctx, None)
-    clear_firewall(ctx)
-    shutdown_daemons(ctx)
-    kill_valgrind(ctx)
+    # Each cleanup() is one remote script; see actions.cleanup_steps()
+    cleanup(ctx, keep_logs=keep_logs)
     # Try to remove packages before reboot
-    remove_installed_packages(ctx)
+    remove_installed_packages(ctx, configure_dpkg=False)
     remotes = ctx.cluster.remotes.keys()
     if should_reboot:
         reboot(ctx, remotes)
     # shutdown daemons again incase of startup
-    shutdown_daemons(ctx)
-    remove_osd_mounts(ctx)
-    remove_osd_tmpfs(ctx)
-    kill_hadoop(ctx)
-    remove_ceph_packages(ctx)
-    synch_clocks(remotes)
-    unlock_firmware_repo(ctx)
-    remove_configuration_files(ctx)
-    undo_multipath(ctx)
-    reset_syslog_dir(ctx)
-    remove_ceph_data(ctx)
-    if not keep_logs:
-        remove_testing_tree(ctx)
-    remove_yum_timedhosts(ctx)
+    cleanup(ctx, after_reboot=True, keep_logs=keep_logs)
     # Once again remove packages after reboot
-    remove_installed_packages(ctx)
+    remove_installed_packages(ctx, configure_dpkg=False)
     log.info('Installed packages removed.')
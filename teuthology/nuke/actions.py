@@ -3,7 +3,8 @@ import time
 
 from teuthology.misc import get_testdir, reconnect
 from teuthology.orchestra import run
-from teuthology.orchestra.remote import Remote
+from teuthology.orchestra.remote import Remote, RemoteBatch
+from teuthology.parallel import parallel
 from teuthology.task import install as install_task
 
 
@@ -17,98 +18,109 @@ def clear_firewall(ctx):
     firewall rules are unaffected.
     """
     log.info("Clearing teuthology firewall rules...")
-    ctx.cluster.run(
-        args=[
-            "sudo", "sh", "-c",
-            "iptables-save | grep -v teuthology | iptables-restore"
-        ],
-    )
+    ctx.cluster.run(args=_clear_firewall_args())
     log.info("Cleared teuthology firewall rules.")
 
 
+def _clear_firewall_args():
+    return [
+        "sudo", "sh", "-c",
+        "iptables-save | grep -v teuthology | iptables-restore"
+    ]
+
+
 def shutdown_daemons(ctx):
     log.info('Unmounting ceph-fuse and killing daemons...')
-    ctx.cluster.run(args=['sudo', 'stop', 'ceph-all', run.Raw('||'),
-                          'sudo', 'service', 'ceph', 'stop', run.Raw('||'),
-                          'sudo', 'systemctl', 'stop', 'ceph.target'],
+    ctx.cluster.run(args=_stop_daemons_args(),
                     check_status=False, timeout=180)
-    ctx.cluster.run(
-        args=[
-            'if', 'grep', '-q', 'ceph-fuse', '/etc/mtab', run.Raw(';'),
-            'then',
-            'grep', 'ceph-fuse', '/etc/mtab', run.Raw('|'),
-            'grep', '-o', " /.* fuse", run.Raw('|'),
-            'grep', '-o', "/.* ", run.Raw('|'),
-            'xargs', '-n', '1', 'sudo', 'fusermount', '-u', run.Raw(';'),
-            'fi',
-            run.Raw(';'),
-            'if', 'grep', '-q', 'rbd-fuse', '/etc/mtab', run.Raw(';'),
-            'then',
-            'grep', 'rbd-fuse', '/etc/mtab', run.Raw('|'),
-            'grep', '-o', " /.* fuse", run.Raw('|'),
-            'grep', '-o', "/.* ", run.Raw('|'),
-            'xargs', '-n', '1', 'sudo', 'fusermount', '-u', run.Raw(';'),
-            'fi',
-            run.Raw(';'),
-            'sudo',
-            'killall',
-            '--quiet',
-            'ceph-mon',
-            'ceph-osd',
-            'ceph-mds',
-            'ceph-mgr',
-            'ceph-fuse',
-            'ceph-disk',
-            'radosgw',
-            'ceph_test_rados',
-            'rados',
-            'rbd-fuse',
-            'apache2',
-            run.Raw('||'),
-            'true',  # ignore errors from ceph binaries not being found
-        ],
-        timeout=120,
-    )
+    ctx.cluster.run(args=_kill_daemons_args(), timeout=120)
     log.info('All daemons killed.')
 
 
+def _stop_daemons_args():
+    return ['sudo', 'stop', 'ceph-all', run.Raw('||'),
+            'sudo', 'service', 'ceph', 'stop', run.Raw('||'),
+            'sudo', 'systemctl', 'stop', 'ceph.target']
+
+
+def _kill_daemons_args():
+    return [
+        'if', 'grep', '-q', 'ceph-fuse', '/etc/mtab', run.Raw(';'),
+        'then',
+        'grep', 'ceph-fuse', '/etc/mtab', run.Raw('|'),
+        'grep', '-o', " /.* fuse", run.Raw('|'),
+        'grep', '-o', "/.* ", run.Raw('|'),
+        'xargs', '-n', '1', 'sudo', 'fusermount', '-u', run.Raw(';'),
+        'fi',
+        run.Raw(';'),
+        'if', 'grep', '-q', 'rbd-fuse', '/etc/mtab', run.Raw(';'),
+        'then',
+        'grep', 'rbd-fuse', '/etc/mtab', run.Raw('|'),
+        'grep', '-o', " /.* fuse", run.Raw('|'),
+        'grep', '-o', "/.* ", run.Raw('|'),
+        'xargs', '-n', '1', 'sudo', 'fusermount', '-u', run.Raw(';'),
+        'fi',
+        run.Raw(';'),
+        'sudo',
+        'killall',
+        '--quiet',
+        'ceph-mon',
+        'ceph-osd',
+        'ceph-mds',
+        'ceph-mgr',
+        'ceph-fuse',
+        'ceph-disk',
+        'radosgw',
+        'ceph_test_rados',
+        'rados',
+        'rbd-fuse',
+        'apache2',
+        run.Raw('||'),
+        'true',  # ignore errors from ceph binaries not being found
+    ]
+
+
 def kill_hadoop(ctx):
     log.info("Terminating Hadoop services...")
-    ctx.cluster.run(args=[
-        "pkill", "-f", "-KILL", "java.*hadoop",
-        ],
-        check_status=False,
-        timeout=60
-    )
+    ctx.cluster.run(args=_kill_hadoop_args(), check_status=False, timeout=60)
+
+
+def _kill_hadoop_args():
+    return ["pkill", "-f", "-KILL", "java.*hadoop"]
 
 
 def kill_valgrind(ctx):
-    # http://tracker.ceph.com/issues/17084
     ctx.cluster.run(
-        args=['sudo', 'pkill', '-f', '-9', 'valgrind.bin'],
+        args=_kill_valgrind_args(),
         check_status=False,
         timeout=20,
     )
 
 
+def _kill_valgrind_args():
+    # http://tracker.ceph.com/issues/17084
+    return ['sudo', 'pkill', '-f', '-9', 'valgrind.bin']
+
+
 def remove_osd_mounts(ctx):
     """
     unmount any osd data mounts (scratch disks)
     """
     log.info('Unmount any osd data directories...')
-    ctx.cluster.run(
-        args=[
-            'grep',
-            '/var/lib/ceph/osd/',
-            '/etc/mtab',
-            run.Raw('|'),
-            'awk', '{print $2}', run.Raw('|'),
-            'xargs', '-r',
-            'sudo', 'umount', '-l', run.Raw(';'),
-            'true'
-        ],
-        timeout=120
-    )
+    ctx.cluster.run(args=_remove_osd_mounts_args(), timeout=120)
+
+
+def _remove_osd_mounts_args():
+    return [
+        'grep',
+        '/var/lib/ceph/osd/',
+        '/etc/mtab',
+        run.Raw('|'),
+        'awk', '{print $2}', run.Raw('|'),
+        'xargs', '-r',
+        'sudo', 'umount', '-l', run.Raw(';'),
+        'true'
+    ]
 
 
 def remove_osd_tmpfs(ctx):
@@ -116,16 +128,17 @@ def remove_osd_tmpfs(ctx):
     unmount tmpfs mounts
     """
     log.info('Unmount any osd tmpfs dirs...')
-    ctx.cluster.run(
-        args=[
-            'egrep', r'tmpfs\s+/mnt', '/etc/mtab', run.Raw('|'),
-            'awk', '{print $2}', run.Raw('|'),
-            'xargs', '-r',
-            'sudo', 'umount', run.Raw(';'),
-            'true'
-        ],
-        timeout=120
-    )
+    ctx.cluster.run(args=_remove_osd_tmpfs_args(), timeout=120)
+
+
+def _remove_osd_tmpfs_args():
+    return [
+        'egrep', r'tmpfs\s+/mnt', '/etc/mtab', run.Raw('|'),
+        'awk', '{print $2}', run.Raw('|'),
+        'xargs', '-r',
+        'sudo', 'umount', run.Raw(';'),
+        'true'
+    ]
 
 
 def stale_kernel_mount(remote):
@@ -181,20 +194,7 @@ def reset_syslog_dir(ctx):
     log.info('Resetting syslog output locations...')
     nodes = {}
     for remote in ctx.cluster.remotes.keys():
-        proc = remote.run(
-            args=[
-                'if', 'test', '-e', '/etc/rsyslog.d/80-cephtest.conf',
-                run.Raw(';'),
-                'then',
-                'sudo', 'rm', '-f', '--', '/etc/rsyslog.d/80-cephtest.conf',
-                run.Raw('&&'),
-                'sudo', 'service', 'rsyslog', 'restart',
-                run.Raw(';'),
-                'fi',
-                run.Raw(';'),
-            ],
-            timeout=60,
-        )
+        proc = remote.run(args=_reset_syslog_dir_args(), timeout=60)
         nodes[remote.name] = proc
 
     for name, proc in nodes.items():
@@ -202,6 +202,20 @@ def reset_syslog_dir(ctx):
         proc.wait()
 
 
+def _reset_syslog_dir_args():
+    return [
+        'if', 'test', '-e', '/etc/rsyslog.d/80-cephtest.conf',
+        run.Raw(';'),
+        'then',
+        'sudo', 'rm', '-f', '--', '/etc/rsyslog.d/80-cephtest.conf',
+        run.Raw('&&'),
+        'sudo', 'service', 'rsyslog', 'restart',
+        run.Raw(';'),
+        'fi',
+        run.Raw(';'),
+    ]
+
+
 def dpkg_configure(ctx):
     for remote in ctx.cluster.remotes.keys():
         if remote.os.package_type != 'deb':
@@ -209,19 +223,23 @@ def dpkg_configure(ctx):
         log.info(
             'Waiting for dpkg --configure -a and apt-get -f install...')
         remote.run(
-            args=[
-                'sudo', 'dpkg', '--configure', '-a',
-                run.Raw(';'),
-                'sudo', 'DEBIAN_FRONTEND=noninteractive',
-                'apt-get', '-y', '--force-yes', '-f', 'install',
-                run.Raw('||'),
-                ':',
-            ],
+            args=_dpkg_configure_args(),
             timeout=180,
             check_status=False,
         )
 
 
+def _dpkg_configure_args():
+    return [
+        'sudo', 'dpkg', '--configure', '-a',
+        run.Raw(';'),
+        'sudo', 'DEBIAN_FRONTEND=noninteractive',
+        'apt-get', '-y', '--force-yes', '-f', 'install',
+        run.Raw('||'),
+        ':',
+    ]
+
+
 def remove_yum_timedhosts(ctx):
     # Workaround for https://bugzilla.redhat.com/show_bug.cgi?id=1233329
     log.info("Removing yum timedhosts files...")
@@ -229,11 +247,15 @@ def remove_yum_timedhosts(ctx):
         if remote.os.package_type != 'rpm':
             continue
         remote.run(
-            args=r"sudo find /var/cache/yum -name 'timedhosts' -exec rm {} \;",
+            args=_remove_yum_timedhosts_args(),
             check_status=False, timeout=180
         )
 
 
+def _remove_yum_timedhosts_args():
+    return r"sudo find /var/cache/yum -name 'timedhosts' -exec rm {} \;"
+
+
 def remove_ceph_packages(ctx):
     """
     remove ceph and ceph dependent packages by force
@@ -242,6 +264,17 @@ def remove_ceph_packages(ctx):
     due to repo changes
     """
     log.info("Force remove ceph packages")
+    for remote in ctx.cluster.remotes.keys():
+        for name, args, check_status in _remove_ceph_packages_steps(remote):
+            log.info(name)
+            remote.run(args=args, check_status=check_status)
+
+
+def _remove_ceph_packages_steps(remote):
+    """
+    :returns: a list of (description, args, check_status) for each command
+              remove_ceph_packages() runs on remote
+    """
     ceph_packages_to_remove = ['ceph-common', 'ceph-mon', 'ceph-osd',
                                'libcephfs1', 'libcephfs2',
                                'librados2', 'librgw2', 'librbd1', 'python-rgw',
@@ -251,74 +284,49 @@ def remove_ceph_packages(ctx):
                                'ceph-deploy', 'libapache2-mod-fastcgi'
                                ]
     pkgs = str.join(' ', ceph_packages_to_remove)
-    for remote in ctx.cluster.remotes.keys():
-        if remote.os.package_type == 'rpm':
-            log.info("Remove any broken repos")
-            dist_release = remote.os.name
-            remote.run(
-                args=['sudo', 'rm', run.Raw("/etc/yum.repos.d/*ceph*")],
-                check_status=False
-            )
-            remote.run(
-                args=['sudo', 'rm', run.Raw("/etc/yum.repos.d/*fcgi*")],
-                check_status=False,
-            )
-            remote.run(
-                args=['sudo', 'rm', run.Raw("/etc/yum.repos.d/*samba*")],
-                check_status=False,
-            )
-            remote.run(
-                args=['sudo', 'rm', run.Raw("/etc/yum.repos.d/*nfs-ganesha*")],
-                check_status=False,
-            )
-            remote.run(
-                args=['sudo', 'rpm', '--rebuilddb']
-            )
-            if dist_release in ['opensuse', 'sle']:
-                remote.sh('sudo zypper clean')
-                log.info('Remove any ceph packages')
-                remote.sh('sudo zypper remove --non-interactive',
-                    check_status=False
-                )
-            else:
-                remote.sh('sudo yum clean all')
-                log.info('Remove any ceph packages')
-                remote.sh('sudo yum remove -y', check_status=False)
+    steps = []
+    if remote.os.package_type == 'rpm':
+        dist_release = remote.os.name
+        for repo in ('ceph', 'fcgi', 'samba', 'nfs-ganesha'):
+            steps.append((
+                "Remove any broken %s repos" % repo,
+                ['sudo', 'rm', run.Raw("/etc/yum.repos.d/*%s*" % repo)],
+                False,
+            ))
+        steps.append(
+            ("Rebuild rpm database", ['sudo', 'rpm', '--rebuilddb'], True))
+        if dist_release in ['opensuse', 'sle']:
+            steps.append(("Clean zypper", 'sudo zypper clean', True))
+            steps.append(('Remove any ceph packages',
+                          'sudo zypper remove --non-interactive', False))
         else:
-            log.info("Remove any broken repos")
-            remote.run(
-                args=['sudo', 'rm', run.Raw("/etc/apt/sources.list.d/*ceph*")],
-                check_status=False,
-            )
-            remote.run(
-                args=['sudo', 'rm', run.Raw("/etc/apt/sources.list.d/*samba*")],
-                check_status=False,
-            )
-            remote.run(
-                args=['sudo', 'rm', run.Raw("/etc/apt/sources.list.d/*nfs-ganesha*")],
-                check_status=False,
-            )
-            log.info("Autoclean")
-            remote.run(
-                args=['sudo', 'apt-get', 'autoclean'],
-                check_status=False,
-            )
-            log.info('Remove any ceph packages')
-            remote.run(
-                args=[
-                    'sudo', 'dpkg', '--remove', '--force-remove-reinstreq',
-                    run.Raw(pkgs)
-                ],
-                check_status=False
-            )
-            log.info("Autoclean")
-            remote.run(
-                args=['sudo', 'apt-get', 'autoclean']
-            )
-
-
-def remove_installed_packages(ctx):
-    dpkg_configure(ctx)
+            steps.append(("Clean yum", 'sudo yum clean all', True))
+            steps.append(
+                ('Remove any ceph packages', 'sudo yum remove -y', False))
+    else:
+        for repo in ('ceph', 'samba', 'nfs-ganesha'):
+            steps.append((
+                "Remove any broken %s repos" % repo,
+                ['sudo', 'rm',
+                 run.Raw("/etc/apt/sources.list.d/*%s*" % repo)],
+                False,
+            ))
+        steps.append(
+            ("Autoclean", ['sudo', 'apt-get', 'autoclean'], False))
+        steps.append((
+            'Remove any ceph packages',
+            ['sudo', 'dpkg', '--remove', '--force-remove-reinstreq',
+             run.Raw(pkgs)],
+            False,
+        ))
+        steps.append(
+            ("Autoclean", ['sudo', 'apt-get', 'autoclean'], True))
+    return steps
+
+
+def remove_installed_packages(ctx, configure_dpkg=True):
+    if configure_dpkg:
+        dpkg_configure(ctx)
     conf = dict(
         project='ceph',
         debuginfo='true',
@@ -341,28 +349,107 @@ def remove_installed_packages(ctx):
     install_task.remove_sources(ctx, conf)
 
 
+def cleanup_steps(ctx, remote, after_reboot=False, keep_logs=False):
+    """
+    The commands nuke runs on a remote before or after rebooting it, in the
+    order it runs them. These are the same commands the individual actions
+    in this module run, except for removing the installed packages, which
+    the install task does itself.
+
+    :returns: a list of (name, args, check_status, timeout)
+    """
+    steps = []
+    if not after_reboot:
+        steps.append(
+            ('clear_firewall', _clear_firewall_args(), True, None))
+    steps.extend([
+        ('stop daemons', _stop_daemons_args(), False, 180),
+        ('kill daemons', _kill_daemons_args(), True, 120),
+    ])
+    if not after_reboot:
+        steps.append(
+            ('kill_valgrind', _kill_valgrind_args(), False, 20))
+    else:
+        steps.extend([
+            ('remove_osd_mounts', _remove_osd_mounts_args(), True, 120),
+            ('remove_osd_tmpfs', _remove_osd_tmpfs_args(), True, 120),
+            ('kill_hadoop', _kill_hadoop_args(), False, 60),
+        ])
+        steps.extend(
+            ('remove_ceph_packages: ' + name, args, check_status, None)
+            for name, args, check_status in
+            _remove_ceph_packages_steps(remote)
+        )
+        steps.extend([
+            ('synch_clocks', _synch_clocks_args(), True, 60),
+            ('unlock_firmware_repo', _unlock_firmware_repo_args(), True,
+             None),
+            ('remove_configuration_files',
+             _remove_configuration_files_args(), True, 30),
+            ('undo_multipath', _undo_multipath_args(), False, 60),
+            ('reset_syslog_dir', _reset_syslog_dir_args(), True, 60),
+            ('remove_ceph_data', _remove_ceph_data_args(), True, None),
+        ])
+        if not keep_logs:
+            steps.append(('remove_testing_tree',
+                          _remove_testing_tree_args(ctx), True, None))
+        if remote.os.package_type == 'rpm':
+            steps.append(('remove_yum_timedhosts',
+                          _remove_yum_timedhosts_args(), False, 180))
+    if remote.os.package_type == 'deb':
+        steps.append(
+            ('dpkg_configure', _dpkg_configure_args(), False, 180))
+    return steps
+
+
+def cleanup(ctx, after_reboot=False, keep_logs=False):
+    """
+    Run cleanup_steps() on each remote as a single script, instead of one
+    command per step. A failed step stops the script, and fails the cleanup
+    of that remote, wherever the corresponding action would have raised.
+    """
+    with parallel() as p:
+        for remote in ctx.cluster.remotes.keys():
+            p.spawn(_cleanup_remote, ctx, remote, after_reboot, keep_logs)
+
+
+def _cleanup_remote(ctx, remote, after_reboot, keep_logs):
+    log.info('Cleaning up %s%s...', remote.shortname,
+             ' after reboot' if after_reboot else '')
+    batch = RemoteBatch(remote)
+    for name, args, check_status, timeout in cleanup_steps(
+            ctx, remote, after_reboot, keep_logs):
+        batch.add(args, check_status=check_status, name=name,
+                  timeout=timeout)
+    batch.run()
+
+
 def remove_ceph_data(ctx):
     log.info("Removing any stale ceph data...")
-    ctx.cluster.run(
-        args=[
-            'sudo', 'rm', '-rf', '/etc/ceph',
-            run.Raw('/var/run/ceph*'),
-        ],
-    )
+    ctx.cluster.run(args=_remove_ceph_data_args())
+
+
+def _remove_ceph_data_args():
+    return [
+        'sudo', 'rm', '-rf', '/etc/ceph',
+        run.Raw('/var/run/ceph*'),
+    ]
 
 
 def remove_testing_tree(ctx):
     log.info('Clearing filesystem of test data...')
-    ctx.cluster.run(
-        args=[
-            'sudo', 'rm', '-rf', get_testdir(ctx),
-            # just for old time's sake
-            run.Raw('&&'),
-            'sudo', 'rm', '-rf', '/tmp/cephtest',
-            run.Raw('&&'),
-            'sudo', 'rm', '-rf', '/home/ubuntu/cephtest',
-        ],
-    )
+    ctx.cluster.run(args=_remove_testing_tree_args(ctx))
+
+
+def _remove_testing_tree_args(ctx):
+    return [
+        'sudo', 'rm', '-rf', get_testdir(ctx),
+        # just for old time's sake
+        run.Raw('&&'),
+        'sudo', 'rm', '-rf', '/tmp/cephtest',
+        run.Raw('&&'),
+        'sudo', 'rm', '-rf', '/home/ubuntu/cephtest',
+    ]
 
 
 def remove_configuration_files(ctx):
@@ -374,12 +461,11 @@ def remove_configuration_files(ctx):
     ``~/.cephdeploy.conf`` to alter how it handles installation by specifying
     a default section in its config with custom locations.
     """
-    ctx.cluster.run(
-        args=[
-            'rm', '-f', '/home/ubuntu/.cephdeploy.conf'
-        ],
-        timeout=30
-    )
+    ctx.cluster.run(args=_remove_configuration_files_args(), timeout=30)
+
+
+def _remove_configuration_files_args():
+    return ['rm', '-f', '/home/ubuntu/.cephdeploy.conf']
 
 
 def undo_multipath(ctx):
@@ -391,44 +477,50 @@ def undo_multipath(ctx):
     log.info('Removing any multipath config/pkgs...')
     for remote in ctx.cluster.remotes.keys():
         remote.run(
-            args=[
-                'sudo', 'multipath', '-F',
-            ],
+            args=_undo_multipath_args(),
             check_status=False,
             timeout=60
         )
 
 
+def _undo_multipath_args():
+    return ['sudo', 'multipath', '-F']
+
+
 def synch_clocks(remotes):
     log.info('Synchronizing clocks...')
     for remote in remotes:
-        remote.run(
-            args=[
-                'sudo', 'systemctl', 'stop', 'ntp.service', run.Raw('||'),
-                'sudo', 'systemctl', 'stop', 'ntpd.service', run.Raw('||'),
-                'sudo', 'systemctl', 'stop', 'chronyd.service',
-                run.Raw('&&'),
-                'sudo', 'ntpdate-debian', run.Raw('||'),
-                'sudo', 'ntp', '-gq', run.Raw('||'),
-                'sudo', 'ntpd', '-gq', run.Raw('||'),
-                'sudo', 'chronyc', 'sources',
-                run.Raw('&&'),
-                'sudo', 'hwclock', '--systohc', '--utc',
-                run.Raw('&&'),
-                'sudo', 'systemctl', 'start', 'ntp.service', run.Raw('||'),
-                'sudo', 'systemctl', 'start', 'ntpd.service', run.Raw('||'),
-                'sudo', 'systemctl', 'start', 'chronyd.service',
-                run.Raw('||'),
-                'true',    # ignore errors; we may be racing with ntpd startup
-            ],
-            timeout=60,
-        )
+        remote.run(args=_synch_clocks_args(), timeout=60)
+
+
+def _synch_clocks_args():
+    return [
+        'sudo', 'systemctl', 'stop', 'ntp.service', run.Raw('||'),
+        'sudo', 'systemctl', 'stop', 'ntpd.service', run.Raw('||'),
+        'sudo', 'systemctl', 'stop', 'chronyd.service',
+        run.Raw('&&'),
+        'sudo', 'ntpdate-debian', run.Raw('||'),
+        'sudo', 'ntp', '-gq', run.Raw('||'),
+        'sudo', 'ntpd', '-gq', run.Raw('||'),
+        'sudo', 'chronyc', 'sources',
+        run.Raw('&&'),
+        'sudo', 'hwclock', '--systohc', '--utc',
+        run.Raw('&&'),
+        'sudo', 'systemctl', 'start', 'ntp.service', run.Raw('||'),
+        'sudo', 'systemctl', 'start', 'ntpd.service', run.Raw('||'),
+        'sudo', 'systemctl', 'start', 'chronyd.service',
+        run.Raw('||'),
+        'true',    # ignore errors; we may be racing with ntpd startup
+    ]
 
 
 def unlock_firmware_repo(ctx):
     log.info('Making sure firmware.git is not locked...')
-    ctx.cluster.run(args=['sudo', 'rm', '-f',
-                          '/lib/firmware/updates/.git/index.lock', ])
+    ctx.cluster.run(args=_unlock_firmware_repo_args())
+
+
+def _unlock_firmware_repo_args():
+    return ['sudo', 'rm', '-f', '/lib/firmware/updates/.git/index.lock']
 
 
 def check_console(hostname):
@@ -12,10 +12,14 @@ import teuthology.provision
 from teuthology import misc
 from teuthology.exceptions import CommandFailedError
 from teuthology.misc import host_shortname
+import base64
+import contextlib
 import errno
+import secrets
 import time
 import re
 import logging
+import gevent
 from io import BytesIO
 from io import StringIO
 import os
@@ -26,6 +30,112 @@ import netaddr
 log = logging.getLogger(__name__)
 
 
+class RemoteBatch(object):
+    """
+    File operations recorded by RemoteShell.batch(), to be run on the remote
+    machine as a single script.
+
+    Each step runs in its own subshell and prints a status marker, so that a
+    failure can be attributed to the step that caused it.
+    """
+    marker = 'teuthology-batch-step'
+
+    def __init__(self, remote):
+        self.remote = remote
+        self.steps = []
+
+    def add(self, args, stdin=None, check_status=True, name=None,
+            timeout=None):
+        """
+        Record a command.
+
+        :param args:         command to run, as for run.run()
+        :param stdin:        str, bytes or fileobj to feed to the command
+        :param check_status: whether a failure of this step fails the batch
+        :param name:         what to call the step when logging its result
+        :param timeout:      kill the step after this many seconds
+        """
+        command = run.quote(args)
+        if timeout:
+            command = run.quote(
+                ['timeout', str(timeout), 'bash', '-c', command])
+        if stdin is not None:
+            if hasattr(stdin, 'read'):
+                stdin = stdin.read()
+            if isinstance(stdin, str):
+                stdin = stdin.encode()
+        self.steps.append((command, stdin, check_status, name))
+
+    @property
+    def script(self):
+        lines = []
+        for index, (command, data, check_status, _) in enumerate(self.steps):
+            lines.extend(['step_{i}() {{'.format(i=index), command, '}'])
+            if data is None:
+                lines.append('( step_{i} ) < /dev/null'.format(i=index))
+            else:
+                eof = 'TEUTHOLOGY_BATCH_EOF'
+                lines.append(
+                    "base64 -d <<'{eof}' | step_{i}".format(eof=eof, i=index))
+                lines.append(base64.encodebytes(data).decode().rstrip('\n'))
+                lines.append(eof)
+            lines.extend([
+                'rc=$?',
+                "printf '\\n{marker} {i} %d\\n' $rc".format(
+                    marker=self.marker, i=index),
+            ])
+            if check_status:
+                lines.append('[ $rc -eq 0 ] || exit $rc')
+        return '\n'.join(lines) + '\n'
+
+    def run(self):
+        """
+        Run the recorded steps with a single remote command.
+
+        :returns: a dict mapping the index of each step that ran to its exit
+                  status
+        :raises: :class:`CommandFailedError` for the first step that failed,
+                 unless it was added with check_status=False
+        """
+        if not self.steps:
+            return dict()
+        proc = self.remote.run(
+            args=['bash', '-s'],
+            stdin=self.script,
+            stdout=StringIO(),
+            check_status=False,
+            label='batch of {n} steps'.format(n=len(self.steps)),
+        )
+        statuses = dict()
+        for match in re.finditer(
+                r'^{marker} (\d+) (\d+)$'.format(marker=self.marker),
+                proc.stdout.getvalue(), re.MULTILINE):
+            statuses[int(match.group(1))] = int(match.group(2))
+        for index, (command, _, check_status, name) in enumerate(self.steps):
+            status = statuses.get(index)
+            if status == 0 or status is not None and not check_status:
+                if name:
+                    log.info('%s: %s: %s', self.remote.shortname, name,
+                             'done' if status == 0 else
+                             'exited with status %d, ignoring' % status)
+                continue
+            if status is None:
+                status = proc.returncode
+            log.error('%s: batch step %d of %d failed: %s',
+                      self.remote.shortname, index + 1, len(self.steps),
+                      name or command)
+            raise CommandFailedError(
+                command=command,
+                exitstatus=status,
+                node=self.remote.shortname,
+                label='batch step {i} of {n}'.format(
+                    i=index + 1, n=len(self.steps)),
+            )
+        log.debug('%s: ran %d batched steps', self.remote.shortname,
+                  len(self.steps))
+        return statuses
+
+
 class RemoteShell(object):
     """
     Contains methods to run miscellaneous shell commands on remote machines.
@@ -42,13 +152,76 @@ class RemoteShell(object):
     the subclass.
     """
 
+    @property
+    def _batch(self):
+        """
+        The batch being recorded by the current greenlet, if any
+        """
+        batches = getattr(self, '_batches', None)
+        if not batches:
+            return None
+        return batches.get(gevent.getcurrent())
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Record file operations and run them as one remote command when the
+        block ends, instead of one command per operation.
+
+        Usage:
+            with remote.batch():
+                remote.write_file('/etc/foo.conf', data, sudo=True)
+                remote.chmod('/etc/foo.conf', '0600')
+
+        Only operations that don't need output from the remote are recorded;
+        mktemp() and mkdtemp() return a path generated locally. Batches may
+        be nested; the steps run when the outermost block ends. If the block
+        raises, the recorded steps are discarded. Batches are tracked per
+        greenlet, so operations issued by other greenlets run immediately.
+
+        :raises: :class:`CommandFailedError` naming the step that failed
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        if getattr(self, '_batches', None) is None:
+            self._batches = dict()
+        current = gevent.getcurrent()
+        batch = self._batches[current] = RemoteBatch(self)
+        try:
+            yield batch
+        finally:
+            del self._batches[current]
+        batch.run()
+
+    def run_or_batch(self, args, stdin=None, check_status=True, **kwargs):
+        """
+        Run a command whose output isn't needed, or record it if a batch()
+        is active.
+        """
+        batch = self._batch
+        if batch is not None:
+            batch.add(args, stdin=stdin, check_status=check_status)
+            return None
+        return self.run(args=args, stdin=stdin, check_status=check_status,
+                        **kwargs)
+
+    def _batch_temp_path(self, prefix, suffix=None, parentdir=None):
+        name = prefix + secrets.token_hex(5) + (suffix or '')
+        return os.path.join(parentdir or '/tmp', name)
+
     def remove(self, path):
-        self.run(args=['rm', '-fr', path])
+        self.run_or_batch(['rm', '-fr', path])
 
     def mkdtemp(self, suffix=None, parentdir=None):
         """
         Create a temporary directory on remote machine and return it's path.
         """
+        if self._batch is not None:
+            path = self._batch_temp_path('tmp.', suffix, parentdir)
+            self.run_or_batch(['mkdir', '-m', '0700', '--', path])
+            return path
+
         args = ['mktemp', '-d']
 
         if suffix:
@@ -68,13 +241,19 @@ class RemoteShell(object):
 
         Returns: the path of the temp file created.
         """
-        args = ['mktemp']
-        if suffix:
-            args.append('--suffix=%s' % suffix)
-        if parentdir:
-            args.append('--tmpdir=%s' % parentdir)
+        if self._batch is not None:
+            path = self._batch_temp_path('tmp.', suffix, parentdir)
+            self.run_or_batch(
+                '(set -C; umask 077; : > {path})'.format(
+                    path=run.quote([path])))
+        else:
+            args = ['mktemp']
+            if suffix:
+                args.append('--suffix=%s' % suffix)
+            if parentdir:
+                args.append('--tmpdir=%s' % parentdir)
 
-        path = self.sh(args).strip()
+            path = self.sh(args).strip()
 
         if data:
             self.write_file(path=path, data=data)
@@ -125,6 +304,24 @@ class RemoteShell(object):
 
         return self.sh(command, **kwargs)
 
+    def choose_archive_codec(self, codecs):
+        """
+        Return the first of codecs whose compressor is installed on the
+        remote machine, falling back to gzip. The probe runs only once per
+        remote.
+
+        :param codecs:  codec names in order of preference, e.g.
+                        misc.get_archive_codecs()
+        """
+        if getattr(self, '_archive_programs', None) is None:
+            found = self.sh('command -v zstd pigz || true')
+            self._archive_programs = set(
+                os.path.basename(line) for line in found.split())
+        for codec in codecs:
+            if codec in self._archive_programs:
+                return codec
+        return 'gzip'
+
     def chmod(self, file_path, permissions):
         """
         As super-user, set permissions on the remote file specified.
@@ -135,9 +332,7 @@ class RemoteShell(object):
             permissions,
             file_path,
             ]
-        self.run(
-            args=args,
-            )
+        self.run_or_batch(args)
 
     def chcon(self, file_path, context):
         """
@@ -187,7 +382,7 @@ class RemoteShell(object):
             chown = 'sudo chown' if sudo else 'chown'
             args += '\n' + chown + ' ' + owner + ' ' + dst
         args = 'set -ex' + '\n' + args
-        self.run(args=args)
+        self.run_or_batch(args)
 
     def move_file(self, src, dst, sudo=False, mode=None, owner=None,
                                               mkdir=False):
@@ -215,7 +410,7 @@ class RemoteShell(object):
         if owner:
             chown = 'sudo chown' if sudo else 'chown'
             args += ' && ' + chown + ' ' + owner + ' ' + dst
-        self.run(args=args)
+        self.run_or_batch(args)
 
     def read_file(self, path, sudo=False, stdout=None,
                               offset=0, length=0):
@@ -292,7 +487,7 @@ class RemoteShell(object):
             chown = 'sudo chown' if sudo else 'chown'
             args += '\n' + chown + ' ' + owner + ' ' + path
         args = 'set -ex' + '\n' + args
-        self.run(args=args, stdin=data, quiet=True)
+        self.run_or_batch(args, stdin=data, quiet=True)
 
     def sudo_write_file(self, path, data, **kwargs):
         """
@@ -346,6 +541,11 @@ class Remote(RemoteShell):
     # for unit tests to hook into
     _runner = staticmethod(run.run)
     _reimage_types = None
+    # compressor commands used by get_tar_stream, keyed by codec
+    _archive_compressors = {
+        'zstd': ['zstd', '-q', '-c', '-T0'],
+        'pigz': ['pigz', '-c'],
+    }
 
     def __init__(self, name, ssh=None, shortname=None, console=None,
                  host_key=None, keep_alive=True):
@@ -392,6 +592,8 @@ class Remote(RemoteShell):
         for failure.
         """
         if self.ssh is not None:
+            # Trace the commands nobody waited for before losing them
+            run.command_trace.flush(self.ssh)
             self.ssh.close()
         if not timeout:
             return self._reconnect(timeout=socket_timeout)
@@ -645,22 +847,39 @@ class Remote(RemoteShell):
         self._sftp_get_file(remote_temp_path, to_path)
         self.remove(remote_temp_path)
 
-    def get_tar_stream(self, path, sudo=False):
+    def get_tar_stream(self, path, sudo=False, codec='gzip'):
         """
         Tar-compress a remote directory and return the RemoteProcess
         for streaming
+
+        :param codec:   the compressor to use; one of misc.ARCHIVE_CODECS
         """
         args = []
+        if codec != 'gzip':
+            # Fail if tar does, not only if the compressor does
+            args.extend(['set', '-o', 'pipefail', run.Raw(';')])
         if sudo:
             args.append('sudo')
-        args.extend([
-            'tar',
-            'cz',
-            '-f', '-',
-            '-C', path,
-            '--',
-            '.',
-            ])
+        if codec == 'gzip':
+            args.extend([
+                'tar',
+                'cz',
+                '-f', '-',
+                '-C', path,
+                '--',
+                '.',
+                ])
+        else:
+            args.extend([
+                'tar',
+                'c',
+                '-f', '-',
+                '-C', path,
+                '--',
+                '.',
+                run.Raw('|'),
+                ])
+            args.extend(self._archive_compressors[codec])
         return self.run(args=args, wait=False, stdout=run.PIPE)
 
     @property
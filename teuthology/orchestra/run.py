@@ -2,7 +2,9 @@
 Paramiko run support
 """
 
+import collections
 import io
+import json
 
 from paramiko import ChannelFile
 
@@ -12,7 +14,9 @@ import socket
 import pipes
 import logging
 import shutil
+import time
 
+from teuthology import tracing
 from teuthology.contextutil import safe_while
 from teuthology.exceptions import (CommandCrashedError, CommandFailedError,
                                    ConnectionLostError)
@@ -20,6 +24,82 @@ from teuthology.exceptions import (CommandCrashedError, CommandFailedError,
 log = logging.getLogger(__name__)
 
 
+class CommandTrace(object):
+    """
+    A bounded, in-memory record of the remote commands run by this process.
+
+    Each entry holds the host, a summary of the command, its start time and
+    duration, its exit status and the number of bytes it wrote to stdout and
+    stderr (None when the caller consumed the stream itself). Once maxlen
+    entries are recorded the oldest ones are dropped.
+
+    Commands are recorded once they have finished and their output has been
+    copied. Those started with wait=False that nobody waits for are recorded
+    by flush(), when their connection is closed or the trace is written.
+    """
+    # Longest command summary to keep, in characters
+    max_command_length = 256
+
+    def __init__(self, maxlen=10000):
+        self.entries = collections.deque(maxlen=maxlen)
+        self.dropped = 0
+        # RemoteProcesses that have been started but not recorded yet
+        self.pending = set()
+
+    def record(self, host, command, start, end, status,
+               stdout_bytes=None, stderr_bytes=None):
+        if len(self.entries) == self.entries.maxlen:
+            self.dropped += 1
+        self.entries.append(dict(
+            host=host,
+            command=self.summarize(command),
+            start=round(start, 3),
+            duration=round(end - start, 3),
+            status=status,
+            stdout_bytes=stdout_bytes,
+            stderr_bytes=stderr_bytes,
+        ))
+
+    @classmethod
+    def summarize(cls, command):
+        """
+        Collapse whitespace in command and truncate it
+        """
+        command = ' '.join(command.split())
+        if len(command) > cls.max_command_length:
+            command = command[:cls.max_command_length - 3] + '...'
+        return command
+
+    def flush(self, client=None):
+        """
+        Record the pending commands run with client, or with any client if
+        it is None, whether or not they have finished
+        """
+        for proc in list(self.pending):
+            if client is None or proc.client is client:
+                proc._trace(final=True)
+
+    def clear(self):
+        self.entries.clear()
+        self.dropped = 0
+        self.pending.clear()
+
+    def write(self, path):
+        """
+        Write the recorded commands to path, one JSON object per line
+        """
+        self.flush()
+        with open(path, 'w') as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        if self.dropped:
+            log.info('Command trace dropped the oldest %d commands',
+                     self.dropped)
+
+
+command_trace = CommandTrace()
+
+
 class RemoteProcess(object):
     """
     An object to begin and monitor execution of a process on a remote host
@@ -31,6 +111,7 @@ class RemoteProcess(object):
         'returncode', 'exitstatus', 'timeout',
         'greenlets',
         '_wait', 'logger',
+        '_start_time', '_end_time', '_stream_bytes', '_traced', '_tid',
         # for orchestra.remote.Remote to place a backreference
         'remote',
         'label',
@@ -84,6 +165,9 @@ class RemoteProcess(object):
         self.returncode = self.exitstatus = None
         self._wait = wait
         self.logger = logger or log
+        self._start_time = self._end_time = None
+        self._stream_bytes = dict()
+        self._traced = False
 
     def execute(self):
         """
@@ -92,6 +176,8 @@ class RemoteProcess(object):
         for line in self.command.split('\n'):
             log.getChild(self.hostname).debug('%s> %s' % (self.label or '', line))
 
+        self._start_time = time.time()
+        self._tid = tracing.tracer.current_tid()
         if hasattr(self, 'timeout'):
             (self._stdin_buf, self._stdout_buf, self._stderr_buf) = \
                 self.client.exec_command(self.command, timeout=self.timeout)
@@ -100,6 +186,7 @@ class RemoteProcess(object):
                 self.client.exec_command(self.command)
         (self.stdin, self.stdout, self.stderr) = \
             (self._stdin_buf, self._stdout_buf, self._stderr_buf)
+        command_trace.pending.add(self)
 
     def add_greenlet(self, greenlet):
         self.greenlets.append(greenlet)
@@ -121,7 +208,8 @@ class RemoteProcess(object):
             stream_log = host_log.getChild(stream_name)
             self.add_greenlet(
                 gevent.spawn(
-                    copy_file_to,
+                    self._copy_stream,
+                    stream_name,
                     getattr(self, stream_name),
                     stream_log,
                     stream_obj,
@@ -133,6 +221,47 @@ class RemoteProcess(object):
             # FIXME: Is this actually true?
             raise RuntimeError(self.deadlock_warning % stream_name)
 
+    def _copy_stream(self, stream_name, src, logger, stream, quiet):
+        self._stream_bytes[stream_name] = \
+            copy_file_to(src, logger, stream, quiet)
+
+    def _trace(self, final=False):
+        """
+        Add this command to the command trace, once it has finished and its
+        output streams have been copied
+
+        :param final: Record the command now, even if it hasn't finished
+        """
+        if self._traced or self._start_time is None:
+            return
+        if final:
+            if self.returncode is None and \
+                    self._stdout_buf.channel.exit_status_ready():
+                self._get_exitstatus()
+        elif not all(greenlet.ready() for greenlet in self.greenlets):
+            return
+        self._traced = True
+        command_trace.pending.discard(self)
+        end = self._end_time or time.time()
+        command_trace.record(
+            host=self.hostname,
+            command=self.command,
+            start=self._start_time,
+            end=end,
+            status=self.returncode,
+            stdout_bytes=self._stream_bytes.get('stdout'),
+            stderr_bytes=self._stream_bytes.get('stderr'),
+        )
+        tracing.tracer.add(
+            CommandTrace.summarize(self.command),
+            'command',
+            self._start_time,
+            end,
+            tid=self._tid,
+            host=self.hostname,
+            status=self.returncode,
+        )
+
     def wait(self):
         """
         Block until remote process finishes.
@@ -149,6 +278,8 @@ class RemoteProcess(object):
             except gevent.Timeout:
                 log.debug("timed out waiting; will kill: {}".format(greenlet))
                 greenlet.kill(block=False)
+        # Killed greenlets may not be dead yet; don't wait for them
+        self._trace(final=True)
         for stream in ('stdout', 'stderr'):
             if hasattr(self, stream):
                 stream_obj = getattr(self, stream)
@@ -190,6 +321,8 @@ class RemoteProcess(object):
                   signal, this returns None instead of paramiko's -1.
         """
         status = self._stdout_buf.channel.recv_exit_status()
+        if self._end_time is None:
+            self._end_time = time.time()
         self.exitstatus = self.returncode = status
         if status == -1:
             status = None
@@ -208,6 +341,7 @@ class RemoteProcess(object):
         :returns: self.returncode if the process is finished; else None
         """
         if self.finished:
+            self._trace()
             self._raise_for_status()
             return self.returncode
         return None
@@ -269,11 +403,17 @@ def copy_to_log(f, logger, loglevel=logging.INFO, capture=None, quiet=False):
     :param capture: an optional stream object for data copy
     :param quiet: suppress `logger` usage if True, this is useful only
                   in combination with `capture`, defaults False
+    :returns: the number of bytes read from f
     """
     # Work-around for http://tracker.ceph.com/issues/8313
     if isinstance(f, ChannelFile):
         f._flags += ChannelFile.FLAG_BINARY
+    size = 0
     for line in f:
+        if isinstance(line, str):
+            size += len(line.encode('utf-8', 'replace'))
+        else:
+            size += len(line)
         if capture:
             if isinstance(capture, io.StringIO):
                 if isinstance(line, str):
@@ -295,6 +435,7 @@ def copy_to_log(f, logger, loglevel=logging.INFO, capture=None, quiet=False):
             logger.log(loglevel, line)
         except (UnicodeDecodeError, UnicodeEncodeError):
             logger.exception("Encountered unprintable line in command output")
+    return size
 
 
 def copy_and_close(src, fdst):
@@ -319,8 +460,9 @@ def copy_file_to(src, logger, stream=None, quiet=False):
                    a copy of src.
     :param quiet: disable logger usage if True, useful in combination
                   with `stream` parameter, defaults False.
+    :returns: the number of bytes (or characters) copied
     """
-    copy_to_log(src, logger, capture=stream, quiet=quiet)
+    return copy_to_log(src, logger, capture=stream, quiet=quiet)
 
 def spawn_asyncresult(fn, *args, **kwargs):
     """
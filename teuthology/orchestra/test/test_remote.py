@@ -1,7 +1,10 @@
 from mock import patch, Mock, MagicMock
 
+import pytest
+
 from io import BytesIO
 
+from teuthology.exceptions import CommandFailedError
 from teuthology.orchestra import remote
 from teuthology.orchestra import opsys
 from teuthology.orchestra.run import RemoteProcess
@@ -182,6 +185,89 @@ class TestRemote(object):
         assert remote.Remote._format_size(1021112).strip() == '997KB'
         assert remote.Remote._format_size(1021112**2).strip() == '971GB'
 
+    def test_choose_archive_codec(self):
+        rem = remote.Remote(name='jdoe@xyzzy.example.com', ssh=self.m_ssh)
+        rem.sh = MagicMock(return_value='/usr/bin/pigz\n')
+        assert rem.choose_archive_codec(['zstd', 'pigz', 'gzip']) == 'pigz'
+        assert rem.choose_archive_codec(['zstd', 'gzip']) == 'gzip'
+        rem.sh.assert_called_once_with('command -v zstd pigz || true')
+
+    def test_get_tar_stream_zstd(self):
+        rem = remote.Remote(name='jdoe@xyzzy.example.com', ssh=self.m_ssh)
+        rem.run = MagicMock()
+        rem.get_tar_stream('/some/dir', sudo=True, codec='zstd')
+        args = rem.run.call_args[1]['args']
+        assert args[:3] == ['set', '-o', 'pipefail']
+        assert args[4:7] == ['sudo', 'tar', 'c']
+        assert args[-4:] == ['zstd', '-q', '-c', '-T0']
+        rem.get_tar_stream('/some/dir', sudo=True, codec='gzip')
+        args = rem.run.call_args[1]['args']
+        assert args[:3] == ['sudo', 'tar', 'cz']
+
+    def _batch_remote(self, stdout, returncode=0):
+        rem = remote.Remote(name='jdoe@xyzzy.example.com', ssh=self.m_ssh)
+
+        def fake_run(**kwargs):
+            kwargs['stdout'].write(stdout)
+            return Mock(stdout=kwargs['stdout'], returncode=returncode)
+        rem.run = MagicMock(side_effect=fake_run)
+        return rem
+
+    def test_batch(self):
+        rem = self._batch_remote(
+            'teuthology-batch-step 0 0\nteuthology-batch-step 1 0\n'
+            'teuthology-batch-step 2 0\n')
+        with rem.batch():
+            path = rem.mktemp()
+            rem.write_file(path, 'some data', sudo=True)
+            rem.chmod(path, '0600')
+            assert rem.run.call_count == 0
+        assert path.startswith('/tmp/tmp.')
+        rem.run.assert_called_once()
+        kwargs = rem.run.call_args[1]
+        assert kwargs['args'] == ['bash', '-s']
+        assert 'sudo dd of=' + path in kwargs['stdin']
+        assert 'sudo chmod 0600 ' + path in kwargs['stdin']
+        assert 'c29tZSBkYXRh' in kwargs['stdin']
+
+    def test_batch_failed_step(self):
+        rem = self._batch_remote(
+            'teuthology-batch-step 0 0\nteuthology-batch-step 1 2\n',
+            returncode=2)
+        with pytest.raises(CommandFailedError) as excinfo:
+            with rem.batch():
+                rem.remove('/some/path')
+                rem.chmod('/other/path', '0600')
+                rem.remove('/never/reached')
+        assert excinfo.value.exitstatus == 2
+        assert excinfo.value.label == 'batch step 2 of 3'
+        assert 'chmod' in excinfo.value.command
+
+    def test_batch_unchecked_step(self):
+        rem = self._batch_remote(
+            'teuthology-batch-step 0 3\nteuthology-batch-step 1 0\n')
+        batch = remote.RemoteBatch(rem)
+        batch.add(['pkill', 'foo'], check_status=False, name='kill foo',
+                  timeout=20)
+        batch.add(['rm', '-f', '/some/path'])
+        assert batch.run() == {0: 3, 1: 0}
+        script = rem.run.call_args[1]['stdin']
+        assert "timeout 20 bash -c 'pkill foo'" in script
+        # Only checked steps stop the script
+        assert script.count('exit $rc') == 1
+
+    def test_batch_nested_and_discarded(self):
+        rem = self._batch_remote('')
+        with pytest.raises(ValueError):
+            with rem.batch():
+                with rem.batch():
+                    rem.remove('/some/path')
+                raise ValueError()
+        assert rem.run.call_count == 0
+        rem.run = MagicMock()
+        rem.remove('/some/path')
+        assert rem.run.call_args[1]['args'] == ['rm', '-fr', '/some/path']
+
     def test_is_container(self):
         m_transport = MagicMock()
         m_transport.getpeername.return_value = ('name', 22)
@@ -1,5 +1,6 @@
 from io import BytesIO
 
+import json
 import paramiko
 import socket
 
@@ -258,6 +259,68 @@ class TestRun(object):
         assert code == 0
         assert proc.exitstatus == 0
 
+    def test_command_trace(self):
+        run.command_trace.clear()
+        set_buffer_contents(self.m_stdout_buf, 'foo\nbar\n')
+        set_buffer_contents(self.m_stderr_buf, 'oops\n')
+        self.m_stdout_buf.channel.recv_exit_status.return_value = 1
+        run.run(
+            client=self.m_ssh,
+            args=['foo', 'bar baz'],
+            name='smithi001',
+            check_status=False,
+        )
+        (entry,) = run.command_trace.entries
+        assert entry['host'] == 'smithi001'
+        assert entry['command'] == "foo 'bar baz'"
+        assert entry['status'] == 1
+        assert entry['stdout_bytes'] == 8
+        assert entry['stderr_bytes'] == 5
+        assert entry['duration'] >= 0
+
+    def test_command_trace_not_waited_for(self, tmp_path):
+        run.command_trace.clear()
+        set_buffer_contents(self.m_stdout_buf, 'foo\n')
+        self.m_stdout_buf.channel.exit_status_ready.return_value = False
+        proc = run.run(
+            client=self.m_ssh,
+            args=['sleep', '60'],
+            name='smithi001',
+            wait=False,
+        )
+        assert proc.poll() is None
+        # Only commands run with the connection being closed are recorded
+        run.command_trace.flush(MagicMock())
+        assert len(run.command_trace.entries) == 0
+        run.command_trace.flush(self.m_ssh)
+        (entry,) = run.command_trace.entries
+        assert entry['command'] == 'sleep 60'
+        assert entry['status'] is None
+        assert entry['stdout_bytes'] == 4
+        assert not run.command_trace.pending
+        # Nor is it recorded again once it has finished
+        self.m_stdout_buf.channel.exit_status_ready.return_value = True
+        self.m_stdout_buf.channel.recv_exit_status.return_value = 0
+        proc.wait()
+        run.command_trace.write(str(tmp_path / 'trace.jsonl'))
+        assert len(run.command_trace.entries) == 1
+
+    def test_command_trace_bounded(self, tmp_path):
+        trace = run.CommandTrace(maxlen=2)
+        for i in range(3):
+            trace.record('host', 'cmd %d' % i, 1.0, 2.5, 0)
+        assert trace.dropped == 1
+        trace.write(str(tmp_path / 'trace.jsonl'))
+        lines = (tmp_path / 'trace.jsonl').read_text().splitlines()
+        assert [json.loads(line)['command'] for line in lines] == \
+            ['cmd 1', 'cmd 2']
+        assert json.loads(lines[0])['duration'] == 1.5
+
+    def test_copy_to_log_counts_bytes(self):
+        logger = MagicMock()
+        assert run.copy_to_log(['caf\u00e9\n', 'ok\n'], logger) == 9
+        assert run.copy_to_log([b'caf\xc3\xa9\n'], logger) == 6
+
     def test_copy_and_close(self):
         run.copy_and_close(None, MagicMock())
         run.copy_and_close('', MagicMock())
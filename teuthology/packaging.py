@@ -20,6 +20,7 @@ from teuthology.exceptions import (VersionNotFoundError, CommitNotFoundError,
 from teuthology.misc import sudo_write_file
 from teuthology.orchestra.opsys import OS, DEFAULT_OS_VERSION
 from teuthology.orchestra.run import Raw
+from teuthology.util import http_client
 
 log = logging.getLogger(__name__)
 
@@ -420,7 +421,7 @@ def _get_config_value_for_remote(ctx, remote, config, key):
 def _get_response(url, wait=False, sleep=15, tries=10):
     with safe_while(sleep=sleep, tries=tries, _raise=False) as proceed:
         while proceed():
-            resp = requests.get(url)
+            resp = http_client.get(url)
             if resp.ok:
                 log.info('Package found...')
                 break
@@ -754,7 +755,7 @@ class GitbuilderProject(object):
         """
         url = "{0}/sha1".format(self.base_url)
         log.info("Looking for package sha1: {0}".format(url))
-        resp = requests.get(url)
+        resp = http_client.get(url)
         sha1 = None
         if not resp.ok:
             # TODO: maybe we should have this retry a few times?
@@ -865,7 +866,7 @@ class ShamanProject(GitbuilderProject):
     def _search(self):
         uri = self._search_uri
         log.debug("Querying %s", uri)
-        resp = requests.get(
+        resp = http_client.get(
             uri,
             headers={'content-type': 'application/json'},
         )
@@ -989,7 +990,7 @@ class ShamanProject(GitbuilderProject):
         build_url = urljoin(self.query_url, path)
 
         try:
-            resp = requests.get(build_url)
+            resp = http_client.get(build_url)
             resp.raise_for_status()
         except requests.HttpError:
             return False
@@ -1009,7 +1010,7 @@ class ShamanProject(GitbuilderProject):
         return False
 
     def _get_repo(self):
-        resp = requests.get(self.repo_url)
+        resp = http_client.get(self.repo_url)
         resp.raise_for_status()
         return str(resp.text)
 
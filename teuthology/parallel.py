@@ -5,6 +5,8 @@ import gevent
 import gevent.pool
 import gevent.queue
 
+from teuthology import tracing
+
 
 log = logging.getLogger(__name__)
 
@@ -20,7 +22,8 @@ def capture_traceback(func, *args, **kwargs):
     raises.
     """
     try:
-        return func(*args, **kwargs)
+        with tracing.span(getattr(func, '__name__', repr(func)), 'greenlet'):
+            return func(*args, **kwargs)
     except Exception:
         return ExceptionHolder(sys.exc_info())
 
@@ -55,13 +58,23 @@ class parallel(object):
     If one of the spawned functions throws an exception, it will be thrown
     when iterating over the results, or when the with block ends.
 
+    Passing ``size`` bounds the number of functions running at once; spawn
+    blocks until a slot is free::
+
+        with parallel(size=4) as p:
+            for remote in remotes:
+                p.spawn(pull_logs, remote)
+
     At the end of the with block, the main thread waits until all
     spawned functions have completed, or, if one exited with an exception,
     kills the rest and raises the exception.
     """
 
-    def __init__(self):
-        self.group = gevent.pool.Group()
+    def __init__(self, size=None):
+        if size:
+            self.group = gevent.pool.Pool(size)
+        else:
+            self.group = gevent.pool.Group()
         self.results = gevent.queue.Queue()
         self.count = 0
         self.any_spawned = False
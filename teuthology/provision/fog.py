@@ -3,8 +3,10 @@ import logging
 import requests
 import socket
 import re
+import time
 
 from datetime import datetime
+from gevent.lock import BoundedSemaphore
 from paramiko import SSHException
 from paramiko.ssh_exception import NoValidConnectionsError
 
@@ -17,6 +19,10 @@ from teuthology import misc
 
 log = logging.getLogger(__name__)
 
+# How many seconds nodes waiting on their deploy tasks may share a list of
+# the active tasks for
+DEPLOY_POLL_INTERVAL = 10
+
 
 def enabled(warn=False):
     """
@@ -52,6 +58,42 @@ def get_types():
     return [type_ for type_ in types if type_]
 
 
+class ActiveTasks(object):
+    """
+    The FOG server's list of active tasks, shared by every node being
+    reimaged in this process, so that however many of them are waiting on
+    their deploys, it is fetched about once per DEPLOY_POLL_INTERVAL
+    """
+    def __init__(self):
+        self.lock = BoundedSemaphore()
+        self.fetched = 0
+        self.tasks = None
+
+    def get(self, fog, max_age=0):
+        """
+        :param fog:     The FOG object to make the request with
+        :param max_age: If nonzero, tasks fetched less than this many seconds
+                        ago may be returned instead
+        :returns:       A list of every active task
+        """
+        with self.lock:
+            if max_age and self.tasks is not None and \
+                    time.time() - self.fetched < max_age:
+                return self.tasks
+            started = time.time()
+            resp = fog.do_request('/task/active')
+            try:
+                tasks = resp.json()['tasks']
+            except Exception:
+                fog.log.exception("Failed to get deploy tasks!")
+                return list()
+            self.tasks, self.fetched = tasks, started
+            return tasks
+
+
+_active_tasks = ActiveTasks()
+
+
 class FOG(object):
     """
     Reimage bare-metal machines with https://fogproject.org/
@@ -221,16 +263,14 @@ class FOG(object):
             if time_delta < 5:
                 return task['id']
 
-    def get_deploy_tasks(self):
+    def get_deploy_tasks(self, max_age=0):
         """
+        :param max_age: If nonzero, the active tasks fetched for any node in
+                        this process less than this many seconds ago may be
+                        used instead of fetching them again
         :returns: A list of deploy tasks which are active on our host
         """
-        resp = self.do_request('/task/active')
-        try:
-            tasks = resp.json()['tasks']
-        except Exception:
-            self.log.exception("Failed to get deploy tasks!")
-            return list()
+        tasks = _active_tasks.get(self, max_age)
         host_tasks = [obj for obj in tasks
                       if obj['host']['name'] == self.shortname]
         return host_tasks
@@ -240,7 +280,7 @@ class FOG(object):
         :param task_id: The id of the task to query
         :returns: True if the task is active
         """
-        host_tasks = self.get_deploy_tasks()
+        host_tasks = self.get_deploy_tasks(max_age=DEPLOY_POLL_INTERVAL)
         return any(
             [task['id'] == task_id for task in host_tasks]
         )
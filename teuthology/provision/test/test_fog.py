@@ -265,6 +265,29 @@ class TestFOG(object):
             result = obj.deploy_task_active(our_task_id)
             assert result is (our_task_id in active_ids)
 
+    def test_deploy_task_active_shared(self):
+        resp_obj = dict(tasks=[
+            dict(id=1, host=dict(name='name1')),
+            dict(id=2, host=dict(name='name2')),
+        ])
+        m_send = self.mocks['m_requests_Session_send']
+        m_send.return_value.json.return_value = resp_obj
+        objs = [self.klass('name%d.fqdn' % i, 'type', '1.0')
+                for i in (1, 2, 3)]
+        with patch.object(fog, '_active_tasks', fog.ActiveTasks()), \
+                patch.object(fog.time, 'time', return_value=1000):
+            # One request tells every node whether its task is done
+            for i, obj in enumerate(objs, 1):
+                obj.shortname = 'name%d' % i
+                assert obj.deploy_task_active(i) is (i < 3)
+            assert m_send.call_count == 1
+            fog.time.time.return_value = 1000 + fog.DEPLOY_POLL_INTERVAL
+            assert objs[0].deploy_task_active(1)
+            assert m_send.call_count == 2
+            # Without max_age, the tasks are always fetched
+            objs[0].get_deploy_tasks()
+            assert m_send.call_count == 3
+
     @mark.parametrize(
         'tries',
         [3, 61],
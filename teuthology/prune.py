@@ -1,11 +1,25 @@
-import gzip
+import collections
+import concurrent.futures
+import functools
 import logging
+import multiprocessing
 import os
-import shutil
+import re
+import sqlite3
 import time
 
+import gevent.threadpool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 import teuthology
+from teuthology import archive_index
 from teuthology.contextutil import safe_while
+from teuthology.util import seekable_log
+from teuthology.util.fs import dir_size, remove_tree
 
 log = logging.getLogger(__name__)
 
@@ -13,6 +27,23 @@ log = logging.getLogger(__name__)
 # If we see this in any directory, we do not prune it
 PRESERVE_FILE = '.preserve'
 
+# The subdirectories of a job removed by --remotes
+REMOTE_SUBDIRS = dict(
+    remote='remote logs',
+    data='mon data',
+)
+
+COMPRESSED_SUFFIXES = dict(
+    gzip='.gz',
+    zstd='.zst',
+)
+
+SUCCESS_PATTERN = re.compile(rb'^\s*success: (true|false)\s*$', re.MULTILINE)
+
+# One of the things the pruner found to do. The size of a directory to
+# remove is only known once it has been removed (or, with dry_run, measured)
+Action = collections.namedtuple('Action', 'kind path category size')
+
 
 def main(args):
     """
@@ -27,9 +58,12 @@ def main(args):
     fail_days = int(args['--fail'])
     remotes_days = int(args['--remotes'])
     compress_days = int(args['--compress'])
+    workers = int(args['--workers'])
+    codec = args['--codec']
 
     prune_archive(
-        archive_dir, pass_days, fail_days, remotes_days, compress_days, dry_run
+        archive_dir, pass_days, fail_days, remotes_days, compress_days,
+        dry_run, workers=workers, codec=codec,
     )
 
 
@@ -40,30 +74,143 @@ def prune_archive(
         remotes_days,
         compress_days,
         dry_run=False,
+        workers=8,
+        codec='gzip',
 ):
     """
-    Walk through the archive_dir, calling the cleanup functions to process
-    directories that might be old enough
+    Walk through the archive_dir, finding what in the directories old enough
+    to process should be removed or compressed, then do it.
+
+    Runs are examined, and directories removed, by a pool of threads; logs
+    are compressed by a pool of processes.
+
+    :param workers: How many threads and processes to use
+    :param codec:   'gzip' or 'zstd'; the latter requires the zstandard
+                    module
+    :returns:       A PruneReport of what was (or, with dry_run, would be)
+                    done
     """
+    if codec not in COMPRESSED_SUFFIXES:
+        raise ValueError("Unknown codec: %s" % codec)
+    if codec == 'zstd' and zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard module")
     min_days = min(filter(
-        lambda n: n >= 0, [pass_days, fail_days, remotes_days]))
+        lambda n: n >= 0,
+        [pass_days, fail_days, remotes_days, compress_days]), default=-1)
+    now = time.time()
+    children = scandir(archive_dir)
     log.debug("Archive {archive} has {count} children".format(
-        archive=archive_dir, count=len(os.listdir(archive_dir))))
-    # Use full paths
-    children = [os.path.join(archive_dir, p) for p in listdir(archive_dir)]
+        archive=archive_dir, count=len(children)))
     run_dirs = list()
     for child in children:
         # Ensure that the path is not a symlink, is a directory, and is old
         # enough to process
-        if (not os.path.islink(child) and os.path.isdir(child) and
-                is_old_enough(child, min_days)):
+        if (not child.is_symlink() and child.is_dir() and
+                _is_old(child.stat().st_mtime, min_days, now)):
             run_dirs.append(child)
-    run_dirs.sort(key=lambda p: os.path.getctime(p), reverse=True)
-    for run_dir in run_dirs:
-        log.debug("Processing %s ..." % run_dir)
-        maybe_remove_jobs(run_dir, pass_days, fail_days, dry_run)
-        maybe_remove_remotes(run_dir, remotes_days, dry_run)
-        maybe_compress_logs(run_dir, compress_days, dry_run)
+    run_dirs.sort(key=lambda e: e.stat().st_ctime, reverse=True)
+
+    report = PruneReport(dry_run)
+    prune = functools.partial(
+        prune_run,
+        pass_days=pass_days,
+        fail_days=fail_days,
+        remotes_days=remotes_days,
+        compress_days=compress_days,
+        dry_run=dry_run,
+        now=now,
+    )
+    pool = gevent.threadpool.ThreadPool(max(workers, 1))
+    compressor = None if dry_run else LogCompressorPool(codec, workers)
+    try:
+        # Each run is acted on as soon as it has been examined, so that
+        # space is reclaimed as we go and only a run's worth of actions is
+        # held at a time
+        for actions in pool.imap(prune, [e.path for e in run_dirs]):
+            for action in actions:
+                if action.kind == 'remove' or dry_run:
+                    report.add(action.category, action.size)
+                else:
+                    compressor.submit(action)
+            if compressor is not None:
+                for action, saved in compressor.finished():
+                    report.add(action.category, saved)
+        if compressor is not None:
+            for action, saved in compressor.finished(wait=True):
+                report.add(action.category, saved)
+    finally:
+        pool.kill()
+        if compressor is not None:
+            compressor.close()
+    report.log()
+    return report
+
+
+def prune_run(run_dir, pass_days, fail_days, remotes_days, compress_days,
+              dry_run=False, now=None):
+    """
+    Find what should be removed or compressed in a run directory, and remove
+    it unless dry_run is set
+
+    :returns: A list of Actions, with the sizes of what was (or would be)
+              removed
+    """
+    actions = list()
+    for action in find_actions(run_dir, pass_days, fail_days, remotes_days,
+                               compress_days, now):
+        if action.kind == 'remove':
+            if dry_run:
+                size = dir_size(action.path)
+            else:
+                size = remove(action.path)
+            action = action._replace(size=size)
+        actions.append(action)
+    return actions
+
+
+class PruneReport(object):
+    """
+    Bytes reclaimed, or reclaimable, by category
+    """
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.counts = collections.Counter()
+        self.sizes = collections.Counter()
+
+    def add(self, category, size):
+        self.counts[category] += 1
+        self.sizes[category] += size
+
+    @property
+    def total(self):
+        return sum(self.sizes.values())
+
+    def log(self):
+        if self.dry_run:
+            log.info("Would reclaim (compressed logs are counted in full):")
+        else:
+            log.info("Reclaimed:")
+        for category in sorted(self.sizes):
+            log.info("    {category}: {size:,} bytes in {count}".format(
+                category=category,
+                size=self.sizes[category],
+                count=self.counts[category],
+            ))
+        log.info("    total: {size:,} bytes".format(size=self.total))
+
+
+def scandir(path):
+    """
+    Like listdir(), but returns os.DirEntry objects, whose file types and stat
+    results are cached
+    """
+    with safe_while(sleep=1, increment=1, tries=10) as proceed:
+        while proceed():
+            try:
+                with os.scandir(path) as entries:
+                    return list(entries)
+            except OSError:
+                log.exception("Failed to list %s !" % path)
 
 
 def listdir(path):
@@ -88,150 +235,272 @@ def should_preserve(dir_name):
     return False
 
 
+def _is_old(mtime, days, now=None):
+    if days < 0:
+        return False
+    now = now or time.time()
+    return (now - mtime) / (60 * 60 * 24) > days
+
+
 def is_old_enough(file_name, days):
     """
     :returns: True if the file's modification date is earlier than the amount
               of days specified
     """
-    if days < 0:
-        return False
-    now = time.time()
-    secs_to_days = lambda s: s / (60 * 60 * 24)
-    age = now - os.path.getmtime(file_name)
-    if secs_to_days(age) > days:
-        return True
-    return False
+    return _is_old(os.path.getmtime(file_name), days)
 
 
-def remove(path):
+def job_success(summary_path, tail_size=4096):
     """
-    Attempt to recursively remove a directory. If an OSError is encountered,
-    log it and continue.
+    Find out whether a job passed from its summary.yaml, without parsing it.
+    safe_dump() sorts keys, so 'success' is usually near the end; only the
+    tail of the file is read unless it isn't there.
+
+    :returns: True or False, or None if the summary doesn't say
+    """
+    with open(summary_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(size - tail_size, 0))
+        match = SUCCESS_PATTERN.search(f.read())
+        if match is None and size > tail_size:
+            f.seek(0)
+            match = SUCCESS_PATTERN.search(f.read())
+    if match is None:
+        return None
+    return match.group(1) == b'true'
+
+
+def find_actions(run_dir, pass_days, fail_days, remotes_days, compress_days,
+                 now=None):
+    """
+    Find what should be removed or compressed in a run directory
+
+    :returns: A list of Actions
     """
     try:
-        shutil.rmtree(path)
-    except OSError:
-        log.exception("Failed to remove %s !" % path)
+        return _find_actions(run_dir, pass_days, fail_days, remotes_days,
+                             compress_days, now or time.time())
+    except Exception:
+        log.exception("Failed to process %s !", run_dir)
+        return []
 
 
-def maybe_remove_jobs(run_dir, pass_days, fail_days, dry_run=False):
+def indexed_statuses(run_dir):
     """
-    Remove entire job log directories if they are old enough and the job passed
+    :returns: A dict of the statuses of the run's finished jobs according to
+              the archive index, or None if there is no index or it can't
+              be used
     """
-    if pass_days < 0 and fail_days < 0:
-        return
-    contents = listdir(run_dir)
-    if PRESERVE_FILE in contents:
-        return
-    for child in contents:
-        job_path = os.path.join(run_dir, child)
+    archive_dir, run_name = os.path.split(run_dir.rstrip('/'))
+    index = archive_index.get_index(archive_dir)
+    if index is None:
+        return None
+    try:
+        return dict((job['job_id'], job['status'])
+                    for job in index.jobs(run_name, finished=True))
+    except (OSError, sqlite3.Error):
+        log.warning("Could not use the archive index for %s", run_dir,
+                    exc_info=True)
+        return None
+    finally:
+        index.close()
+
+
+def _find_actions(run_dir, pass_days, fail_days, remotes_days, compress_days,
+                  now):
+    log.debug("Processing %s ..." % run_dir)
+    actions = list()
+    contents = scandir(run_dir)
+    if any(entry.name == PRESERVE_FILE for entry in contents):
+        return actions
+    statuses = None
+    if pass_days >= 0 or fail_days >= 0:
+        statuses = indexed_statuses(run_dir)
+    for entry in contents:
+        job_path = entry.path
         # Ensure the path isn't marked for preservation and that it is a
         # directory
-        if should_preserve(job_path) or not os.path.isdir(job_path):
+        if not entry.is_dir() or should_preserve(job_path):
             continue
-        # Is it a job dir?
-        summary_path = os.path.join(job_path, 'summary.yaml')
-        if not os.path.exists(summary_path):
+        status = statuses.get(entry.name) if statuses else None
+        if _job_removal(actions, job_path, pass_days, fail_days, now,
+                        status):
             continue
-        # Depending on whether it passed or failed, we have a different age
-        # threshold
-        summary_lines = [line.strip() for line in
-                         open(summary_path).readlines()]
-        if 'success: true' in summary_lines:
-            status = 'passed'
-            days = pass_days
-        elif 'success: false' in summary_lines:
-            status = 'failed'
-            days = fail_days
+        job_mtime = entry.stat().st_mtime
+        if _is_old(job_mtime, remotes_days, now):
+            for (subdir, description) in REMOTE_SUBDIRS.items():
+                subdir_path = os.path.join(job_path, subdir)
+                if not os.path.isdir(subdir_path):
+                    continue
+                log.info("{job} is {days} days old; removing {desc}".format(
+                    job=job_path,
+                    days=remotes_days,
+                    desc=description,
+                ))
+                actions.append(Action('remove', subdir_path, description,
+                                      None))
+        if _is_old(job_mtime, compress_days, now):
+            log_name = 'teuthology.log'
+            log_path = os.path.join(job_path, log_name)
+            try:
+                size = os.stat(log_path).st_size
+            except OSError:
+                continue
+            log.info("{job} is {days} days old; compressing {name}".format(
+                job=job_path,
+                days=compress_days,
+                name=log_name,
+            ))
+            actions.append(Action('compress', log_path, 'compressed logs',
+                                  size))
+    return actions
+
+
+def _job_removal(actions, job_path, pass_days, fail_days, now, status=None):
+    """
+    Add an action removing the job if it is old enough and, depending on
+    whether it passed, should be removed
+
+    :param status: The job's status according to the archive index, if
+                   known; otherwise its summary.yaml is read
+    :returns: True if the job will be removed
+    """
+    if pass_days < 0 and fail_days < 0:
+        return False
+    # Is it a job dir?
+    summary_path = os.path.join(job_path, 'summary.yaml')
+    try:
+        summary_mtime = os.stat(summary_path).st_mtime
+        if status == 'pass':
+            success = True
+        elif status in ('fail', 'dead'):
+            success = False
         else:
-            continue
-        # Ensure the directory is old enough to remove
-        if not is_old_enough(summary_path, days):
-            continue
-        log.info("{job} is a {days}-day old {status} job; removing".format(
-            job=job_path, days=days, status=status))
-        if not dry_run:
-            remove(job_path)
+            success = job_success(summary_path)
+    except OSError:
+        return False
+    # Depending on whether it passed or failed, we have a different age
+    # threshold
+    if success is True:
+        status = 'passed'
+        days = pass_days
+    elif success is False:
+        status = 'failed'
+        days = fail_days
+    else:
+        return False
+    # Ensure the directory is old enough to remove
+    if not _is_old(summary_mtime, days, now):
+        return False
+    log.info("{job} is a {days}-day old {status} job; removing".format(
+        job=job_path, days=days, status=status))
+    actions.append(Action('remove', job_path, '%s jobs' % status, None))
+    return True
 
 
-def maybe_remove_remotes(run_dir, days, dry_run=False):
+def remove(path):
     """
-    Remove remote logs (not teuthology logs) from job directories if they are
-    old enough
+    Attempt to recursively remove a directory. If an OSError is encountered,
+    log it and continue.
+
+    :returns: The number of bytes removed
     """
-    if days < 0:
-        return
-    contents = listdir(run_dir)
-    subdirs = dict(
-        remote='remote logs',
-        data='mon data',
-    )
-    if PRESERVE_FILE in contents:
-        return
-    for child in contents:
-        item = os.path.join(run_dir, child)
-        # Ensure the path isn't marked for preservation, that it is a
-        # directory, and that it is old enough
-        if (should_preserve(item) or not os.path.isdir(item) or not
-                is_old_enough(item, days)):
-            continue
-        for (subdir, description) in subdirs.items():
-            _maybe_remove_subdir(item, subdir, days, description, dry_run)
+    return remove_tree(path)
 
 
-def _maybe_remove_subdir(job_dir, subdir, days, description, dry_run=False):
-    # Does the subdir exist?
-    subdir_path = os.path.join(job_dir, subdir)
-    if not os.path.isdir(subdir_path):
-        return
-    log.info("{job} is {days} days old; removing {desc}".format(
-        job=job_dir,
-        days=days,
-        desc=description,
-    ))
-    if not dry_run:
-        remove(subdir_path)
+class LogCompressorPool(object):
+    """
+    Compress logs in a pool of processes, removing the originals, as they
+    are submitted. With one worker, logs are compressed as they are
+    submitted instead.
 
+    :param codec:   'gzip' or 'zstd'
+    :param workers: How many processes to use
+    """
+    def __init__(self, codec='gzip', workers=8):
+        self.codec = codec
+        self.workers = workers
+        self.pool = None
+        self.pending = dict()
+        self.done = list()
 
-def maybe_compress_logs(run_dir, days, dry_run=False):
-    if days < 0:
-        return
-    contents = listdir(run_dir)
-    if PRESERVE_FILE in contents:
-        return
-    for child in contents:
-        item = os.path.join(run_dir, child)
-        # Ensure the path isn't marked for preservation, that it is a
-        # directory, and that it is old enough
-        if (should_preserve(item) or not os.path.isdir(item) or not
-                is_old_enough(item, days)):
-            continue
-        log_name = 'teuthology.log'
-        log_path = os.path.join(item, log_name)
-        if not os.path.exists(log_path):
-            continue
-        log.info("{job} is {days} days old; compressing {name}".format(
-            job=item,
-            days=days,
-            name=log_name,
-        ))
-        if dry_run:
-            continue
-        zlog_path = log_path + '.gz'
-        try:
-            _compress(log_path, zlog_path)
-        except Exception:
-            log.exception("Failed to compress %s", log_path)
-            os.remove(zlog_path)
+    def submit(self, action):
+        if self.workers <= 1:
+            self.done.append((action, compress_log(action.path, self.codec)))
+            return
+        if self.pool is None:
+            # multiprocessing.Pool's helper threads don't get along with
+            # gevent's monkey-patching; ProcessPoolExecutor's do
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context('fork'))
+        # Don't let the backlog grow without bound while runs are examined
+        # faster than their logs are compressed
+        while len(self.pending) >= self.workers * 4:
+            self._collect(concurrent.futures.wait(
+                list(self.pending),
+                return_when=concurrent.futures.FIRST_COMPLETED)[0])
+        future = self.pool.submit(compress_log, action.path, self.codec)
+        self.pending[future] = action
+
+    def _collect(self, done):
+        for future in done:
+            action = self.pending.pop(future)
+            try:
+                saved = future.result()
+            except Exception:
+                log.exception("Failed to compress %s", action.path)
+                saved = None
+            self.done.append((action, saved))
+
+    def finished(self, wait=False):
+        """
+        Yield (action, bytes saved) for each log that has been compressed
+        since the last call; bytes saved is None if it could not be
+
+        :param wait: Wait for every submitted log to be compressed
+        """
+        if wait:
+            self._collect(concurrent.futures.wait(list(self.pending))[0])
         else:
-            os.remove(log_path)
+            self._collect([f for f in self.pending if f.done()])
+        done, self.done = self.done, list()
+        for action, saved in done:
+            if saved is not None:
+                yield action, saved
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def compress_log(log_path, codec='gzip'):
+    """
+    Compress a log, removing the original
+
+    :returns: The number of bytes saved, or None if it could not be
+              compressed
+    """
+    zlog_path = log_path + COMPRESSED_SUFFIXES[codec]
+    try:
+        size = os.stat(log_path).st_size
+        _compress(log_path, zlog_path, codec)
+        saved = size - os.stat(zlog_path).st_size
+    except Exception:
+        log.exception("Failed to compress %s", log_path)
+        for path in (zlog_path, zlog_path + seekable_log.INDEX_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+        return None
+    os.remove(log_path)
+    return saved
 
 
-def _compress(in_path, out_path):
+def _compress(in_path, out_path, codec='gzip'):
     """
-    Compresses a file using gzip, preserving the original permissions, atime,
-    and mtime.  Does not remove the original.
+    Compresses a file into the seekable log format using gzip or zstd,
+    preserving the original permissions, atime, and mtime.  Does not remove
+    the original.
     """
-    with open(in_path, 'rb') as src, gzip.open(out_path, 'wb') as dest:
-        shutil.copyfileobj(src, dest)
-        shutil.copystat(in_path, out_path)
+    seekable_log.compress(in_path, out_path, codec)
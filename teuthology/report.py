@@ -6,12 +6,17 @@ import requests
 import logging
 import random
 import socket
+import sqlite3
+import time
 from datetime import datetime
 
 import teuthology
+from teuthology import archive_index
 from teuthology.config import config
 from teuthology.contextutil import safe_while
 from teuthology.job_status import get_status, set_status
+from teuthology.parallel import parallel
+from teuthology.util import http_client
 
 report_exceptions = (requests.exceptions.RequestException, socket.error)
 
@@ -40,10 +45,13 @@ def main(args):
     archive_base = os.path.abspath(os.path.expanduser(args['--archive'])) or \
         config.archive_base
     save = not args['--no-save']
+    workers = int(args['--workers'])
+    batch_size = int(args['--batch'])
 
     log = init_logging()
     reporter = ResultsReporter(archive_base, save=save, refresh=refresh,
-                               log=log)
+                               log=log, workers=workers,
+                               batch_size=batch_size)
     if dead and not job:
         for run_name in run:
             try_mark_run_dead(run[0])
@@ -67,10 +75,35 @@ class ResultsSerializer(object):
     """
     yamls = ('orig.config.yaml', 'config.yaml', 'info.yaml', 'summary.yaml')
 
-    def __init__(self, archive_base, log=None):
+    def __init__(self, archive_base, log=None, index=None):
+        """
+        :param index: An ArchiveIndex to list runs and jobs with. Defaults to
+                      one if config.archive_index is set; otherwise the
+                      archive directory is listed.
+        """
         self.archive_base = archive_base or config.archive_base
         self.log = log or init_logging()
+        self.index = index or archive_index.get_index(self.archive_base)
+
+    def _from_index(self, method, *args, **kwargs):
+        """
+        Call one of the index's methods
 
+        :returns: What it returned, or None if there is no index or it
+                  can't be used - e.g. it's locked, or has another schema
+                  version - in which case the archive is read instead from
+                  then on
+        """
+        if self.index is None:
+            return None
+        try:
+            return getattr(self.index, method)(*args, **kwargs)
+        except (sqlite3.Error, OSError):
+            self.log.warning(
+                "Could not use the archive index; reading the archive "
+                "instead", exc_info=True)
+            self.index = None
+            return None
 
     def job_info(self, run_name, job_id, pretty=False, simple=False):
         """
@@ -139,6 +172,12 @@ class ResultsSerializer(object):
         :returns:        A dict like: {'1': '/path/to/1', '2': 'path/to/2'}
         """
         archive_dir = os.path.join(self.archive_base, run_name)
+        indexed = self._from_index('jobs', run_name)
+        if indexed is not None:
+            return dict(
+                (job['job_id'], os.path.join(archive_dir, job['job_id']))
+                for job in indexed
+            )
         if not os.path.isdir(archive_dir):
             return {}
         jobs = {}
@@ -158,6 +197,13 @@ class ResultsSerializer(object):
         :param run_name: The name of the run.
         :returns:        A dict like: {'1': '/path/to/1', '2': 'path/to/2'}
         """
+        indexed = self._from_index('jobs', run_name, finished=False)
+        if indexed is not None:
+            archive_dir = os.path.join(self.archive_base, run_name)
+            return dict(
+                (job['job_id'], os.path.join(archive_dir, job['job_id']))
+                for job in indexed
+            )
         jobs = self.jobs_for_run(run_name)
         for job_id in list(jobs):
             if os.path.exists(os.path.join(jobs[job_id], 'summary.yaml')):
@@ -170,6 +216,9 @@ class ResultsSerializer(object):
         Look in the base archive directory for all test runs. Return a list of
         their names.
         """
+        indexed = self._from_index('runs')
+        if indexed is not None:
+            return indexed
         archive_base = self.archive_base
         if not os.path.isdir(archive_base):
             return []
@@ -181,11 +230,52 @@ class ResultsSerializer(object):
         return runs
 
 
+class ReportProgress(object):
+    """
+    Keep track of how many of a run's jobs have been reported, logging the
+    progress and throughput every so often.
+    """
+    def __init__(self, run_name, total, log, interval=30):
+        self.run_name = run_name
+        self.total = total
+        self.log = log
+        self.interval = interval
+        self.done = 0
+        self.start = self.last_log = time.time()
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.start
+        if not elapsed:
+            return 0.0
+        return self.done / elapsed
+
+    def update(self, count=1):
+        self.done += count
+        now = time.time()
+        if self.done < self.total and now - self.last_log >= self.interval:
+            self.last_log = now
+            self.log.info("    %s: %s/%s jobs (%.1f jobs/sec)",
+                          self.run_name, self.done, self.total, self.rate)
+
+    def finish(self):
+        self.log.info("    %s: reported %s jobs in %.1fs (%.1f jobs/sec)",
+                      self.run_name, self.done, time.time() - self.start,
+                      self.rate)
+
+
 class ResultsReporter(object):
     last_run_file = 'last_successful_run'
 
     def __init__(self, archive_base=None, base_uri=None, save=False,
-                 refresh=False, log=None):
+                 refresh=False, log=None, workers=8, batch_size=0):
+        """
+        :param workers:    How many jobs to read and post at once
+        :param batch_size: If greater than one, post up to this many jobs in
+                           each request. Results servers that don't accept
+                           lists of jobs are detected, after which jobs are
+                           posted one at a time.
+        """
         self.log = log or init_logging()
         self.archive_base = archive_base or config.archive_base
         self.base_uri = base_uri or config.results_server
@@ -195,17 +285,20 @@ class ResultsReporter(object):
         self.serializer = ResultsSerializer(archive_base, log=self.log)
         self.save_last_run = save
         self.refresh = refresh
-        self.session = self._make_session()
+        self.workers = max(workers, 1)
+        self.batch_size = batch_size
+        self.session = self._make_session(pool_size=self.workers)
 
         if not self.base_uri:
             msg = "No results_server set in {yaml}; cannot report results"
             self.log.warning(msg.format(yaml=config.yaml_path))
 
-    def _make_session(self, max_retries=10):
-        session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=max_retries)
-        session.mount('http://', adapter)
-        return session
+    def _make_session(self, max_retries=10, pool_size=10):
+        # Keep a connection open for each worker so that concurrent
+        # reporting doesn't reconnect for every job. Failed responses are
+        # handled (and batches retried) by the reporter itself.
+        return http_client.make_session(pool_size=pool_size,
+                                        retries=max_retries, statuses=())
 
     def report_all_runs(self):
         """
@@ -228,6 +321,7 @@ class ResultsReporter(object):
         """
         num_runs = len(run_names)
         num_jobs = 0
+        start = time.time()
         self.log.info("Posting %s runs", num_runs)
         for run in run_names:
             job_count = self.report_run(run)
@@ -235,7 +329,11 @@ class ResultsReporter(object):
             if self.save_last_run:
                 self.last_run = run
         del self.last_run
-        self.log.info("Total: %s jobs in %s runs", num_jobs, len(run_names))
+        elapsed = time.time() - start
+        self.log.info("Total: %s jobs in %s runs in %.1fs (%.1f jobs/sec)",
+                      num_jobs, len(run_names), elapsed,
+                      num_jobs / elapsed if elapsed else 0.0)
+        http_client.log_stats()
 
     def report_run(self, run_name, dead=False):
         """
@@ -266,11 +364,85 @@ class ResultsReporter(object):
         """
         Report several jobs to the results server.
 
+        Up to self.workers jobs (or batches of jobs) are read from the archive
+        and posted at once.
+
         :param run_name: The name of the run.
         :param job_ids:  The jobs' ids
+        :returns:        The number of jobs reported.
         """
-        for job_id in job_ids:
-            self.report_job(run_name, job_id, dead=dead)
+        job_ids = list(job_ids)
+        progress = ReportProgress(run_name, len(job_ids), self.log)
+        size = max(self.batch_size, 1)
+        with parallel(size=self.workers) as p:
+            for i in range(0, len(job_ids), size):
+                p.spawn(self._report_chunk, run_name, job_ids[i:i + size],
+                        dead, progress)
+        progress.finish()
+        return len(job_ids)
+
+    def _report_chunk(self, run_name, job_ids, dead, progress):
+        job_infos = [self.serializer.job_info(run_name, job_id)
+                     for job_id in job_ids]
+        if len(job_infos) > 1 and \
+                self.report_job_batch(run_name, job_infos, dead=dead):
+            progress.update(len(job_infos))
+            return
+        for job_id, job_info in zip(job_ids, job_infos):
+            self.report_job(run_name, job_id, job_info=job_info, dead=dead)
+            progress.update()
+
+    def report_job_batch(self, run_name, job_infos, dead=False):
+        """
+        Report several jobs to the results server in a single request. Only
+        some results servers accept lists of jobs, and those that don't fail
+        in different ways; so once a batch is refused for any reason other
+        than that its jobs already exist, batching is turned off for this
+        reporter. Connection failures are retried. If the batch isn't
+        accepted, its jobs should be reported one at a time.
+
+        :param run_name:  The name of the run. The run must already exist.
+        :param job_infos: A list of the jobs' info dicts
+        :returns:         True if the server accepted the jobs.
+        """
+        if self.batch_size <= 1:
+            return False
+        run_uri = "{base}/runs/{name}/jobs/".format(
+            base=self.base_uri, name=run_name,)
+        if dead:
+            for job_info in job_infos:
+                if get_status(job_info) is None:
+                    set_status(job_info, 'dead')
+        job_json = json.dumps(job_infos)
+        headers = {'content-type': 'application/json'}
+        response = None
+        inc = random.uniform(0, 1)
+        with safe_while(
+                sleep=1, increment=inc, tries=5, _raise=False,
+                action=f'report {len(job_infos)} jobs') as proceed:
+            while proceed():
+                try:
+                    response = self.session.post(run_uri, data=job_json,
+                                                 headers=headers)
+                    break
+                except requests.RequestException as e:
+                    self.log.warning("POST of jobs to %s failed: %s",
+                                     run_uri, e)
+        if response is None:
+            return False
+        if response.status_code == 200:
+            return True
+        # The server understood the list, but some of its jobs had been
+        # reported before; they need to be updated one at a time
+        if 'already exists' in response.text:
+            return False
+        if self.batch_size > 1:
+            self.log.info(
+                "POST of %s jobs to %s failed with status %s; posting jobs "
+                "one at a time", len(job_infos), run_uri,
+                response.status_code)
+            self.batch_size = 0
+        return False
 
     def report_job(self, run_name, job_id, job_info=None, dead=False):
         """
@@ -9,7 +9,9 @@ from teuthology import report
 from teuthology.job_status import get_status
 from teuthology.misc import get_user, merge_configs
 from teuthology.nuke import nuke
+from teuthology.orchestra.run import command_trace
 from teuthology.run_tasks import run_tasks
+from teuthology.tracing import tracer
 from teuthology.repo_utils import fetch_qa_suite
 from teuthology.results import email_results
 from teuthology.config import FakeNamespace
@@ -273,6 +275,11 @@ def report_outcome(config, archive, summary, fake_ctx):
     if archive is not None:
         with open(os.path.join(archive, 'summary.yaml'), 'w') as f:
             yaml.safe_dump(summary, f, default_flow_style=False)
+        try:
+            command_trace.write(os.path.join(archive, 'command_trace.jsonl'))
+            tracer.write(os.path.join(archive, 'trace.json'))
+        except OSError:
+            log.exception('Failed to write the job traces')
 
     summary_dump = yaml.safe_dump(summary)
     log.info('Summary data:\n%s' % summary_dump)
@@ -11,6 +11,7 @@ from copy import deepcopy
 from humanfriendly import format_timespan
 import sentry_sdk
 
+from teuthology import tracing
 from teuthology.config import config as teuth_config
 from teuthology.exceptions import ConnectionLostError
 from teuthology.job_status import set_status, get_status
@@ -79,7 +80,12 @@ def _import(from_package, module_name, task_name, fail_on_import_error=False):
 def run_one_task(taskname, **kwargs):
     taskname = taskname.replace('-', '_')
     task = get_task(taskname)
-    return task(**kwargs)
+    start = time.time()
+    manager = task(**kwargs)
+    if hasattr(manager, '__enter__'):
+        return tracing.TracedManager(taskname, manager)
+    tracing.tracer.add(taskname, 'task', start, time.time())
+    return manager
 
 
 def run_tasks(tasks, ctx):
@@ -108,6 +108,7 @@ def schedule_job(job_config, num=1, report_status=True):
         print('Job scheduled with name {name} and ID {jid}'.format(
             name=job_config['name'], jid=jid))
         job_config['job_id'] = str(jid)
+        teuthology.beanstalk.index_job(tube, job_config['name'], jid)
         if report_status:
             report.try_push_job_info(job_config, dict(status='queued'))
         num -= 1
@@ -1,9 +1,13 @@
 # Origin: https://github.com/jcsp/scrape/blob/master/scrape.py
 # Author: John Spray (github.com/jcsp)
 
+import concurrent.futures
 import difflib
+import functools
 from errno import ENOENT
 from gzip import GzipFile
+import mmap
+import multiprocessing
 import sys
 import os
 import yaml
@@ -11,6 +15,9 @@ from collections import defaultdict
 import re
 import logging
 import subprocess
+import zlib
+
+from teuthology.util import seekable_log
 
 
 log = logging.getLogger('scrape')
@@ -25,6 +32,14 @@ class Reason(object):
     def get_detail(self):
         return None
 
+    @classmethod
+    def signature(cls, job):
+        """
+        The FailureSignature of a job this kind of reason would be made for
+        """
+        return FailureSignature(cls.__name__,
+                                normalize(job.get_failure_reason() or ''))
+
 
 def grep(path, expr):
     """
@@ -56,6 +71,21 @@ class GenericReason(Reason):
     def get_detail(self):
         return self.backtrace
 
+    @classmethod
+    def signature(cls, job):
+        backtrace = job.get_backtrace()
+        if backtrace:
+            return FailureSignature('Crash', *backtrace_frames(backtrace),
+                                    fuzzy=True)
+        failure_reason = job.get_failure_reason() or ''
+        if "Test failure:" in failure_reason:
+            return FailureSignature('TestFailure', failure_reason)
+        match = re.search(r"workunit test (.*)\) on ", failure_reason)
+        if match:
+            return FailureSignature('Workunit', match.group(1))
+        return FailureSignature('Failure', normalize(failure_reason),
+                                fuzzy=True)
+
     def get_description(self):
         if self.description:
             return self.description
@@ -131,6 +161,10 @@ class AssertionReason(Reason):
     def could_be(cls, job):
         return job.get_assertion() is not None
 
+    @classmethod
+    def signature(cls, job):
+        return FailureSignature('Assertion', normalize(job.get_assertion()))
+
     def match(self, job):
         return self.assertion == job.get_assertion()
 
@@ -149,6 +183,13 @@ class LockdepReason(AssertionReason):
 
         return "common/lockdep" in job.get_assertion()
 
+    @classmethod
+    def signature(cls, job):
+        backtrace = job.get_backtrace()
+        frames = backtrace_frames(backtrace) if backtrace else ()
+        return FailureSignature('Lockdep', normalize(job.get_assertion()),
+                                *frames, fuzzy=bool(frames))
+
     def get_description(self):
         return "Lockdep: {0}".format(self.assertion)
 
@@ -186,6 +227,19 @@ class DeadReason(Reason):
     def could_be(cls, job):
         return job.summary_data is None
 
+    @classmethod
+    def signature(cls, job):
+        backtrace = job.get_backtrace()
+        if backtrace:
+            return FailureSignature('Dead', *backtrace_frames(backtrace),
+                                    fuzzy=True)
+        last_tlog_line = job.get_last_tlog_line()
+        if last_tlog_line is None:
+            return FailureSignature('Dead')
+        return FailureSignature(
+            'Dead', normalize(last_tlog_line.decode(errors='replace')),
+            fuzzy=True)
+
     def match(self, job):
         if job.summary_data:
             return False
@@ -220,6 +274,10 @@ class TimeoutReason(Reason):
     def could_be(cls, job):
         return cls.get_timeout(job) is not None
 
+    @classmethod
+    def signature(cls, job):
+        return FailureSignature('Timeout', *cls.get_timeout(job))
+
     @classmethod
     def get_timeout(cls, job):
         if job.get_failure_reason() is None:
@@ -252,6 +310,181 @@ class TimeoutReason(Reason):
 MAX_TEUTHOLOGY_LOG = 1024 * 1024 * 100
 MAX_SVC_LOG = 100 * 1024 * 1024
 MAX_BT_LINES = 100
+# What lines reporting valgrind issues have in common
+VALGRIND_ISSUE = '</kind> in '
+
+# Everything the reasons look for in a log, so that it can be found in a
+# single pass. Lines from daemons' stderr have a teuthology log prefix ending
+# in '.stderr:', which the backtrace markers follow.
+LOG_PATTERN = re.compile(
+    rb'^(?:[^\n]*?\.stderr:)?(?:'
+    rb'(?P<bt_start> ceph version)|'
+    rb'(?P<bt_end> NOTE: a copy of the executable)'
+    rb')[^\n]*$|'
+    rb'^[^\n]*(?:'
+    rb'(?P<assertion>FAILED assert)|'
+    rb'(?P<crash>command crashed with signal)|'
+    rb'(?P<valgrind></kind> in )'
+    rb')[^\n]*$',
+    re.MULTILINE,
+)
+
+
+def _strip_prefix(line):
+    if ".stderr:" in line:
+        return line.split(".stderr:", 1)[1]
+    return line
+
+
+class LogFeatures(object):
+    """
+    What a single pass over a log found, for reasons to match against
+
+    :param backtrace:  The first complete backtrace, or None
+    :param assertion:  The last failed assertion before the backtrace ended
+    :param crashes:    Lines saying a command crashed with a signal
+    :param valgrind:   Lines reporting valgrind issues
+    :param last_line:  The log's last line, as bytes
+    """
+    def __init__(self, backtrace=None, assertion=None, crashes=None,
+                 valgrind=None, last_line=None):
+        self.backtrace = backtrace
+        self.assertion = assertion
+        self.crashes = crashes or []
+        self.valgrind = valgrind or []
+        self.last_line = last_line
+
+    @classmethod
+    def scan(cls, data):
+        """
+        Find the features of a log
+
+        :param data: The log's contents; bytes or an mmap
+        """
+        scanner = _LogScanner()
+        scanner.feed(data)
+        return scanner.finish()
+
+    @classmethod
+    def scan_chunks(cls, chunks, limit=None):
+        """
+        Find the features of a log read a piece at a time, e.g. a compressed
+        log's frames, without holding all of it in memory
+
+        :param chunks: An iterable of bytes
+        :param limit:  If the log turns out to be larger than this, stop and
+                       return None
+        """
+        scanner = _LogScanner()
+        carry = b""
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            if limit is not None and total > limit:
+                return None
+            data = carry + chunk
+            # Only scan whole lines; keep the rest for the next chunk
+            cut = data.rfind(b"\n") + 1
+            scanner.feed(data[:cut])
+            carry = data[cut:]
+        scanner.feed(carry)
+        return scanner.finish()
+
+    @classmethod
+    def scan_file(cls, path):
+        """
+        Find the features of the log at path, mapping it into memory rather
+        than reading it
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls.scan(b"")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return cls.scan(data)
+
+
+class _LogScanner(object):
+    """
+    LogFeatures.scan(), fed whole lines at a time. A backtrace that isn't
+    complete at the end of one feed is carried over to the next.
+    """
+    # Give up on a backtrace that goes on for longer than this
+    max_backtrace_bytes = 1024 * 1024
+
+    def __init__(self):
+        self.features = LogFeatures()
+        self.backtrace_done = False
+        # The start of the backtrace in the data being fed, or the
+        # backtrace so far from previous feeds
+        self.bt_start = None
+        self.bt_partial = None
+        self.last = b""
+
+    def feed(self, data):
+        if not data:
+            return
+        self.last = data
+        features = self.features
+        for match in LOG_PATTERN.finditer(data):
+            kind = match.lastgroup
+            if kind == 'crash':
+                features.crashes.append(
+                    match.group(0).decode(errors='replace'))
+                continue
+            if kind == 'valgrind':
+                features.valgrind.append(
+                    match.group(0).decode(errors='replace'))
+                continue
+            if self.backtrace_done:
+                continue
+            if kind == 'assertion':
+                line = match.group(0).decode(errors='replace')
+                features.assertion = _strip_prefix(line).strip()
+            elif kind == 'bt_start':
+                self.bt_start = match.start()
+                self.bt_partial = None
+            elif kind == 'bt_end':
+                if self.bt_start is not None:
+                    bt_data = data[self.bt_start:match.start()]
+                elif self.bt_partial is not None:
+                    bt_data = self.bt_partial + data[:match.start()]
+                else:
+                    log.warning("Saw end of BT but not start")
+                    continue
+                self.bt_start = None
+                self.bt_partial = None
+                self._backtrace(bt_data)
+        if self.bt_start is not None:
+            self.bt_partial = bytes(data[self.bt_start:])
+            self.bt_start = None
+        elif self.bt_partial is not None:
+            self.bt_partial += data
+        if self.bt_partial is not None and \
+                len(self.bt_partial) > self.max_backtrace_bytes:
+            log.warning("Ignoring backtrace longer than {0} bytes".format(
+                self.max_backtrace_bytes))
+            self.bt_partial = None
+
+    def _backtrace(self, bt_data):
+        bt_lines = bt_data.decode(errors='replace').splitlines(True)
+        if len(bt_lines) > MAX_BT_LINES:
+            # Something wrong with our parsing, drop it
+            log.warning("Ignoring malparsed backtrace: {0}".format(
+                ", ".join(bt_lines[0:3])
+            ))
+            return
+        self.features.backtrace = "".join(
+            _strip_prefix(line) for line in bt_lines).strip()
+        self.backtrace_done = True
+
+    def finish(self):
+        data = self.last
+        end = len(data)
+        if end and data[end - 1:end] == b"\n":
+            end -= 1
+        self.features.last_line = \
+            bytes(data[data.rfind(b"\n", 0, end) + 1:end]).strip()
+        return self.features
 
 
 class Job(object):
@@ -276,6 +509,9 @@ class Job(object):
         self.backtrace = None
         self.assertion = None
         self.populated = False
+        self.features = None
+        self.scanned = False
+        self.valgrind_lines = None
 
     def get_success(self):
         if self.summary_data:
@@ -289,45 +525,91 @@ class Job(object):
         else:
             return None
 
-    def get_last_tlog_line(self):
+    @property
+    def tlog_path(self):
+        """
+        The path of the job's teuthology.log, which may have been compressed
+        """
         t_path = os.path.join(self.path, "teuthology.log")
-        if not os.path.exists(t_path):
-            return None
-        else:
-            out, err = subprocess.Popen(["tail", "-n", "1", t_path], stdout=subprocess.PIPE).communicate()
-            return out.strip()
-
-    def _search_backtrace(self, file_obj):
-        bt_lines = []
-        assertion = None
-        for line in file_obj:
-            # Log prefix from teuthology.log
-            if ".stderr:" in line:
-                line = line.split(".stderr:")[1]
-
-            if "FAILED assert" in line:
-                assertion = line.strip()
-
-            if line.startswith(" ceph version"):
-                # The start of a backtrace!
-                bt_lines = [line]
-            elif line.startswith(" NOTE: a copy of the executable"):
-                # The backtrace terminated, if we have a buffer return it
-                if len(bt_lines):
-                    return ("".join(bt_lines)).strip(), assertion
+        return seekable_log.find_log(t_path) or t_path
+
+    def get_features(self):
+        """
+        The LogFeatures of the job's teuthology.log, or None if it has none
+        or it is too large to scan
+        """
+        if not self.scanned:
+            t_path = self.tlog_path
+            try:
+                if t_path.endswith(('.gz', '.zst')):
+                    reader = seekable_log.SeekableLogReader(t_path)
+                    size = reader.size
                 else:
-                    log.warning("Saw end of BT but not start")
-            elif bt_lines:
-                # We're in a backtrace, push the line onto the list
-                if len(bt_lines) > MAX_BT_LINES:
-                    # Something wrong with our parsing, drop it
-                    log.warning("Ignoring malparsed backtrace: {0}".format(
-                        ", ".join(bt_lines[0:3])
-                    ))
-                    bt_lines = []
-                bt_lines.append(line)
-
-        return None, assertion
+                    reader = None
+                    size = os.stat(t_path).st_size
+                if size is not None and size > MAX_TEUTHOLOGY_LOG:
+                    self.features = None
+                elif reader is not None:
+                    # Without an index, the size is only known once the log
+                    # has been read that far
+                    self.features = LogFeatures.scan_chunks(
+                        reader.chunks(), limit=MAX_TEUTHOLOGY_LOG)
+                else:
+                    self.features = LogFeatures.scan_file(t_path)
+                if self.features is None:
+                    log.debug("Ignoring teuthology log for job {0}, it is "
+                              "over {1} bytes".format(
+                                  self.job_id, MAX_TEUTHOLOGY_LOG))
+            except (IOError, OSError):
+                self.features = None
+            self.scanned = True
+        return self.features
+
+    def get_valgrind_lines(self):
+        """
+        The lines of the job's teuthology.log reporting valgrind issues. If
+        the log is too large to scan, it is searched for only those lines.
+        """
+        if self.valgrind_lines is None:
+            features = self.get_features()
+            if features is not None:
+                self.valgrind_lines = features.valgrind
+            else:
+                self.valgrind_lines = self._grep_tlog(VALGRIND_ISSUE)
+        return self.valgrind_lines
+
+    def _grep_tlog(self, expr):
+        t_path = self.tlog_path
+        try:
+            if t_path.endswith(('.gz', '.zst')):
+                reader = seekable_log.SeekableLogReader(t_path)
+                return [line.decode(errors='replace')
+                        for line in reader.grep(re.escape(expr))]
+            return [line for line in grep(t_path, expr) if line]
+        except (IOError, OSError):
+            return []
+
+    def populate(self):
+        """
+        Do all the reading the reasons need up front. Only failed jobs get
+        reasons, so passed jobs' logs aren't read.
+        """
+        if self.get_success() is True:
+            return self
+        self.get_features()
+        self.get_backtrace()
+        return self
+
+    def get_last_tlog_line(self):
+        features = self.get_features()
+        if features is not None:
+            return features.last_line
+        # The log is missing or too large to scan; its tail is cheap to read
+        try:
+            lines = seekable_log.tail(self.tlog_path)
+        except (IOError, OSError):
+            return None
+        return lines[-1].strip() if lines else None
 
     def get_assertion(self):
         if not self.populated:
@@ -340,22 +622,20 @@ class Job(object):
         return self.backtrace
 
     def _populate_backtrace(self):
-        tlog_path = os.path.join(self.path, "teuthology.log")
-        try:
-            s = os.stat(tlog_path)
-        except OSError:
+        self.populated = True
+        tlog_path = self.tlog_path
+        if not os.path.exists(tlog_path):
             log.warning("Missing teuthology log {0}".format(tlog_path))
             return None
-        size = s.st_size
-        if size > MAX_TEUTHOLOGY_LOG:
-            log.debug("Ignoring teuthology log for job {0}, it is {1} bytes".format(self.job_id, size))
-            return None
 
-        self.backtrace, self.assertion = self._search_backtrace(open(tlog_path))
+        features = self.get_features()
+        if features is None:
+            return None
+        self.backtrace, self.assertion = features.backtrace, features.assertion
         if self.backtrace:
             return
 
-        for line in grep(tlog_path, "command crashed with signal"):
+        for line in features.crashes:
             log.debug("Found a crash indication: {0}".format(line))
             # tasks.ceph.osd.1.plana82.stderr
             match = re.search(r"tasks.ceph.([^\.]+).([^\.]+).([^\.]+).stderr", line)
@@ -382,11 +662,13 @@ class Job(object):
                 ))
                 continue
 
-            bt, ass = self._search_backtrace(GzipFile(gzipped_log_path))
-            if ass and not self.assertion:
-                self.assertion = ass
-            if bt:
-                self.backtrace = bt
+            with GzipFile(gzipped_log_path) as f:
+                svc_features = LogFeatures.scan_chunks(
+                    iter(functools.partial(f.read, 1024 * 1024), b""))
+            if svc_features.assertion and not self.assertion:
+                self.assertion = svc_features.assertion
+            if svc_features.backtrace:
+                self.backtrace = svc_features.backtrace
                 return
 
         return None
@@ -397,7 +679,15 @@ class ValgrindReason(Reason):
         assert self.could_be(job)
         self.service_types = self._get_service_types(job)
 
-    def _get_service_types(self, job):
+    @classmethod
+    def signature(cls, job):
+        service_types = cls._get_service_types(job)
+        return FailureSignature('Valgrind', *sorted(
+            (service, tuple(types))
+            for service, types in service_types.items()))
+
+    @classmethod
+    def _get_service_types(cls, job):
         """
         Get dict mapping service type 'osd' etc to sorted list of violation types 'Leak_PossiblyLost' etc
         """
@@ -405,7 +695,7 @@ class ValgrindReason(Reason):
         result = defaultdict(list)
         # Lines like:
         # 2014-08-22T20:07:18.668 ERROR:tasks.ceph:saw valgrind issue   <kind>Leak_DefinitelyLost</kind> in /var/log/ceph/valgrind/osd.3.log.gz
-        for line in grep(os.path.join(job.path, "teuthology.log"), "</kind> in "):
+        for line in job.get_valgrind_lines():
             match = re.search("<kind>(.+)</kind> in .+/(.+)", line)
             if not match:
                 log.warning("Misunderstood line: {0}".format(line))
@@ -440,6 +730,23 @@ known_reasons = [
 ]
 
 
+def reason_type(job):
+    """
+    The known reason matching the job, or the most specific kind of reason
+    that could be made for it
+    """
+    for r in known_reasons:
+        if r.match(job):
+            return r
+
+    # NB ordering matters, LockdepReason must come before AssertionReason
+    for klass in [DeadReason, LockdepReason, AssertionReason, TimeoutReason, ValgrindReason]:
+        if klass.could_be(job):
+            return klass
+
+    return GenericReason
+
+
 def give_me_a_reason(job):
     """
     If no existing reasons match the job, generate the most specific reason we can
@@ -450,51 +757,220 @@ def give_me_a_reason(job):
     # it will get matched up with a backtrace or assertion if one is there, hiding
     # the valgrind/timeout aspect.
 
-    for r in known_reasons:
-        if r.match(job):
-            return r
+    r = reason_type(job)
+    if isinstance(r, Reason):
+        return r
+    return r(job)
 
-    # NB ordering matters, LockdepReason must come before AssertionReason
-    for klass in [DeadReason, LockdepReason, AssertionReason, TimeoutReason, ValgrindReason]:
-        if klass.could_be(job):
-            return klass(job)
 
-    return GenericReason(job)
+def get_signature(job):
+    """
+    The FailureSignature of the reason give_me_a_reason() would find
+    """
+    r = reason_type(job)
+    if isinstance(r, Reason):
+        return FailureSignature('Known', r.get_description())
+    return r.signature(job)
+
+
+def load_job(path, job_id):
+    return Job(path, job_id).populate()
+
+
+# Varying details that shouldn't split a failure into several signatures
+NORMALIZATIONS = [
+    # ubuntu@smithi001.front.sepia.ceph.com
+    (re.compile(r"\b(?:\w+@)?[a-z][\w-]*\d+(?:\.[a-z][\w-]*)+\b"), "HOST"),
+    (re.compile(r"0x[0-9a-fA-F]+"), "ADDR"),
+    (re.compile(r"\b[0-9a-f]{8,}(?:-[0-9a-f]{4,})*\b"), "HEX"),
+    (re.compile(r"\d+"), "N"),
+]
+
+
+def normalize(text):
+    """
+    Strip hostnames, addresses, hashes and numbers from text
+    """
+    for pattern, replacement in NORMALIZATIONS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def backtrace_frames(backtrace):
+    """
+    The normalized frames of a backtrace, without frame numbers, offsets or
+    addresses
+    """
+    frames = []
+    for line in backtrace.splitlines():
+        line = line.strip()
+        if not line or line.startswith("ceph version"):
+            continue
+        line = re.sub(r"^\d+:\s*", "", line)
+        line = re.sub(r"\+0x[0-9a-fA-F]+", "", line)
+        line = re.sub(r"\s*\[0x[0-9a-fA-F]+\]$", "", line)
+        frames.append(normalize(line))
+    return tuple(frames)
+
+
+class FailureSignature(object):
+    """
+    What identifies a failure: the kind of reason and the normalized details
+    it depends on. Jobs with equal signatures have the same reason; fuzzy
+    signatures of the same kind may also be merged if they're similar enough.
+    """
+    def __init__(self, kind, *parts, **kwargs):
+        self.kind = kind
+        self.key = (kind,) + tuple(parts)
+        self.fuzzy = kwargs.get('fuzzy', False)
+        self.text = " ".join(str(part) for part in parts)
+        self._minhash = None
+
+    @property
+    def minhash(self):
+        if self._minhash is None:
+            self._minhash = MinHash(self.text)
+        return self._minhash
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return "FailureSignature{0!r}".format(self.key)
+
+
+class MinHash(object):
+    """
+    A MinHash sketch of the word shingles of some text, for estimating
+    Jaccard similarity
+    """
+    num_hashes = 32
+    shingle_size = 3
+
+    def __init__(self, text):
+        words = text.split()
+        size = self.shingle_size
+        shingles = set(
+            " ".join(words[i:i + size]).encode()
+            for i in range(max(len(words) - size + 1, 1))
+        )
+        self.values = tuple(
+            min(zlib.crc32(shingle, seed) for shingle in shingles)
+            for seed in range(self.num_hashes)
+        )
+
+    def similarity(self, other):
+        same = sum(1 for a, b in zip(self.values, other.values) if a == b)
+        return same / float(self.num_hashes)
+
+
+class SignatureIndex(object):
+    """
+    Look up the reason for a FailureSignature: by hash for exact matches,
+    and through MinHash locality-sensitive hashing for near-duplicates of
+    fuzzy ones.
+
+    :param threshold: How similar (estimated Jaccard similarity of the
+                      shingles) fuzzy signatures need to be to share a reason
+    :param bands:     How many bands the MinHash values are split into for
+                      finding candidates
+    """
+    def __init__(self, threshold=0.5, bands=16):
+        self.threshold = threshold
+        self.bands = bands
+        self.reasons = dict()
+        self.buckets = defaultdict(list)
+
+    def _band_keys(self, signature):
+        values = signature.minhash.values
+        rows = len(values) // self.bands
+        for band in range(self.bands):
+            yield (signature.kind, band, values[band * rows:(band + 1) * rows])
+
+    def find(self, signature):
+        """
+        :returns: The reason for the signature, or None
+        """
+        reason = self.reasons.get(signature)
+        if reason is not None or not signature.fuzzy:
+            return reason
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for key in self._band_keys(signature):
+            for other, other_reason in self.buckets.get(key, []):
+                if id(other) in seen:
+                    continue
+                seen.add(id(other))
+                similarity = signature.minhash.similarity(other)
+                if similarity >= best_similarity:
+                    best, best_similarity = other_reason, similarity
+        if best is not None:
+            self.reasons[signature] = best
+        return best
+
+    def add(self, signature, reason):
+        self.reasons[signature] = reason
+        if signature.fuzzy:
+            for key in self._band_keys(signature):
+                self.buckets[key].append((signature.minhash, reason))
 
 
 class Scraper(object):
-    def __init__(self, target_dir):
+    """
+    :param workers: How many processes to read jobs with; defaults to the
+                    number of CPUs
+    """
+    def __init__(self, target_dir, workers=None):
         self.target_dir = target_dir
+        self.workers = workers or os.cpu_count() or 1
         log.addHandler(logging.FileHandler(os.path.join(target_dir,
                                                      "scrape.log")))
 
-    def analyze(self):
-        entries = os.listdir(self.target_dir)
-        jobs = []
-        for entry in entries:
+    def load_jobs(self):
+        """
+        Read every job's files, and scan its logs, in a pool of processes
+        """
+        paths = []
+        job_ids = []
+        for entry in sorted(os.listdir(self.target_dir)):
             job_dir = os.path.join(self.target_dir, entry)
             if os.path.isdir(job_dir):
-                jobs.append(Job(job_dir, entry))
+                paths.append(job_dir)
+                job_ids.append(entry)
+        if self.workers <= 1 or len(paths) <= 1:
+            return list(map(load_job, paths, job_ids))
+        # multiprocessing.Pool's helper threads don't get along with gevent's
+        # monkey-patching; ProcessPoolExecutor's do
+        with concurrent.futures.ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context('fork')) as pool:
+            chunksize = max(len(paths) // (self.workers * 4), 1)
+            return list(pool.map(load_job, paths, job_ids,
+                                 chunksize=chunksize))
+
+    def analyze(self):
+        jobs = self.load_jobs()
 
         log.info("Found {0} jobs".format(len(jobs)))
 
         passes = []
         reasons = defaultdict(list)
+        index = SignatureIndex()
 
         for job in jobs:
             if job.get_success():
                 passes.append(job)
                 continue
 
-            matched = False
-            for reason, reason_jobs in reasons.items():
-                if reason.match(job):
-                    reason_jobs.append(job)
-                    matched = True
-                    break
-
-            if not matched:
-                reasons[give_me_a_reason(job)].append(job)
+            signature = get_signature(job)
+            reason = index.find(signature)
+            if reason is None:
+                reason = give_me_a_reason(job)
+                index.add(signature, reason)
+            reasons[reason].append(job)
 
         log.info("Found {0} distinct failure reasons".format(len(reasons)))
         for reason, jobs in list(reasons.items()):
@@ -96,7 +96,7 @@ class TestRun(object):
             self.klass(self.args)
 
     @patch('teuthology.suite.run.util.fetch_repos')
-    @patch('requests.head')
+    @patch('teuthology.util.http_client.head')
     @patch('teuthology.suite.run.util.git_branch_exists')
     @patch('teuthology.suite.run.util.package_version_for_hash')
     @patch('teuthology.suite.run.util.git_ls_remote')
@@ -122,7 +122,7 @@ class TestRun(object):
         assert run.base_config.branch == 'ceph_branch'
 
     @patch('teuthology.suite.run.util.git_ls_remote')
-    @patch('requests.head')
+    @patch('teuthology.util.http_client.head')
     @patch('teuthology.suite.util.git_branch_exists')
     @patch('teuthology.suite.util.package_version_for_hash')
     def test_sha1_nonexistent(
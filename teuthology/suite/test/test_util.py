@@ -91,7 +91,7 @@ Branch 'no-branch' not found in repo: https://github.com/ceph/ceph-ci.git!"
 Branch 'no-branch' not found in repo: https://github.com/ceph/ceph-ci.git!"
         m_smtp.assert_not_called()
 
-    @patch('requests.get')
+    @patch('teuthology.util.http_client.get')
     def test_get_hash_success(self, m_get):
         mock_resp = Mock()
         mock_resp.ok = True
@@ -100,7 +100,7 @@ Branch 'no-branch' not found in repo: https://github.com/ceph/ceph-ci.git!"
         result = util.get_gitbuilder_hash()
         assert result == "the_hash"
 
-    @patch('requests.get')
+    @patch('teuthology.util.http_client.get')
     def test_get_hash_fail(self, m_get):
         mock_resp = Mock()
         mock_resp.ok = False
@@ -108,7 +108,7 @@ Branch 'no-branch' not found in repo: https://github.com/ceph/ceph-ci.git!"
         result = util.get_gitbuilder_hash()
         assert result is None
 
-    @patch('requests.get')
+    @patch('teuthology.util.http_client.get')
     def test_package_version_for_hash(self, m_get):
         mock_resp = Mock()
         mock_resp.ok = True
@@ -117,7 +117,7 @@ Branch 'no-branch' not found in repo: https://github.com/ceph/ceph-ci.git!"
         result = util.package_version_for_hash("hash")
         assert result == "the_version"
 
-    @patch('requests.get')
+    @patch('teuthology.util.http_client.get')
     def test_get_branch_info(self, m_get):
         mock_resp = Mock()
         mock_resp.ok = True
@@ -177,7 +177,7 @@ Branch 'no-branch' not found in repo: https://github.com/ceph/ceph-ci.git!"
         assert util.git_ls_remote('ceph', 'nobranch') is None
         assert util.git_ls_remote('ceph', 'main') is not None
 
-    @patch('teuthology.suite.util.requests.get')
+    @patch('teuthology.util.http_client.get')
     def test_find_git_parents(self, m_requests_get):
         refresh_resp = Mock(ok=True)
         history_resp = Mock(ok=True)
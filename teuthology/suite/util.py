@@ -1,7 +1,6 @@
 import copy
 import logging
 import os
-import requests
 import smtplib
 import socket
 from subprocess import Popen, PIPE, DEVNULL
@@ -21,6 +20,7 @@ from teuthology.orchestra.opsys import OS
 from teuthology.packaging import get_builder_project
 from teuthology.repo_utils import build_git_url
 from teuthology.task.install import get_flavor
+from teuthology.util import http_client
 
 log = logging.getLogger(__name__)
 
@@ -214,7 +214,7 @@ def git_validate_sha1(project, sha1, project_owner='ceph'):
             'git_validate_sha1: how do I check %s for a sha1?' % url
         )
 
-    resp = requests.head(url)
+    resp = http_client.head(url)
     if resp.ok:
         return sha1
     return None
@@ -249,7 +249,7 @@ def get_branch_info(project, branch, project_owner='ceph'):
     url_templ = 'https://api.github.com/repos/{project_owner}/{project}/git/refs/heads/{branch}'  # noqa
     url = url_templ.format(project_owner=project_owner, project=project,
                            branch=branch)
-    resp = requests.get(url)
+    resp = http_client.get(url)
     if resp.ok:
         return resp.json()
 
@@ -472,7 +472,7 @@ def find_git_parents(project: str, sha1: str, count=1):
 
     def refresh(project):
         url = '%s/%s.git/refresh/' % (base_url, project)
-        resp = requests.get(url)
+        resp = http_client.get(url)
         if not resp.ok:
             log.error('git refresh failed for %s: %s',
                       project, resp.content.decode())
@@ -480,7 +480,7 @@ def find_git_parents(project: str, sha1: str, count=1):
     def get_sha1s(project, committish, count):
         url = '/'.join((base_url, '%s.git' % project,
                        'history/?committish=%s&count=%d' % (committish, count)))
-        resp = requests.get(url)
+        resp = http_client.get(url)
         resp.raise_for_status()
         sha1s = resp.json()['sha1s']
         if len(sha1s) != count:
@@ -61,6 +61,8 @@ def _ship_utilities(ctx):
     """
     testdir = teuthology.get_testdir(ctx)
     filenames = []
+    # (path, data, mode) of each file to write to every remote
+    files = []
 
     log.info('Shipping valgrind.supp...')
     assert 'suite_path' in ctx.config
@@ -71,13 +73,7 @@ def _ship_utilities(ctx):
                 ) as f:
             fn = os.path.join(testdir, 'valgrind.supp')
             filenames.append(fn)
-            for rem in ctx.cluster.remotes.keys():
-                teuthology.sudo_write_file(
-                    remote=rem,
-                    path=fn,
-                    data=f,
-                    )
-                f.seek(0)
+            files.append((fn, f.read(), None))
     except IOError as e:
         log.info('Cannot ship supression file for valgrind: %s...', e.strerror)
 
@@ -89,21 +85,16 @@ def _ship_utilities(ctx):
         dst = os.path.join(destdir, filename)
         filenames.append(dst)
         with open(src, 'rb') as f:
-            for rem in ctx.cluster.remotes.keys():
+            files.append((dst, f.read(), 'a=rx'))
+
+    for rem in ctx.cluster.remotes.keys():
+        with rem.batch():
+            for path, data, mode in files:
                 teuthology.sudo_write_file(
                     remote=rem,
-                    path=dst,
-                    data=f,
-                )
-                f.seek(0)
-                rem.run(
-                    args=[
-                        'sudo',
-                        'chmod',
-                        'a=rx',
-                        '--',
-                        dst,
-                    ],
+                    path=path,
+                    data=data,
+                    perms=mode,
                 )
     return filenames
 
@@ -4,7 +4,6 @@ Note that there is no corresponding task defined for this module.  All of
 the calls are made from other modules, most notably teuthology/run.py
 """
 import contextlib
-import functools
 import gzip
 import logging
 import os
@@ -14,6 +13,7 @@ import yaml
 import subprocess
 import tempfile
 import re
+import gevent.threadpool
 import humanfriendly
 
 import teuthology.lock.ops
@@ -24,6 +24,8 @@ from teuthology.config import config as teuth_config
 from teuthology.exceptions import ConfigError, VersionNotFoundError
 from teuthology.job_status import get_status, set_status
 from teuthology.orchestra import cluster, remote, run
+from teuthology.parallel import parallel
+from teuthology.util import seekable_log
 # the below import with noqa is to workaround run.py which does not support multilevel submodule import
 from teuthology.task.internal.redhat import (setup_cdn_repo, setup_base_repo,            # noqa
                                              setup_additional_repo,                      # noqa
@@ -366,16 +368,108 @@ def fetch_binaries_for_coredumps(path, remote):
 
 def gzip_if_too_large(compress_min_size, src, tarinfo, local_path):
     if tarinfo.size >= compress_min_size:
-        with gzip.open(local_path + '.gz', 'wb') as dest:
-            shutil.copyfileobj(src, dest)
+        with seekable_log.SeekableLogWriter(local_path + '.gz') as dest:
+            seekable_log.copy(src, dest)
     else:
         misc.copy_fileobj(src, tarinfo, local_path)
 
 
+def compress_log(path):
+    """
+    Compress a log into the seekable gzip format, removing the original
+    """
+    try:
+        seekable_log.compress(path, path + '.gz')
+    except Exception:
+        log.exception('Failed to compress %s', path)
+    else:
+        os.remove(path)
+
+
+class LogCompressor(object):
+    """
+    A write_to function for misc.pull_directory which gzips files of at
+    least compress_min_size bytes, in the seekable log format.
+
+    With workers set, large files are written as-is and then compressed by a
+    pool of up to that many threads (zlib doesn't hold the GIL while it
+    compresses), so that compression does not hold up the archive stream.
+    Call wait() before relying on the compressed files, and close() when
+    done with the compressor.
+    """
+    def __init__(self, compress_min_size, workers=0):
+        self.compress_min_size = compress_min_size
+        self.workers = workers
+        self.pool = None
+        if workers:
+            self.pool = gevent.threadpool.ThreadPool(workers)
+
+    def __call__(self, src, tarinfo, local_path):
+        if not self.workers or tarinfo.size < self.compress_min_size:
+            gzip_if_too_large(self.compress_min_size, src, tarinfo, local_path)
+            return
+        misc.copy_fileobj(src, tarinfo, local_path)
+        self.pool.spawn(compress_log, local_path)
+
+    def wait(self):
+        if self.pool is not None:
+            self.pool.join()
+
+    def close(self):
+        """
+        Stop the pool's threads; any compression still running is abandoned
+        """
+        if self.pool is not None:
+            self.pool.kill()
+            self.pool = None
+
+
+def pull_remote_archive(remote, archive_dir, path, write_to):
+    """
+    Pull archive_dir from remote into path, then fetch binaries for any
+    coredumps found there.
+
+    :returns: a dict of transfer statistics for the remote
+    """
+    codec = remote.choose_archive_codec(misc.get_archive_codecs())
+    stats = dict(host=remote.shortname, codec=codec, files=0, bytes=0)
+
+    def counting_write_to(src, tarinfo, local_path):
+        stats['files'] += 1
+        stats['bytes'] += tarinfo.size
+        write_to(src, tarinfo, local_path)
+
+    start = time.time()
+    misc.pull_directory(remote, archive_dir, path, counting_write_to,
+                        codec=codec)
+    stats['transfer_seconds'] = round(time.time() - start, 3)
+    # Check for coredumps and pull binaries
+    fetch_binaries_for_coredumps(path, remote)
+    stats['seconds'] = round(time.time() - start, 3)
+    return stats
+
+
+def write_archive_stats(ctx, stats):
+    """
+    Store per-remote archive transfer statistics in the job archive
+    """
+    stats = sorted(stats, key=lambda s: s['host'])
+    summary = dict(
+        hosts=stats,
+        total_bytes=sum(s['bytes'] for s in stats),
+        total_files=sum(s['files'] for s in stats),
+    )
+    with open(os.path.join(ctx.archive, 'archive_stats.yaml'), 'w') as f:
+        yaml.safe_dump(summary, f, default_flow_style=False)
+
+
 @contextlib.contextmanager
 def archive(ctx, config):
     """
     Handle the creation and deletion of the archive directory.
+
+    Remote archives are pulled concurrently; the number of remotes pulled at
+    once is limited by the top-level ``archive-concurrency`` option.
     """
     log.info('Creating archive directory...')
     archive_dir = misc.get_archive_dir(ctx)
@@ -403,22 +497,42 @@ def archive(ctx, config):
             logdir = os.path.join(ctx.archive, 'remote')
             if (not os.path.exists(logdir)):
                 os.mkdir(logdir)
-            for rem in ctx.cluster.remotes.keys():
-                path = os.path.join(logdir, rem.shortname)
-                min_size_option = ctx.config.get('log-compress-min-size',
-                                                 '128MB')
-                try:
-                    compress_min_size_bytes = \
-                        humanfriendly.parse_size(min_size_option)
-                except humanfriendly.InvalidSize:
-                    msg = 'invalid "log-compress-min-size": {}'.format(min_size_option)
-                    log.error(msg)
-                    raise ConfigError(msg)
-                maybe_compress = functools.partial(gzip_if_too_large,
-                                                   compress_min_size_bytes)
-                misc.pull_directory(rem, archive_dir, path, maybe_compress)
-                # Check for coredumps and pull binaries
-                fetch_binaries_for_coredumps(path, rem)
+            min_size_option = ctx.config.get('log-compress-min-size',
+                                             '128MB')
+            try:
+                compress_min_size_bytes = \
+                    humanfriendly.parse_size(min_size_option)
+            except humanfriendly.InvalidSize:
+                msg = 'invalid "log-compress-min-size": {}'.format(min_size_option)
+                log.error(msg)
+                raise ConfigError(msg)
+            maybe_compress = LogCompressor(
+                compress_min_size_bytes,
+                ctx.config.get('log-compress-workers', 4),
+            )
+            concurrency = ctx.config.get('archive-concurrency', 8)
+            remotes = list(ctx.cluster.remotes.keys())
+            stats = []
+            try:
+                with parallel(size=concurrency) as p:
+                    for rem in remotes:
+                        path = os.path.join(logdir, rem.shortname)
+                        p.spawn(pull_remote_archive, rem, archive_dir, path,
+                                maybe_compress)
+                    for result in p:
+                        stats.append(result)
+                        log.info(
+                            'Transferred archive from %s (%d/%d): %d files, '
+                            '%s in %.1f seconds',
+                            result['host'], len(stats), len(remotes),
+                            result['files'],
+                            humanfriendly.format_size(result['bytes']),
+                            result['seconds'],
+                        )
+                maybe_compress.wait()
+            finally:
+                maybe_compress.close()
+            write_archive_stats(ctx, stats)
 
         log.info('Removing archive directory...')
         run.wait(
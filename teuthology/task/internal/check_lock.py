@@ -17,7 +17,8 @@ def check_lock(ctx, config, check_up=True):
         return
     log.info('Checking locks...')
     for machine in ctx.config['targets'].keys():
-        status = teuthology.lock.query.get_status(machine)
+        status = teuthology.lock.query.get_status(
+            machine, max_age=teuthology.lock.query.STATUS_TTL)
         log.debug('machine status is %s', repr(status))
         assert status is not None, \
             'could not read lock status for {name}'.format(name=machine)
@@ -1,3 +1,10 @@
+import gzip
+import os
+import yaml
+
+from io import BytesIO
+from unittest.mock import patch, Mock
+
 from teuthology.config import FakeNamespace
 from teuthology.task import internal
 
@@ -55,3 +62,54 @@ class TestInternal(object):
         assert internal.buildpackages_prep(self.ctx,
                                            self.ctx.config) == internal.BUILDPACKAGES_REMOVED
         assert self.ctx.config == {'tasks': []}
+
+    @patch('teuthology.task.internal.fetch_binaries_for_coredumps')
+    @patch('teuthology.task.internal.misc.pull_directory')
+    def test_pull_remote_archive(self, m_pull_directory, m_fetch):
+        def fake_pull(remote, remotedir, localdir, write_to, codec):
+            for size in (10, 20):
+                write_to(Mock(), Mock(size=size), localdir)
+        m_pull_directory.side_effect = fake_pull
+        m_write_to = Mock()
+        remote = Mock(shortname='smithi001')
+        remote.choose_archive_codec.return_value = 'zstd'
+        stats = internal.pull_remote_archive(
+            remote, '/archive', '/local/smithi001', m_write_to)
+        assert stats['host'] == 'smithi001'
+        assert stats['codec'] == 'zstd'
+        assert stats['files'] == 2
+        assert stats['bytes'] == 30
+        assert m_write_to.call_count == 2
+        m_fetch.assert_called_once_with('/local/smithi001', remote)
+
+    def test_write_archive_stats(self, tmp_path):
+        self.ctx.archive = str(tmp_path)
+        internal.write_archive_stats(self.ctx, [
+            dict(host='b', files=1, bytes=5, seconds=1.0),
+            dict(host='a', files=2, bytes=7, seconds=2.0),
+        ])
+        with open(tmp_path / 'archive_stats.yaml') as f:
+            stats = yaml.safe_load(f)
+        assert [h['host'] for h in stats['hosts']] == ['a', 'b']
+        assert stats['total_bytes'] == 12
+        assert stats['total_files'] == 3
+
+    def test_log_compressor(self, tmp_path):
+        compressor = internal.LogCompressor(10, workers=2)
+        for name, data in (('small', b'x'), ('big1', b'y' * 20),
+                           ('big2', b'z' * 20)):
+            compressor(BytesIO(data), Mock(size=len(data)),
+                       str(tmp_path / name))
+        compressor.wait()
+        compressor.close()
+        assert compressor.pool is None
+        assert sorted(os.listdir(tmp_path)) == ['big1.gz', 'big2.gz', 'small']
+        with gzip.open(tmp_path / 'big2.gz') as f:
+            assert f.read() == b'z' * 20
+
+    def test_log_compressor_inline(self, tmp_path):
+        compressor = internal.LogCompressor(10)
+        compressor(BytesIO(b'y' * 20), Mock(size=20), str(tmp_path / 'big'))
+        assert os.listdir(tmp_path) == ['big.gz']
+        with gzip.open(tmp_path / 'big.gz') as f:
+            assert f.read() == b'y' * 20
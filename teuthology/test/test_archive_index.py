@@ -0,0 +1,198 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import pytest
+import yaml
+
+from teuthology import archive_index
+from teuthology import report
+from teuthology.test import fake_archive
+
+
+class TestArchiveIndex(object):
+    def setup_method(self):
+        self.archive = fake_archive.FakeArchive()
+        self.archive.setup()
+        self.archive_base = self.archive.archive_base
+        self.index_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.index_dir, 'index.sqlite')
+        self.index = archive_index.ArchiveIndex(self.archive_base,
+                                                self.index_path)
+
+    def teardown_method(self):
+        self.index.close()
+        self.archive.teardown()
+        shutil.rmtree(self.index_dir)
+
+    def create_run(self, run_name, job_count=5, num_hung=0):
+        return self.archive.create_fake_run(
+            run_name, job_count, 'examples/3node_ceph.yaml',
+            num_hung=num_hung)
+
+    def job_dir(self, run_name, job_id):
+        return os.path.join(self.archive_base, run_name, str(job_id))
+
+    def test_runs(self):
+        self.create_run('run1')
+        self.create_run('run2')
+        assert self.index.runs() == ['run1', 'run2']
+        shutil.rmtree(os.path.join(self.archive_base, 'run1'))
+        assert self.index.runs() == ['run2']
+
+    def test_default_path(self):
+        path = archive_index.default_path(self.archive_base)
+        assert not path.startswith(self.archive_base)
+        assert path != archive_index.default_path(self.archive_base + '2')
+
+    def test_jobs(self):
+        jobs = self.create_run('run1', 5, num_hung=2)
+        indexed = self.index.jobs('run1')
+        assert sorted(j['job_id'] for j in indexed) == \
+            sorted(str(j['job_id']) for j in jobs)
+        by_id = dict((str(j['job_id']), j) for j in jobs)
+        for job in indexed:
+            expected = by_id[job['job_id']]
+            assert job['owner'] == expected['info']['owner']
+            assert job['size'] is None
+            if 'summary' in expected:
+                summary = expected['summary']
+                assert job['finished']
+                assert job['status'] == \
+                    ('pass' if summary['success'] else 'fail')
+                assert job['duration'] == summary['duration']
+                assert job['failure_reason'] == \
+                    summary.get('failure_reason')
+            else:
+                assert not job['finished']
+                assert job['status'] is None
+        assert len(self.index.jobs('run1', finished=False)) == 2
+
+    def test_jobs_status(self):
+        jobs = self.create_run('run1', 10)
+        passed = sorted(str(j['job_id']) for j in jobs
+                        if j['summary']['success'])
+        got = self.index.jobs('run1', status='pass')
+        assert sorted(j['job_id'] for j in got) == passed
+
+    def test_unfinished_job_finishes(self):
+        jobs = self.create_run('run1', 3, num_hung=1)
+        job_id = str(jobs[0]['job_id'])
+        assert [j['job_id'] for j in
+                self.index.jobs('run1', finished=False)] == [job_id]
+        with open(os.path.join(self.job_dir('run1', job_id),
+                               'summary.yaml'), 'w') as f:
+            yaml.safe_dump(dict(success=False, status='dead'), f)
+        assert self.index.jobs('run1', finished=False) == []
+        assert self.index.job('run1', job_id)['status'] == 'dead'
+
+    def test_unchanged_run_is_not_reread(self):
+        self.create_run('run1', 3)
+        self.index.jobs('run1')
+        self.index.read_job = None
+        assert len(self.index.jobs('run1')) == 3
+
+    def test_finished_job_rewritten(self):
+        jobs = self.create_run('run1', 3)
+        job_id = str(jobs[0]['job_id'])
+        self.index.jobs('run1')
+        summary_path = os.path.join(self.job_dir('run1', job_id),
+                                    'summary.yaml')
+        with open(summary_path, 'w') as f:
+            yaml.safe_dump(dict(success=False, status='dead'), f)
+        # Rewriting a file in place leaves its directory's mtime alone
+        stat = os.stat(summary_path)
+        os.utime(summary_path, (stat.st_atime, stat.st_mtime + 10))
+        assert self.index.job('run1', job_id)['status'] == 'dead'
+        assert [job['status'] for job in self.index.jobs('run1')
+                if job['job_id'] == job_id] == ['dead']
+
+    def test_removed_job(self):
+        jobs = self.create_run('run1', 3)
+        self.index.jobs('run1')
+        shutil.rmtree(self.job_dir('run1', jobs[0]['job_id']))
+        assert len(self.index.jobs('run1')) == 2
+
+    def test_update_job(self):
+        jobs = self.create_run('run1', 3, num_hung=3)
+        job_id = jobs[0]['job_id']
+        with open(os.path.join(self.job_dir('run1', job_id),
+                               'summary.yaml'), 'w') as f:
+            yaml.safe_dump(dict(success=True), f)
+        self.index.update_job('run1', job_id, size=True)
+        got = self.index.jobs('run1', status='pass', update=False)
+        assert [j['job_id'] for j in got] == [str(job_id)]
+        assert got[0]['size'] > 0
+
+    def test_rebuild(self):
+        self.create_run('run1', 3)
+        self.index.jobs('run1')
+        self.index.close()
+        os.remove(self.index.path)
+        index = archive_index.ArchiveIndex(self.archive_base,
+                                           self.index_path)
+        index.rebuild()
+        assert len(index.jobs('run1', update=False)) == 3
+        index.close()
+
+    def test_schema_version(self):
+        self.create_run('run1', 3)
+        self.index.jobs('run1')
+        self.index.conn.execute('PRAGMA user_version = 999')
+        self.index.conn.commit()
+        self.index.close()
+        with pytest.raises(sqlite3.DatabaseError):
+            self.index.jobs('run1')
+
+    def test_readonly(self):
+        self.create_run('run1', 3, num_hung=1)
+        index = archive_index.ArchiveIndex(self.archive_base,
+                                           self.index_path, readonly=True)
+        with pytest.raises(sqlite3.OperationalError):
+            index.jobs('run1')
+        assert len(self.index.jobs('run1')) == 3
+        self.create_run('run2', 3)
+        assert len(index.jobs('run1')) == 3
+        # read-only users don't update the index
+        assert index.runs() == ['run1']
+        index.close()
+
+    def test_concurrent_setup(self):
+        indexes = [archive_index.ArchiveIndex(self.archive_base,
+                                              self.index_path)
+                   for i in range(2)]
+        self.create_run('run1', 3)
+        indexes[0].jobs('run1')
+        # setting the index up again leaves what's there alone
+        assert len(indexes[1].jobs('run1', update=False)) == 3
+        for index in indexes:
+            index.close()
+
+    def test_serializer(self):
+        self.create_run('run1', 4, num_hung=1)
+        self.create_run('run2', 2)
+        plain = report.ResultsSerializer(self.archive_base)
+        indexed = report.ResultsSerializer(self.archive_base,
+                                           index=self.index)
+        assert indexed.all_runs == sorted(plain.all_runs)
+        for run_name in ('run1', 'run2'):
+            assert indexed.jobs_for_run(run_name) == \
+                plain.jobs_for_run(run_name)
+            assert indexed.running_jobs_for_run(run_name) == \
+                plain.running_jobs_for_run(run_name)
+
+    def test_serializer_falls_back(self):
+        self.create_run('run1', 4, num_hung=1)
+        self.index.jobs('run1')
+        self.index.conn.execute('PRAGMA user_version = 999')
+        self.index.conn.commit()
+        self.index.close()
+        plain = report.ResultsSerializer(self.archive_base)
+        indexed = report.ResultsSerializer(self.archive_base,
+                                           index=self.index)
+        assert indexed.jobs_for_run('run1') == plain.jobs_for_run('run1')
+        assert indexed.index is None
+        assert indexed.running_jobs_for_run('run1') == \
+            plain.running_jobs_for_run('run1')
+        assert indexed.all_runs == plain.all_runs
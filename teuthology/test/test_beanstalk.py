@@ -0,0 +1,195 @@
+import beanstalkc
+import yaml
+
+from unittest.mock import patch
+
+from teuthology import beanstalk
+
+
+class FakeQueue(object):
+    def __init__(self):
+        self.jobs = dict()
+        self.next_id = 1
+        self.peeks = 0
+        self.reserves = 0
+        self.stats = 0
+
+    def put(self, tube, job_config):
+        job_id = self.next_id
+        self.next_id += 1
+        self.jobs[job_id] = dict(tube=tube, body=yaml.safe_dump(job_config),
+                                 pri=job_config['priority'], reserved=False)
+        return job_id
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection(object):
+    """
+    Just enough of beanstalkc.Connection for one watched tube
+    """
+    def __init__(self, queue):
+        self.queue = queue
+        self.tube = None
+
+    def watch(self, tube):
+        self.tube = tube
+
+    def ignore(self, tube):
+        pass
+
+    def ready(self):
+        return sorted(
+            (job['pri'], job_id) for job_id, job in self.queue.jobs.items()
+            if job['tube'] == self.tube and not job['reserved'])
+
+    def stats_tube(self, tube):
+        return {'current-jobs-ready': len(self.ready())}
+
+    def reserve(self, timeout=None):
+        self.queue.reserves += 1
+        ready = self.ready()
+        if not ready:
+            return None
+        job_id = ready[0][1]
+        self.queue.jobs[job_id]['reserved'] = True
+        return beanstalkc.Job(self, job_id, self.queue.jobs[job_id]['body'])
+
+    def release(self, job_id, priority, delay):
+        self.queue.jobs[job_id]['reserved'] = False
+
+    def stats_job(self, job_id):
+        self.queue.stats += 1
+        job = self.queue.jobs.get(job_id)
+        if job is None:
+            raise beanstalkc.CommandFailed('stats-job', 'NOT_FOUND', [])
+        return {'id': job_id, 'pri': job['pri'],
+                'state': 'reserved' if job['reserved'] else 'ready'}
+
+    def peek(self, job_id):
+        self.queue.peeks += 1
+        job = self.queue.jobs.get(job_id)
+        if job is None:
+            return None
+        return beanstalkc.Job(self, job_id, job['body'], reserved=False)
+
+    def delete(self, job_id):
+        if job_id not in self.queue.jobs:
+            raise beanstalkc.CommandFailed('delete', 'NOT_FOUND', [])
+        del self.queue.jobs[job_id]
+
+    def close(self):
+        pass
+
+
+class Collector(beanstalk.JobProcessor):
+    def process_job(self, job_id):
+        pass
+
+
+class TestBeanstalk(object):
+    def setup_method(self):
+        self.queue = FakeQueue()
+        self.connection = self.queue.connect()
+        self.connection.watch('smithi')
+        self.p_connect = patch.object(beanstalk, 'connect',
+                                      self.queue.connect)
+        self.p_connect.start()
+
+    def teardown_method(self):
+        self.p_connect.stop()
+
+    def schedule(self, run_name, count, index=True):
+        for i in range(count):
+            job_id = self.queue.put('smithi', dict(
+                name=run_name, priority=100, description='desc %d' % i))
+            if index:
+                beanstalk.index_job('smithi', run_name, job_id)
+
+    def test_indexed_run(self, tmp_path):
+        with patch.object(beanstalk.config, 'queue_index_dir',
+                          str(tmp_path)):
+            self.schedule('run1', 5)
+            self.schedule('run2', 100)
+            self.schedule('run3', 5)
+            # The first job of run1 has already been dispatched
+            del self.queue.jobs[1]
+            processor = Collector()
+            with patch.object(beanstalk.yaml, 'safe_load') as m_safe_load:
+                beanstalk.walk_jobs(self.connection, 'smithi', processor,
+                                    run_name='run1')
+        assert list(processor.jobs) == ['2', '3', '4', '5']
+        # Only the matching jobs' bodies were fetched
+        assert self.queue.peeks == 4
+        assert self.queue.stats == 110
+        assert self.queue.reserves == 0
+        # Only names were looked at, so no job was parsed
+        m_safe_load.assert_not_called()
+        job_config = processor.jobs['2']['job_config']
+        assert job_config['description'] == 'desc 1'
+
+    def test_runs_only(self, tmp_path):
+        with patch.object(beanstalk.config, 'queue_index_dir',
+                          str(tmp_path)):
+            self.schedule('run1', 5)
+            self.schedule('run2', 50)
+            self.schedule('run3', 5)
+            for job_id in range(1, 6):
+                del self.queue.jobs[job_id]
+            processor = beanstalk.RunPrinter()
+            beanstalk.walk_jobs(self.connection, 'smithi', processor,
+                                runs_only=True)
+            assert processor.runs == ['run2', 'run3']
+            # run1 is gone, so it has been dropped from the index
+            assert sorted(beanstalk.indexed_runs('smithi')) == \
+                ['run2', 'run3']
+        assert self.queue.peeks < 15
+
+    def test_reserved_job(self, tmp_path):
+        with patch.object(beanstalk.config, 'queue_index_dir',
+                          str(tmp_path)):
+            self.schedule('run1', 3)
+            # A dispatcher has reserved the first job
+            self.queue.jobs[1]['reserved'] = True
+            processor = Collector()
+            beanstalk.walk_jobs(self.connection, 'smithi', processor,
+                                run_name='run1')
+        assert list(processor.jobs) == ['2', '3']
+        assert self.queue.reserves == 0
+
+    def test_partly_indexed(self, tmp_path):
+        with patch.object(beanstalk.config, 'queue_index_dir',
+                          str(tmp_path)):
+            self.schedule('run1', 3)
+            # Scheduled elsewhere, or before the index existed
+            self.schedule('run1', 2, index=False)
+            self.schedule('run2', 2, index=False)
+            processor = Collector()
+            beanstalk.walk_jobs(self.connection, 'smithi', processor,
+                                run_name='run1')
+            assert list(processor.jobs) == ['1', '2', '3', '4', '5']
+            processor = beanstalk.RunPrinter()
+            beanstalk.walk_jobs(self.connection, 'smithi', processor,
+                                runs_only=True)
+            assert processor.runs == ['run1', 'run2']
+        assert not any(job['reserved'] for job in self.queue.jobs.values())
+
+    def test_unindexed_run(self):
+        self.schedule('run1', 3, index=False)
+        self.schedule('run2', 3, index=False)
+        processor = beanstalk.JobDeleter('run2')
+        with patch.object(beanstalk.report, 'try_delete_jobs'):
+            beanstalk.walk_jobs(self.connection, 'smithi', processor,
+                                pattern='run2')
+        assert sorted(self.queue.jobs) == [1, 2, 3]
+        # Jobs that didn't match were released again
+        assert not any(job['reserved'] for job in self.queue.jobs.values())
+
+    def test_lazy_job_config(self):
+        body = yaml.safe_dump(dict(name='run1', priority=50, tube='smithi'))
+        job_config = beanstalk.LazyJobConfig(body)
+        assert job_config['name'] == 'run1'
+        assert job_config._config is None
+        assert job_config['priority'] == 50
+        assert dict(job_config) == yaml.safe_load(body)
@@ -0,0 +1,82 @@
+import beanstalkc
+
+from unittest.mock import patch
+
+from teuthology import beanstalk
+from teuthology.benchmark import Benchmark
+from teuthology.benchmark.beanstalkd import FakeBeanstalkd
+
+
+class TestFakeBeanstalkd(object):
+    def setup_method(self):
+        self.server = FakeBeanstalkd().start()
+        self.p_config = patch.multiple(
+            beanstalk.config, queue_host=self.server.host,
+            queue_port=self.server.port)
+        self.p_config.start()
+        self.connection = beanstalk.connect()
+
+    def teardown_method(self):
+        self.connection.close()
+        self.p_config.stop()
+        self.server.stop()
+
+    def test_priority_order(self):
+        self.connection.use('smithi')
+        beanstalk.watch_tube(self.connection, 'smithi')
+        low = self.connection.put('low', priority=200)
+        high = self.connection.put('high', priority=10)
+        job = self.connection.reserve(timeout=0)
+        assert (job.jid, job.body) == (high, 'high')
+        job.release()
+        assert self.connection.reserve(timeout=0).jid == high
+        assert self.connection.reserve(timeout=0).jid == low
+        assert self.connection.reserve(timeout=0) is None
+
+    def test_bury_delete(self):
+        self.connection.use('smithi')
+        beanstalk.watch_tube(self.connection, 'smithi')
+        jid = self.connection.put('body')
+        job = self.connection.reserve(timeout=0)
+        job.bury()
+        assert self.connection.stats_job(jid)['state'] == 'buried'
+        assert self.connection.stats_tube('smithi')['current-jobs-buried'] == 1
+        assert self.connection.peek(jid).body == 'body'
+        job.delete()
+        assert self.connection.peek(jid) is None
+
+    def test_released_on_disconnect(self):
+        self.connection.use('smithi')
+        jid = self.connection.put('body')
+        other = beanstalk.connect()
+        beanstalk.watch_tube(other, 'smithi')
+        assert other.reserve(timeout=0).jid == jid
+        # Another connection may not delete a reserved job
+        try:
+            self.connection.delete(jid)
+        except beanstalkc.CommandFailed:
+            pass
+        else:
+            assert False, "deleted a job reserved elsewhere"
+        other.close()
+        beanstalk.watch_tube(self.connection, 'smithi')
+        assert self.connection.reserve(timeout=1).jid == jid
+
+
+class TestBenchmark(object):
+    def test_run(self):
+        results = Benchmark(jobs=4, nodes=4, roles=2).run()
+        assert results['schedule']['jobs'] == 4
+        assert results['suite']['jobs'] == 4
+        # Both stages' jobs, plus the suite's first-in-suite job
+        assert results['dispatch']['jobs'] == 9
+        assert results['reserve_latency']['count'] == 9
+        assert results['beanstalk_commands']['delete'] == 9
+        # Every job locked its nodes, and unlocked them again
+        assert results['http_calls']['POST /nodes/'] == 16
+
+    def test_one_stage(self):
+        results = Benchmark(jobs=3).run(stages=['schedule'])
+        assert results['schedule']['jobs'] == 3
+        assert 'dispatch' not in results
+        assert results['beanstalk_commands']['put'] == 3
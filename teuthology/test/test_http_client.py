@@ -0,0 +1,118 @@
+import http.server
+import threading
+
+from unittest.mock import patch
+
+from teuthology.util import http_client
+
+
+class FakeServer(object):
+    """
+    An HTTP/1.1 server which keeps connections alive, counting them, and
+    fails the first `failures` requests with a 503
+    """
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.requests = list()
+        self.connections = 0
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                fake.connections += 1
+                super().setup()
+
+            def respond(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self.rfile.read(length)
+                fake.requests.append((self.command, self.path))
+                status = 200
+                if fake.failures:
+                    fake.failures -= 1
+                    status = 503
+                body = b'{}'
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestHTTPClient(object):
+    def setup_method(self):
+        http_client.reset()
+        self.p_config = patch.multiple(
+            'teuthology.util.http_client.config',
+            http_pool_size=2, http_retries=3, http_backoff=0)
+        self.p_config.start()
+
+    def teardown_method(self):
+        self.p_config.stop()
+        http_client.reset()
+
+    def test_keep_alive(self):
+        server = FakeServer()
+        try:
+            for i in range(5):
+                assert http_client.get(server.url + '/nodes/node%d/' % i).ok
+            http_client.put(server.url + '/nodes/node1/', '{}')
+        finally:
+            server.stop()
+        assert len(server.requests) == 6
+        assert server.connections == 1
+
+    def test_retry_idempotent(self):
+        server = FakeServer(failures=2)
+        try:
+            assert http_client.get(server.url + '/nodes/').ok
+        finally:
+            server.stop()
+        assert server.requests == [('GET', '/nodes/')] * 3
+
+    def test_no_retry_post(self):
+        server = FakeServer(failures=1)
+        try:
+            response = http_client.post(server.url + '/nodes/lock_many/', '{}')
+        finally:
+            server.stop()
+        assert response.status_code == 503
+        assert len(server.requests) == 1
+
+    def test_stats(self):
+        server = FakeServer()
+        try:
+            http_client.get(server.url + '/nodes/node1/')
+            http_client.get(server.url + '/nodes/?locked=1')
+            http_client.get(server.url + '/runs/run1/jobs/1/')
+        finally:
+            server.stop()
+        netloc = server.url.split('://')[1]
+        stats = http_client.stats()
+        assert sorted(stats) == ['GET %s/nodes' % netloc,
+                                 'GET %s/runs' % netloc]
+        assert stats['GET %s/nodes' % netloc]['count'] == 2
+        assert stats['GET %s/runs' % netloc]['count'] == 1
+
+    def test_new_session_after_fork(self):
+        session = http_client.get_session()
+        assert http_client.get_session() is session
+        with patch('teuthology.util.http_client.os.getpid',
+                   return_value=-1):
+            assert http_client.get_session() is not session
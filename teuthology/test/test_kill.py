@@ -0,0 +1,84 @@
+from unittest.mock import patch, DEFAULT
+
+from teuthology import kill
+
+
+def make_node(shortname, description, is_vm=False):
+    return dict(name='%s.front.sepia.ceph.com' % shortname,
+                description=description, ssh_pub_key='key-' + shortname,
+                is_vm=is_vm)
+
+
+class TestFindTargets(object):
+    def setup_method(self):
+        self.nodes = [
+            make_node('node1', '/archive/run1/1'),
+            make_node('node2', '/archive/run1/10'),
+            make_node('node3', '/archive/run1/2'),
+            make_node('node4', '/archive/run10/1'),
+            make_node('vpm5', '/archive/run1/3', is_vm=True),
+        ]
+        self.p_get = patch('teuthology.util.http_client.get')
+        m_get = self.p_get.start()
+        m_get.return_value.ok = True
+        m_get.return_value.json.side_effect = \
+            lambda: [dict(node) for node in self.nodes]
+        self.p_list_locks = patch.object(
+            kill.query, 'list_locks', wraps=kill.query.list_locks)
+        self.m_list_locks = self.p_list_locks.start()
+
+    def teardown_method(self):
+        self.p_list_locks.stop()
+        self.p_get.stop()
+
+    def names(self, targets):
+        return sorted(name.split('.')[0] for name in targets['targets'])
+
+    def test_run(self):
+        with patch.object(kill.misc, 'ssh_keyscan', return_value=dict()), \
+                patch.object(kill.ops, 'push_new_keys'):
+            targets = kill.find_targets('run1', 'me')
+        assert self.names(targets) == ['node1', 'node2', 'node3', 'vpm5']
+        self.m_list_locks.assert_called_once()
+        assert self.m_list_locks.call_args[1]['locked_by'] == 'me'
+        assert self.m_list_locks.call_args[1]['up'] is True
+
+    def test_jobs(self):
+        targets = kill.find_targets('run1', 'me', job_ids=['1', 2])
+        assert self.names(targets) == ['node1', 'node3']
+        self.m_list_locks.assert_called_once()
+        assert kill.find_targets('run1', 'me', job_id='10') == \
+            dict(targets={'node2.front.sepia.ceph.com': 'key-node2'})
+        assert kill.find_targets('run2', 'me') == dict()
+
+    def test_vm_keys(self):
+        with patch.object(kill.misc, 'ssh_keyscan', return_value={
+                    'vpm5.front.sepia.ceph.com': 'new-key'}) as m_keyscan, \
+                patch.object(kill.ops, 'push_new_keys') as m_push:
+            targets = kill.find_targets('run1', 'me', job_id=3)
+        m_keyscan.assert_called_once_with(
+            ['vpm5.front.sepia.ceph.com'], _raise=False)
+        m_push.assert_called_once()
+        assert targets == dict(targets={'vpm5.front.sepia.ceph.com': 'new-key'})
+
+
+def test_kill_jobs():
+    job_infos = {
+        '1': dict(owner='alice', pid=101),
+        '2': dict(owner='bob', pid=102),
+        '3': dict(owner='alice', pid=103),
+    }
+    with patch.object(kill.report, 'ResultsSerializer') as m_serializer, \
+            patch.object(kill.pid_registry, 'find_pids', return_value=None), \
+            patch.multiple(kill, kill_processes=DEFAULT, find_targets=DEFAULT,
+                           nuke_targets=DEFAULT) as m:
+        m_serializer.return_value.job_info.side_effect = \
+            lambda run_name, job_id: job_infos[job_id]
+        m['find_targets'].side_effect = \
+            lambda run_name, owner, job_ids: dict(owner=owner)
+        kill.kill_jobs('run1', ['1', '2', '3'])
+    assert m['kill_processes'].call_count == 3
+    assert m['kill_processes'].call_args[0] == ('run1', [103])
+    assert sorted(call[1]['job_ids'] for call in
+                  m['find_targets'].call_args_list) == [['1', '3'], ['2']]
+    assert m['nuke_targets'].call_count == 2
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 from unittest.mock import patch, Mock
@@ -8,20 +10,77 @@ from teuthology import ls
 class TestLs(object):
     """ Tests for teuthology.ls """
 
-    @patch('os.path.isdir')
-    @patch('os.listdir')
-    def test_get_jobs(self, m_listdir, m_isdir):
-        m_listdir.return_value = ["1", "a", "3"]
-        m_isdir.return_value = True
-        results = ls.get_jobs("some/archive/dir")
-        assert results == ["1", "3"]
+    def make_run(self, tmp_path):
+        tmp_path.mkdir(exist_ok=True)
+        for job in ("1", "2", "10"):
+            (tmp_path / job).mkdir()
+        (tmp_path / "a").mkdir()
+        (tmp_path / "3").write_text("not a job dir")
+        (tmp_path / "1" / "summary.yaml").write_text(
+            "success: false\nowner: me\ndescription: one\n"
+            "duration: 12.5\nfailure_reason: reasons\n")
+        (tmp_path / "10" / "summary.yaml").write_text(
+            "success: true\nowner: me\ndescription: ten\n")
+        (tmp_path / "2" / "teuthology.log").write_text(
+            "first line\nlast line\n")
+        return tmp_path
 
-    @patch("yaml.safe_load_all")
-    @patch("teuthology.ls.get_jobs")
-    def test_ls(self, m_get_jobs,  m_safe_load_all):
-        m_get_jobs.return_value = ["1", "2"]
-        m_safe_load_all.return_value = [{"failure_reason": "reasons"}]
-        ls.ls("some/archive/div", True)
+    def test_get_jobs(self, tmp_path):
+        self.make_run(tmp_path)
+        results = ls.get_jobs(str(tmp_path))
+        assert results == ["1", "10", "2"]
+
+    @pytest.fixture(autouse=True)
+    def cache_home(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    def test_ls(self, tmp_path, capsys):
+        run_dir = self.make_run(tmp_path)
+        ls.ls(str(run_dir), True, workers=2)
+        out = capsys.readouterr().out.splitlines()
+        assert out == [
+            "1 fail me one 12s",
+            "    reasons",
+            "10 pass me ten 0s",
+            "2      last line",
+        ]
+
+    @patch("teuthology.ls.archive_index.config")
+    def test_ls_index(self, m_config, tmp_path, capsys):
+        m_config.archive_index = True
+        m_config.archive_index_path = str(tmp_path / "index.sqlite")
+        run_dir = self.make_run(tmp_path / "run")
+        ls.ls(str(run_dir), False)
+        indexed = capsys.readouterr().out
+        m_config.archive_index = False
+        ls.ls(str(run_dir), False)
+        assert indexed == capsys.readouterr().out
+
+    @patch("teuthology.ls.archive_index.config")
+    def test_ls_index_error(self, m_config, tmp_path, capsys):
+        m_config.archive_index = True
+        m_config.archive_index_path = str(tmp_path / "index.sqlite")
+        (tmp_path / "index.sqlite").write_text("not a database")
+        run_dir = self.make_run(tmp_path / "run")
+        ls.ls(str(run_dir), False)
+        assert capsys.readouterr().out.splitlines()[0] == \
+            "1 fail me one 12s"
+
+    def test_ls_summary_cache(self, tmp_path, capsys):
+        run_dir = self.make_run(tmp_path / "run")
+        ls.ls(str(run_dir), False)
+        first = capsys.readouterr().out
+        with patch("teuthology.ls.read_summary",
+                   wraps=ls.read_summary) as m_read_summary:
+            ls.ls(str(run_dir), False)
+        assert capsys.readouterr().out == first
+        # only the unfinished job is read again
+        m_read_summary.assert_called_once_with(str(run_dir / "2"))
+        (run_dir / "10" / "summary.yaml").write_text(
+            "success: false\nowner: me\ndescription: ten\n")
+        os.utime(str(run_dir / "10" / "summary.yaml"), (1, 1))
+        ls.ls(str(run_dir), False)
+        assert "10 fail me ten 0s" in capsys.readouterr().out
 
     @patch("teuthology.ls.open")
     @patch("teuthology.ls.get_jobs")
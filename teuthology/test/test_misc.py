@@ -1,9 +1,12 @@
 import argparse
+import io
+import tarfile
 
 from unittest.mock import Mock, patch
 from teuthology.orchestra import cluster
 from teuthology.config import config
 from teuthology import misc
+from teuthology.exceptions import CommandFailedError
 import subprocess
 
 import pytest
@@ -250,6 +253,82 @@ def test_split_role():
         actual_split = misc.split_role(role)
         assert actual_split == expected_split
 
+def _tar_bytes(files, mode):
+    buf = io.BytesIO()
+    with tarfile.open(mode=mode, fileobj=buf) as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def test_open_tar_stream_gzip():
+    stream = io.BytesIO(_tar_bytes({'./a.log': b'abc'}, 'w:gz'))
+    tar = misc.open_tar_stream(stream, 'gzip')
+    ti = tar.next()
+    assert ti.name == './a.log'
+    assert tar.extractfile(ti).read() == b'abc'
+
+
+def test_open_tar_stream_zstd():
+    zstandard = pytest.importorskip('zstandard')
+    data = _tar_bytes({'./a.log': b'abc'}, 'w')
+    stream = io.BytesIO(zstandard.ZstdCompressor().compress(data))
+    tar = misc.open_tar_stream(stream, 'zstd')
+    ti = tar.next()
+    assert tar.extractfile(ti).read() == b'abc'
+
+
+def test_open_tar_stream_zstd_frames():
+    zstandard = pytest.importorskip('zstandard')
+    data = _tar_bytes({'./a.log': b'abc' * 10000}, 'w')
+    compressor = zstandard.ZstdCompressor()
+    stream = io.BytesIO(b''.join(
+        compressor.compress(data[i:i + 4096])
+        for i in range(0, len(data), 4096)))
+    tar = misc.open_tar_stream(stream, 'zstd')
+    ti = tar.next()
+    assert tar.extractfile(ti).read() == b'abc' * 10000
+
+
+@patch('teuthology.misc.zstandard', None)
+def test_get_archive_codecs_without_zstandard():
+    assert misc.get_archive_codecs() == ['pigz', 'gzip']
+
+
+def test_pull_directory_negotiates_codec(tmp_path):
+    remote = Mock(shortname='smithi001')
+    remote.choose_archive_codec.return_value = 'pigz'
+    remote.get_tar_stream.return_value = Mock(
+        stdout=io.BytesIO(_tar_bytes({'./sub/a.log': b'abc'}, 'w:gz')))
+    misc.pull_directory(remote, '/remote/dir', str(tmp_path))
+    remote.choose_archive_codec.assert_called_once_with(
+        misc.get_archive_codecs())
+    remote.get_tar_stream.assert_called_once_with(
+        '/remote/dir', sudo=True, codec='pigz')
+    assert (tmp_path / 'sub' / 'a.log').read_bytes() == b'abc'
+    remote.get_tar_stream.return_value.wait.assert_called_once_with()
+
+
+def test_pull_directory_tar_fails(tmp_path):
+    remote = Mock(shortname='smithi001')
+    process = remote.get_tar_stream.return_value = Mock(
+        stdout=io.BytesIO(_tar_bytes({'./a.log': b'abc'}, 'w:gz')))
+    process.wait.side_effect = CommandFailedError('tar', 2)
+    with pytest.raises(CommandFailedError):
+        misc.pull_directory(remote, '/remote/dir', str(tmp_path),
+                            codec='gzip')
+
+
+def test_move_file_preserve_perms():
+    remote = Mock()
+    misc.move_file(remote, '/tmp/src', '/etc/dst', sudo=True)
+    remote.run_or_batch.assert_called_once_with(
+        'perms=$(sudo stat -c %a /etc/dst) && sudo mv -- /tmp/src /etc/dst'
+        ' && sudo chmod "$perms" /etc/dst')
+
+
 class TestHostnames(object):
     def setup_method(self):
         config._conf = dict()
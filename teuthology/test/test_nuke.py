@@ -10,6 +10,7 @@ from teuthology import nuke
 from teuthology import misc
 from teuthology.config import config
 from teuthology.dispatcher.supervisor import create_fake_context
+from teuthology.exceptions import CommandFailedError
 
 class TestNuke(object):
 
@@ -252,7 +253,8 @@ def test_nuke_internal():
             nuke,
             nuke_helper=DEFAULT,
             unlock_one=DEFAULT,
-            get_status=lambda i: statuses[i],
+            get_status_map=lambda targets, **kwargs: {
+                t: statuses[t] for t in targets},
             ) as m:
         nuke.nuke(ctx, True)
         m['nuke_helper'].assert_called_with(ANY, True, False, True)
@@ -263,7 +265,8 @@ def test_nuke_internal():
             nuke,
             nuke_helper=DEFAULT,
             unlock_one=DEFAULT,
-            get_status=lambda i: statuses[i],
+            get_status_map=lambda targets, **kwargs: {
+                t: statuses[t] for t in targets},
             ) as m:
         nuke.nuke(ctx, False)
         m['nuke_helper'].assert_called_with(ANY, False, False, True)
@@ -274,7 +277,8 @@ def test_nuke_internal():
             nuke,
             nuke_helper=DEFAULT,
             unlock_one=DEFAULT,
-            get_status=lambda i: statuses[i],
+            get_status_map=lambda targets, **kwargs: {
+                t: statuses[t] for t in targets},
             ) as m:
         nuke.nuke(ctx, False, True, False, True, False)
         m['nuke_helper'].assert_called_with(ANY, False, True, False)
@@ -286,8 +290,106 @@ def test_nuke_internal():
             nuke,
             nuke_helper=DEFAULT,
             unlock_one=DEFAULT,
-            get_status=lambda i: statuses[i],
+            get_status_map=lambda targets, **kwargs: {
+                t: statuses[t] for t in targets},
             ) as m:
         nuke.nuke(ctx, True)
         m['nuke_helper'].assert_not_called()
         m['unlock_one'].assert_not_called()
+
+
+
+def test_nuke_retry_and_resume(tmp_path):
+    targets = {'user@host%d' % i: 'key%d' % i for i in range(4)}
+    ctx = create_fake_context(dict(
+        owner='test_owner', targets=targets, archive_path='/path',
+        machine_type='test_machine', name='test_name'))
+    statuses = {t: {'name': t, 'description': 'test_name'} for t in targets}
+    progress = str(tmp_path / 'progress')
+    attempts = dict()
+    broken = ['user@host1']
+
+    def nuke_helper(ctx, *args):
+        (target,) = ctx.config['targets']
+        attempts[target] = attempts.get(target, 0) + 1
+        if target in broken or \
+                target == 'user@host2' and attempts[target] == 1:
+            raise RuntimeError()
+
+    with patch.multiple(
+            nuke,
+            nuke_helper=nuke_helper,
+            unlock_one=DEFAULT,
+            get_status_map=lambda targets, **kwargs: {
+                t: statuses[t] for t in targets},
+            ) as m, patch.object(nuke.time, 'sleep') as m_sleep:
+        nuke.nuke(ctx, True, workers=2, retries=1, progress=progress)
+        assert attempts == {'user@host0': 1, 'user@host1': 2,
+                            'user@host2': 2, 'user@host3': 1}
+        assert m_sleep.call_count == 2
+        assert m['unlock_one'].call_count == 3
+        assert nuke.read_progress(progress) == \
+            set(['user@host0', 'user@host2', 'user@host3'])
+
+        # Running it again only nukes what's left, then forgets the progress
+        attempts.clear()
+        broken.clear()
+        nuke.nuke(ctx, True, retries=0, progress=progress)
+        assert attempts == {'user@host1': 1}
+        assert not os.path.exists(progress)
+
+class TestCleanup(object):
+    def make_remote(self, package_type, stdout):
+        remote = Mock(shortname='host1')
+        remote.os.package_type = package_type
+        remote.os.name = 'ubuntu' if package_type == 'deb' else 'centos'
+
+        def fake_run(**kwargs):
+            kwargs['stdout'].write(stdout)
+            return Mock(stdout=kwargs['stdout'], returncode=0)
+        remote.run.side_effect = fake_run
+        return remote
+
+    def make_ctx(self, remote):
+        ctx = Mock()
+        ctx.cluster.remotes = {remote: ['role']}
+        ctx.teuthology_config = dict(test_path='/home/ubuntu/cephtest')
+        return ctx
+
+    def test_one_command_per_remote(self):
+        steps = len(nuke.actions.cleanup_steps(
+            Mock(), self.make_remote('deb', ''), after_reboot=True))
+        stdout = ''.join('teuthology-batch-step %d 0\n' % i
+                         for i in range(steps))
+        remote = self.make_remote('deb', stdout)
+        nuke.actions.cleanup(self.make_ctx(remote), after_reboot=True)
+        remote.run.assert_called_once()
+        script = remote.run.call_args[1]['stdin']
+        assert 'killall --quiet ceph-mon' in script
+        assert 'dpkg --remove' in script
+        assert 'yum' not in script
+        # The daemons get 180 seconds to stop
+        assert "timeout 180 bash -c 'sudo stop ceph-all" in script
+
+    def test_steps(self):
+        ctx = Mock()
+        names = [step[0] for step in nuke.actions.cleanup_steps(
+            ctx, self.make_remote('rpm', ''))]
+        assert names == ['clear_firewall', 'stop daemons', 'kill daemons',
+                         'kill_valgrind']
+        names = [step[0] for step in nuke.actions.cleanup_steps(
+            ctx, self.make_remote('rpm', ''), after_reboot=True,
+            keep_logs=True)]
+        assert 'remove_testing_tree' not in names
+        assert 'remove_yum_timedhosts' in names
+        assert 'dpkg_configure' not in names
+
+    def test_failed_step(self):
+        # The firewall was cleared, and stopping the daemons failed but
+        # doesn't matter; killing them failed and does
+        remote = self.make_remote(
+            'rpm', 'teuthology-batch-step 0 0\nteuthology-batch-step 1 1\n'
+            'teuthology-batch-step 2 1\n')
+        with pytest.raises(CommandFailedError) as excinfo:
+            nuke.actions.cleanup(self.make_ctx(remote))
+        assert excinfo.value.label == 'batch step 3 of 4'
@@ -1,3 +1,5 @@
+import gevent
+
 from teuthology.parallel import parallel
 
 
@@ -26,3 +28,22 @@ class TestParallel(object):
             for result in para:
                 in_set.remove(result)
 
+
+    def test_size(self):
+        running = set()
+        seen = list()
+
+        def track(item):
+            running.add(item)
+            seen.append(len(running))
+            gevent.sleep(0.01)
+            running.remove(item)
+            return item
+
+        in_set = set(range(10))
+        with parallel(size=3) as para:
+            for i in in_set:
+                para.spawn(track, i)
+            results = set(para)
+        assert results == in_set
+        assert max(seen) == 3
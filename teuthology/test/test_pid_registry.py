@@ -0,0 +1,83 @@
+import os
+
+from unittest.mock import patch
+
+from teuthology import kill
+from teuthology.util import pid_registry
+
+
+class TestPIDRegistry(object):
+    def setup_method(self):
+        self.p_config = patch.object(pid_registry, 'config')
+        self.m_config = self.p_config.start()
+
+    def teardown_method(self):
+        self.p_config.stop()
+
+    def test_register(self, tmp_path):
+        self.m_config.pid_registry_dir = str(tmp_path)
+        assert pid_registry.find_pids('run1') is None
+        pid_registry.register('run1', 1, 100)
+        pid_registry.register('run1', 1, 101)
+        pid_registry.register('run1', 2, 200)
+        pid_registry.register('run2', 3, 300)
+        assert sorted(pid_registry.find_pids('run1')) == [100, 101, 200]
+        assert pid_registry.find_pids('run1', 2) == [200]
+        assert pid_registry.find_pids('run1', 4) == []
+        pid_registry.unregister('run1', 1)
+        pid_registry.unregister('run1', 1)
+        assert pid_registry.find_pids('run1') == [200]
+        assert pid_registry.job_ids('run1') == {'2'}
+        pid_registry.unregister('run1', 2)
+        # Nothing is left of the run
+        assert pid_registry.find_pids('run1') is None
+        assert sorted(os.listdir(str(tmp_path))) == ['run2']
+
+    def test_default_dir(self, tmp_path):
+        self.m_config.pid_registry_dir = None
+        with patch.object(pid_registry.tempfile, 'gettempdir',
+                          return_value=str(tmp_path)):
+            pid_registry.register('run1', 1, 100)
+            path = os.path.join(str(tmp_path), 'teuthology-pids')
+            assert os.stat(path).st_mode & 0o1777 == 0o1777
+            assert pid_registry.find_pids('run1') == [100]
+
+    def test_kill_processes(self, tmp_path):
+        self.m_config.pid_registry_dir = str(tmp_path)
+        pid_registry.register('run1', 1, 100)
+        pid_registry.register('run1', 1, 101)
+        jobs = {
+            'run1': [dict(job_id='1', status='running'),
+                     dict(job_id='2', status='queued')],
+            'run3': [dict(job_id='5', status='running'),
+                     dict(job_id='6', status='waiting')],
+        }
+        pid_registry.register('run3', 5, 500)
+        with patch.object(kill.config, 'results_server', 'http://paddles'), \
+                patch.object(kill.report, 'ResultsReporter') as m_reporter, \
+                patch.multiple(
+                kill,
+                find_pids=lambda run_name: [400],
+                process_matches_run=lambda pid, run_name: pid != 100,
+                ), \
+                patch.object(kill.psutil, 'pid_exists',
+                             side_effect=lambda pid: pid != 102), \
+                patch.object(kill.psutil, 'Process'), \
+                patch.object(kill.getpass, 'getuser'), \
+                patch.object(kill.subprocess, 'Popen'), \
+                patch.object(kill.subprocess, 'call') as m_call:
+            m_reporter.return_value.get_jobs.side_effect = \
+                lambda run_name, fields: jobs[run_name]
+            kill.kill_processes('run1')
+            # 100 is the supervisor
+            assert m_call.call_args_list[-1][0][0][-1] == '101'
+            assert m_call.call_count == 1
+            m_call.reset_mock()
+            kill.kill_processes('run2')
+            assert m_call.call_args_list[-1][0][0][-1] == '400'
+            m_call.reset_mock()
+            # Job 6 was started without registering it, so every process
+            # is looked at
+            kill.kill_processes('run3')
+            assert m_call.call_args_list[-1][0][0][-1] == '400'
+            assert m_call.call_count == 1
@@ -0,0 +1,127 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from unittest.mock import patch
+
+from teuthology import prune
+from teuthology.config import config
+
+DAY = 60 * 60 * 24
+
+
+class TestPrune(object):
+    def age(self, path, days):
+        then = time.time() - days * DAY
+        os.utime(path, (then, then))
+
+    def make_job(self, run_dir, job_id, success=None, days=0, log=b''):
+        job_dir = run_dir / job_id
+        (job_dir / 'remote' / 'smithi001').mkdir(parents=True)
+        (job_dir / 'remote' / 'smithi001' / 'ceph.log').write_bytes(
+            b'x' * 100)
+        (job_dir / 'teuthology.log').write_bytes(log)
+        if success is not None:
+            summary = job_dir / 'summary.yaml'
+            summary.write_text(
+                "description: foo\nowner: me\nsuccess: %s\n" %
+                str(success).lower())
+            self.age(summary, days)
+        self.age(job_dir, days)
+        return job_dir
+
+    def make_archive(self, tmp_path):
+        run_dir = tmp_path / 'run1'
+        run_dir.mkdir()
+        self.passed = self.make_job(run_dir, '1', True, days=20)
+        self.failed = self.make_job(run_dir, '2', False, days=20,
+                                    log=b'line\n' * 1000)
+        self.running = self.make_job(run_dir, '3', None, days=70,
+                                     log=b'line\n' * 1000)
+        self.recent = self.make_job(run_dir, '4', True, days=1)
+        self.age(run_dir, 20)
+        return tmp_path
+
+    def test_job_success(self, tmp_path):
+        summary = tmp_path / 'summary.yaml'
+        summary.write_text("failure_reason: foo\nsuccess: false\n")
+        assert prune.job_success(str(summary)) is False
+        summary.write_text("success: true\n" + "targets: x\n" * 2000)
+        assert prune.job_success(str(summary), tail_size=64) is True
+        summary.write_text("status: running\n")
+        assert prune.job_success(str(summary)) is None
+
+    def test_dry_run(self, tmp_path):
+        archive = self.make_archive(tmp_path)
+        report = prune.prune_archive(str(archive), 14, -1, 60, 30,
+                                     dry_run=True, workers=2)
+        assert report.counts == {
+            'passed jobs': 1,
+            'remote logs': 1,
+            'compressed logs': 1,
+        }
+        assert report.sizes['remote logs'] == 100
+        assert report.sizes['compressed logs'] == 5000
+        assert self.passed.exists()
+        assert (self.running / 'remote').exists()
+        assert (self.running / 'teuthology.log').exists()
+
+    def test_prune(self, tmp_path):
+        archive = self.make_archive(tmp_path)
+        report = prune.prune_archive(str(archive), 14, 15, 60, 10,
+                                     workers=2)
+        assert not self.passed.exists()
+        assert not self.failed.exists()
+        assert not (self.running / 'remote').exists()
+        assert not (self.running / 'teuthology.log').exists()
+        with gzip.open(str(self.running / 'teuthology.log.gz')) as f:
+            assert f.read() == b'line\n' * 1000
+        assert (self.recent / 'remote').exists()
+        assert report.counts['failed jobs'] == 1
+        # remote logs, teuthology.log and summary.yaml
+        assert report.sizes['failed jobs'] == 100 + 5000 + len(
+            "description: foo\nowner: me\nsuccess: false\n")
+        assert 0 < report.sizes['compressed logs'] < 5000
+
+    def test_prune_indexed(self, tmp_path):
+        archive = tmp_path / 'archive'
+        archive.mkdir()
+        self.make_archive(archive)
+        with patch.multiple(config, archive_index=True,
+                            archive_index_path=str(tmp_path / 'index')), \
+                patch.object(prune, 'job_success') as m_job_success:
+            report = prune.prune_archive(str(archive), 14, 15, -1, -1,
+                                         workers=2)
+        # How the jobs went came from the index, not their summaries
+        m_job_success.assert_not_called()
+        assert not self.passed.exists()
+        assert not self.failed.exists()
+        assert self.running.exists()
+        assert self.recent.exists()
+        assert report.counts == {'passed jobs': 1, 'failed jobs': 1}
+
+    def test_remove_counts_bytes(self, tmp_path):
+        job_dir = self.make_job(tmp_path, '1', True, log=b'x' * 50)
+        assert prune.remove(str(job_dir)) == 100 + 50 + len(
+            "description: foo\nowner: me\nsuccess: true\n")
+        assert not job_dir.exists()
+
+    def test_preserve(self, tmp_path):
+        archive = self.make_archive(tmp_path)
+        (self.passed / prune.PRESERVE_FILE).write_text('')
+        prune.prune_archive(str(archive), 14, 15, 60, 10, workers=1)
+        assert self.passed.exists()
+        assert not self.failed.exists()
+
+    def test_compress_zstd(self, tmp_path):
+        if prune.zstandard is None:
+            pytest.skip("zstandard is not installed")
+        log_path = tmp_path / 'teuthology.log'
+        log_path.write_bytes(b'line\n' * 1000)
+        assert prune.compress_log(str(log_path), 'zstd') > 0
+        assert not log_path.exists()
+        with open(str(log_path) + '.zst', 'rb') as f:
+            data = prune.zstandard.ZstdDecompressor().stream_reader(f).read()
+        assert data == b'line\n' * 1000
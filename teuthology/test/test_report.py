@@ -1,7 +1,11 @@
+import http.server
+import threading
 import yaml
 import json
+from unittest.mock import patch
 from teuthology.test import fake_archive
 from teuthology import report
+from teuthology.job_status import get_status
 
 
 class TestSerializer(object):
@@ -75,3 +79,179 @@ class TestSerializer(object):
         assert full_obj == out_obj
 
 
+
+
+class FakeResultsServer(object):
+    """
+    A minimal stand-in for paddles, storing the jobs posted to it
+    """
+    def __init__(self, accept_batches=False, batch_failures=0):
+        self.accept_batches = accept_batches
+        # How many batches to fail with a 503 before accepting them
+        self.batch_failures = batch_failures
+        self.jobs = dict()
+        self.requests = list()
+        self.ports = set()
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), self._make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def uri(self):
+        return 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers['Content-Length'])
+                return json.loads(self.rfile.read(length))
+
+            def do_HEAD(self):
+                fake.requests.append(('HEAD', self.path))
+                self._reply(404)
+
+            def do_POST(self):
+                fake.requests.append(('POST', self.path))
+                fake.ports.add(self.client_address[1])
+                body = self._read_json()
+                if isinstance(body, list):
+                    if not fake.accept_batches:
+                        return self._reply(405)
+                    if fake.batch_failures:
+                        fake.batch_failures -= 1
+                        return self._reply(503)
+                else:
+                    body = [body]
+                for job in body:
+                    job_id = str(job['job_id'])
+                    if job_id in fake.jobs:
+                        msg = 'job with job_id %s already exists' % job_id
+                        return self._reply(
+                            400, json.dumps(dict(message=msg)).encode())
+                    fake.jobs[job_id] = job
+                self._reply(200)
+
+            def do_PUT(self):
+                fake.requests.append(('PUT', self.path))
+                job = self._read_json()
+                fake.jobs[str(job['job_id'])] = job
+                self._reply(200)
+
+        return Handler
+
+
+class TestReporter(object):
+    run_name = 'test_reporter'
+
+    def setup_method(self):
+        self.archive = fake_archive.FakeArchive()
+        self.archive.setup()
+        self.jobs = self.archive.create_fake_run(
+            self.run_name, 20, 'examples/3node_ceph.yaml')
+        self.job_ids = sorted(str(job['job_id']) for job in self.jobs)
+
+    def teardown_method(self):
+        self.archive.teardown()
+        if getattr(self, 'server', None):
+            self.server.stop()
+
+    def start_server(self, **kwargs):
+        self.server = FakeResultsServer(**kwargs)
+        self.server.start()
+        return self.server
+
+    def make_reporter(self, **kwargs):
+        return report.ResultsReporter(
+            archive_base=self.archive.archive_base,
+            base_uri=self.server.uri,
+            **kwargs
+        )
+
+    def posts(self):
+        return [r for r in self.server.requests if r[0] == 'POST']
+
+    def test_report_run(self):
+        self.start_server()
+        reporter = self.make_reporter(workers=4)
+        assert reporter.report_run(self.run_name) == len(self.job_ids)
+        assert sorted(self.server.jobs) == self.job_ids
+        assert len(self.posts()) == len(self.job_ids)
+        # connections are kept alive and shared between workers
+        assert len(self.server.ports) <= 4
+
+    def test_report_jobs_dead(self):
+        self.start_server()
+        reporter = self.make_reporter(workers=4)
+        hung = self.job_ids[:3]
+        reporter.report_jobs(self.run_name, hung, dead=True)
+        assert sorted(self.server.jobs) == hung
+        for job in self.server.jobs.values():
+            assert get_status(job) in ('dead', 'pass', 'fail')
+
+    def test_report_jobs_existing(self):
+        self.start_server()
+        reporter = self.make_reporter(workers=4)
+        reporter.report_jobs(self.run_name, self.job_ids)
+        reporter.report_jobs(self.run_name, self.job_ids)
+        puts = [r for r in self.server.requests if r[0] == 'PUT']
+        assert len(puts) == len(self.job_ids)
+
+    def test_report_batches(self):
+        self.start_server(accept_batches=True)
+        reporter = self.make_reporter(workers=2, batch_size=8)
+        assert reporter.report_jobs(self.run_name, self.job_ids) == 20
+        assert sorted(self.server.jobs) == self.job_ids
+        assert len(self.posts()) == 3
+
+    def test_report_batches_unsupported(self):
+        self.start_server()
+        reporter = self.make_reporter(workers=1, batch_size=8)
+        reporter.report_jobs(self.run_name, self.job_ids)
+        assert sorted(self.server.jobs) == self.job_ids
+        # one rejected batch, then one POST per job
+        assert len(self.posts()) == len(self.job_ids) + 1
+        assert reporter.batch_size == 0
+
+    def test_report_batches_server_error(self):
+        # e.g. a server that fails to parse a list of jobs
+        self.start_server(accept_batches=True, batch_failures=1)
+        reporter = self.make_reporter(workers=1, batch_size=10)
+        with patch('teuthology.contextutil.time.sleep') as m_sleep:
+            reporter.report_jobs(self.run_name, self.job_ids)
+        assert sorted(self.server.jobs) == self.job_ids
+        # the failed batch isn't retried, and batching is turned off
+        assert len(self.posts()) == len(self.job_ids) + 1
+        assert reporter.batch_size == 0
+        m_sleep.assert_not_called()
+
+    def test_report_batches_existing(self):
+        self.start_server(accept_batches=True)
+        reporter = self.make_reporter(workers=1, batch_size=10)
+        reporter.report_jobs(self.run_name, self.job_ids[:5])
+        reporter.report_jobs(self.run_name, self.job_ids)
+        assert sorted(self.server.jobs) == self.job_ids
+        # the batch holding existing jobs falls back to one POST per job,
+        # but batching stays on for the next
+        assert len(self.posts()) == 1 + 1 + 10 + 1
+        assert reporter.batch_size == 10
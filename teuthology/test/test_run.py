@@ -125,6 +125,8 @@ class TestRun(object):
         m_fetch_qa_suite.assert_called_with("feature_branch", commit="commit")
         assert result == "/some/other/suite/path/qa"
 
+    @patch("teuthology.run.tracer")
+    @patch("teuthology.run.command_trace")
     @patch("teuthology.run.get_status")
     @patch("teuthology.run.nuke")
     @patch("yaml.safe_dump")
@@ -132,7 +134,7 @@ class TestRun(object):
     @patch("teuthology.run.email_results")
     @patch("teuthology.run.open")
     @patch("sys.exit")
-    def test_report_outcome(self, m_sys_exit, m_open, m_email_results, m_try_push_job_info, m_safe_dump, m_nuke, m_get_status):
+    def test_report_outcome(self, m_sys_exit, m_open, m_email_results, m_try_push_job_info, m_safe_dump, m_nuke, m_get_status, m_command_trace, m_tracer):
         m_get_status.return_value = "fail"
         fake_ctx = Mock()
         summary = {"failure_reason": "reasons"}
@@ -144,6 +146,9 @@ class TestRun(object):
         assert m_nuke.called
         m_try_push_job_info.assert_called_with(config, summary)
         m_open.assert_called_with("the/archive/path/summary.yaml", "w")
+        m_command_trace.write.assert_called_with(
+            "the/archive/path/command_trace.jsonl")
+        m_tracer.write.assert_called_with("the/archive/path/trace.json")
         assert m_email_results.called
         assert m_open.called
         assert m_sys_exit.called
@@ -5,6 +5,7 @@ import shutil
 import tempfile
 import yaml
 from teuthology import scrape
+from teuthology.util import seekable_log
 
 class FakeResultDir(object):
     """Mocks a Result Directory"""
@@ -131,6 +132,31 @@ class TestScrape(object):
             vreason = scrape.ValgrindReason(job)
             assert vreason.match(job)
 
+    def test_valgrindreason_large_log(self, monkeypatch):
+        monkeypatch.setattr(scrape, "MAX_TEUTHOLOGY_LOG", 10)
+        line = "2014-08-22T20:07:18.668 ERROR:tasks.ceph:saw valgrind issue   <kind>Leak_DefinitelyLost</kind> in /var/log/ceph/valgrind/osd.3.log.gz\n"
+        with FakeResultDir(failure_reason="saw valgrind issues",
+                           assertion=line) as d:
+            grepped = []
+
+            def grep(path, expr):
+                grepped.append(path)
+                with open(path) as f:
+                    return [l.rstrip("\n") for l in f if expr in l] + ['']
+            monkeypatch.setattr(scrape, "grep", grep)
+            job = scrape.Job(d.path, 1)
+            assert job.get_features() is None
+            assert scrape.ValgrindReason(job).service_types == \
+                {'osd': ['Leak_DefinitelyLost']}
+            # Searched once, however often the reason looks
+            assert len(grepped) == 1
+            t_path = os.path.join(d.path, "teuthology.log")
+            seekable_log.compress(t_path, t_path + ".gz")
+            os.remove(t_path)
+            job = scrape.Job(d.path, 1)
+            assert scrape.ValgrindReason(job).service_types == \
+                {'osd': ['Leak_DefinitelyLost']}
+
     def test_give_me_a_reason(self):
         with FakeResultDir() as d:
             job = scrape.Job(d.path, 1)
@@ -165,3 +191,139 @@ class TestScrape(object):
         assert os.path.exists(os.path.join(d.path, "scrape.log"))
 
         shutil.rmtree(d.path)
+
+    def test_log_features(self):
+        data = (
+            b"2014-08-22T20:07:17 INFO:teuthology:starting\n"
+            b"2014-08-22T20:07:18 INFO:tasks.ceph.osd.0.smithi01.stderr:"
+            b"./osd/OSD.cc: 10: FAILED assert(false)\n"
+            b"2014-08-22T20:07:18 INFO:tasks.ceph.osd.0.smithi01.stderr:"
+            b" ceph version 1000\n"
+            b"2014-08-22T20:07:18 INFO:tasks.ceph.osd.0.smithi01.stderr:"
+            b" 1: (foo()+0x10)\n"
+            b"2014-08-22T20:07:18 INFO:tasks.ceph.osd.0.smithi01.stderr:"
+            b" NOTE: a copy of the executable is needed\n"
+            b"2014-08-22T20:07:19 INFO:tasks.ceph.osd.1.smithi01.stderr:"
+            b"./osd/OSD.cc: 20: FAILED assert(later)\n"
+            b"2014-08-22T20:07:20 ERROR:tasks.ceph:saw valgrind issue "
+            b"  <kind>Leak_DefinitelyLost</kind> in /var/log/ceph/valgrind/"
+            b"osd.3.log.gz\n"
+            b"2014-08-22T20:07:21 INFO:tasks.ceph.osd.2:command crashed with "
+            b"signal 6\n"
+            b"2014-08-22T20:07:22 INFO:teuthology:the end\n"
+        )
+        self.check_log_features(scrape.LogFeatures.scan(data))
+        # However the log is split up, the same features are found
+        for size in (7, 50, 100, 200):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.check_log_features(scrape.LogFeatures.scan_chunks(chunks))
+        assert scrape.LogFeatures.scan_chunks([data], limit=100) is None
+
+    def check_log_features(self, features):
+        assert features.backtrace == "ceph version 1000\n 1: (foo()+0x10)"
+        assert features.assertion == "./osd/OSD.cc: 10: FAILED assert(false)"
+        assert len(features.valgrind) == 1
+        assert "<kind>Leak_DefinitelyLost</kind>" in features.valgrind[0]
+        assert features.crashes == [
+            "2014-08-22T20:07:21 INFO:tasks.ceph.osd.2:command crashed with "
+            "signal 6"
+        ]
+        assert features.last_line == \
+            b"2014-08-22T20:07:22 INFO:teuthology:the end"
+
+    def test_log_features_empty(self):
+        features = scrape.LogFeatures.scan(b"")
+        assert features.backtrace is None
+        assert features.last_line == b""
+
+    def test_scraper_workers(self):
+        with FakeResultDir() as d:
+            for job_id in ("1", "2", "3"):
+                job_dir = os.path.join(d.path, job_id)
+                os.mkdir(job_dir)
+                for name in ("config.yaml", "summary.yaml", "teuthology.log"):
+                    shutil.copy(os.path.join(d.path, name), job_dir)
+            jobs = scrape.Scraper(d.path, workers=2).load_jobs()
+            assert sorted(job.job_id for job in jobs) == ["1", "2", "3"]
+            for job in jobs:
+                assert job.populated
+                assert job.get_assertion() == "FAILED assert 1 == 2"
+
+    def test_passed_jobs_not_scanned(self):
+        with FakeResultDir() as d:
+            with open(os.path.join(d.path, "summary.yaml"), "w") as f:
+                yaml.dump({"success": True}, f)
+            job = scrape.load_job(d.path, "1")
+            assert not job.scanned
+            assert not job.populated
+
+    def test_large_log_not_scanned(self, monkeypatch):
+        monkeypatch.setattr(scrape, "MAX_TEUTHOLOGY_LOG", 10)
+        with FakeResultDir() as d:
+            job = scrape.load_job(d.path, "1")
+            assert job.get_features() is None
+            assert job.get_backtrace() is None
+            assert job.get_last_tlog_line() == \
+                b"NOTE: a copy of the executable dummy text"
+
+    def test_compressed_log(self):
+        with FakeResultDir() as d:
+            log_path = os.path.join(d.path, "teuthology.log")
+            seekable_log.compress(log_path, log_path + ".gz")
+            os.remove(log_path)
+            job = scrape.load_job(d.path, "1")
+            assert job.get_assertion() == "FAILED assert 1 == 2"
+            assert job.get_last_tlog_line() == \
+                b"NOTE: a copy of the executable dummy text"
+
+    def test_normalize(self):
+        assert scrape.normalize(
+            "Command failed on smithi001 with status 1: "
+            "'ssh ubuntu@smithi042.front.sepia.ceph.com 0x7f3e'") == \
+            "Command failed on smithiN with status N: 'ssh HOST ADDR'"
+
+    def test_backtrace_frames(self):
+        backtrace = (
+            "ceph version 17.0.0-123-gdeadbeef\n"
+            " 1: (ceph::__ceph_assert_fail(char const*)+0x14b) "
+            "[0x55b0c0d0c0]\n"
+            " 2: (OSD::handle_osd_map(MOSDMap*)+0x2f) [0x55b0c0d0f0]\n"
+        )
+        assert scrape.backtrace_frames(backtrace) == (
+            "(ceph::__ceph_assert_fail(char const*))",
+            "(OSD::handle_osd_map(MOSDMap*))",
+        )
+
+    def test_signature_index(self):
+        index = scrape.SignatureIndex()
+        first = scrape.FailureSignature(
+            'Failure', "Command failed on smithiN with status N: "
+            "'sudo ceph osd pool create foo N N replicated'", fuzzy=True)
+        index.add(first, "reason")
+        same = scrape.FailureSignature('Failure', first.text, fuzzy=True)
+        assert index.find(same) == "reason"
+        near = scrape.FailureSignature(
+            'Failure', "Command failed on smithiN with status N: "
+            "'sudo ceph osd pool create bar N N replicated'", fuzzy=True)
+        assert index.find(near) == "reason"
+        other_kind = scrape.FailureSignature('Dead', first.text, fuzzy=True)
+        assert index.find(other_kind) is None
+        different = scrape.FailureSignature(
+            'Failure', "timed out waiting for admin_socket to appear "
+            "after osd.N restart", fuzzy=True)
+        assert index.find(different) is None
+        exact = scrape.FailureSignature(
+            'Failure', near.text.replace('bar', 'baz'))
+        assert index.find(exact) is None
+
+    def test_signature_ignores_hosts(self):
+        with FakeResultDir(
+            failure_reason="Command failed on smithi001 with status 1",
+            blank_backtrace=True,
+        ) as d1, FakeResultDir(
+            failure_reason="Command failed on smithi093 with status 1",
+            blank_backtrace=True,
+        ) as d2:
+            sig1 = scrape.get_signature(scrape.Job(d1.path, 1))
+            sig2 = scrape.get_signature(scrape.Job(d2.path, 2))
+            assert sig1 == sig2
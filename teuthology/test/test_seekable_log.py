@@ -0,0 +1,157 @@
+import gzip
+import os
+
+import pytest
+
+from unittest.mock import patch
+
+from teuthology.util import seekable_log
+
+
+def make_log(count=2000):
+    lines = []
+    for i in range(count):
+        lines.append(b"2018-07-27T00:%02d:%02d.000 INFO:teuthology:line %d\n" %
+                     (i // 60, i % 60, i))
+        if i % 100 == 0:
+            lines.append(b"  continued %d\n" % i)
+    return b"".join(lines)
+
+
+class TestSeekableLog(object):
+    def write(self, tmp_path, data, name='teuthology.log.gz', **kwargs):
+        path = str(tmp_path / name)
+        with seekable_log.SeekableLogWriter(path, frame_size=4096,
+                                            **kwargs) as f:
+            f.write(data)
+        return path
+
+    def test_gzip_compatible(self, tmp_path):
+        data = make_log()
+        path = self.write(tmp_path, data)
+        with gzip.open(path) as f:
+            assert f.read() == data
+        reader = seekable_log.SeekableLogReader(path)
+        assert reader.indexed
+        assert len(reader.frames) > 10
+        assert reader.read() == data
+
+    def test_frames_hold_whole_lines(self, tmp_path):
+        path = self.write(tmp_path, make_log())
+        reader = seekable_log.SeekableLogReader(path)
+        for i in range(len(reader.frames)):
+            assert reader.read_frame(i).endswith(b'\n')
+
+    def test_small_log_has_no_index(self, tmp_path):
+        path = self.write(tmp_path, b"one line\n")
+        assert not os.path.exists(path + seekable_log.INDEX_SUFFIX)
+        reader = seekable_log.SeekableLogReader(path)
+        assert not reader.indexed
+        assert reader.tail() == [b"one line"]
+
+    def test_tail(self, tmp_path):
+        data = make_log()
+        path = self.write(tmp_path, data)
+        reader = seekable_log.SeekableLogReader(path)
+        with patch.object(reader, 'read_frame',
+                          wraps=reader.read_frame) as m_read_frame:
+            assert reader.tail(3) == data.splitlines()[-3:]
+        assert m_read_frame.call_count == 1
+        assert seekable_log.tail(path, 2) == data.splitlines()[-2:]
+
+    def test_tail_uncompressed(self, tmp_path):
+        path = tmp_path / 'teuthology.log'
+        path.write_bytes(b"a\nb\nc\n")
+        assert seekable_log.tail(str(path), 2) == [b"b", b"c"]
+        path.write_bytes(b"")
+        assert seekable_log.tail(str(path)) == []
+
+    def test_between(self, tmp_path):
+        data = make_log()
+        path = self.write(tmp_path, data)
+        reader = seekable_log.SeekableLogReader(path)
+        start, end = "2018-07-27T00:10:00", "2018-07-27T00:11:40"
+        with patch.object(reader, 'read_frame',
+                          wraps=reader.read_frame) as m_read_frame:
+            lines = list(reader.between(start, end))
+        assert m_read_frame.call_count < len(reader.frames) / 4
+        assert lines[0] == b"2018-07-27T00:10:00.000 INFO:teuthology:line 600\n"
+        assert lines[1] == b"  continued 600\n"
+        assert lines[-1] == \
+            b"2018-07-27T00:11:39.000 INFO:teuthology:line 699\n"
+        assert len(lines) == 101
+
+    def test_between_unindexed(self, tmp_path):
+        data = make_log()
+        path = str(tmp_path / 'teuthology.log.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(data)
+        reader = seekable_log.SeekableLogReader(path)
+        assert not reader.indexed
+        lines = list(reader.between("2018-07-27T00:10:00",
+                                    "2018-07-27T00:11:40"))
+        assert len(lines) == 101
+
+    def test_stale_index(self, tmp_path):
+        path = self.write(tmp_path, make_log())
+        with gzip.open(path, 'wb') as f:
+            f.write(b"rewritten\n")
+        reader = seekable_log.SeekableLogReader(path)
+        assert not reader.indexed
+        assert reader.tail() == [b"rewritten"]
+
+    def test_grep(self, tmp_path):
+        path = self.write(tmp_path, make_log())
+        reader = seekable_log.SeekableLogReader(path)
+        assert list(reader.grep(r"continued 1\d00$")) == [
+            b"  continued 1%d00" % i for i in range(10)]
+
+    def test_zstd(self, tmp_path):
+        if seekable_log.zstandard is None:
+            pytest.skip("zstandard is not installed")
+        data = make_log()
+        path = self.write(tmp_path, data, name='teuthology.log.zst')
+        reader = seekable_log.SeekableLogReader(path)
+        assert reader.codec == 'zstd'
+        assert reader.read() == data
+        assert reader.tail() == data.splitlines()[-1:]
+
+    def test_chunks_unindexed(self, tmp_path):
+        data = make_log()
+        path = str(tmp_path / 'teuthology.log.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(data)
+        reader = seekable_log.SeekableLogReader(path)
+        assert reader.size is None
+        chunks = list(reader.chunks(size=4096))
+        assert len(chunks) > 1
+        assert max(len(chunk) for chunk in chunks) <= 4096
+        assert b''.join(chunks) == data
+        assert reader.tail(2) == data.splitlines()[-2:]
+
+    def test_size(self, tmp_path):
+        data = make_log()
+        path = self.write(tmp_path, data)
+        assert seekable_log.SeekableLogReader(path).size == len(data)
+
+    def test_zstd_missing(self, tmp_path):
+        path = tmp_path / 'teuthology.log.zst'
+        path.write_bytes(b'')
+        with patch.object(seekable_log, 'zstandard', None):
+            with pytest.raises(IOError) as excinfo:
+                seekable_log.SeekableLogReader(str(path))
+        assert 'zstandard' in str(excinfo.value)
+
+    def test_compress(self, tmp_path):
+        src = tmp_path / 'teuthology.log'
+        src.write_bytes(make_log())
+        os.utime(str(src), (1000000, 1000000))
+        dest = str(tmp_path / 'teuthology.log.gz')
+        seekable_log.compress(str(src), dest, frame_size=4096)
+        assert os.stat(dest).st_mtime == 1000000
+        assert seekable_log.find_log(str(tmp_path / 'teuthology.log')) == \
+            str(src)
+        src.unlink()
+        assert seekable_log.find_log(str(tmp_path / 'teuthology.log')) == \
+            dest
+        assert seekable_log.SeekableLogReader(dest).indexed
@@ -0,0 +1,94 @@
+import gc
+import json
+
+import gevent
+
+from mock import MagicMock
+
+from teuthology import tracing
+from teuthology.parallel import parallel
+
+
+class TestTracer(object):
+    def setup_method(self):
+        self.tracer = tracing.Tracer()
+
+    def test_span(self):
+        with self.tracer.span('outer', 'task', foo='bar'):
+            with self.tracer.span('inner', 'command'):
+                pass
+        events = [e for e in self.tracer.events if e['ph'] == 'X']
+        assert [e['name'] for e in events] == ['inner', 'outer']
+        inner, outer = events
+        assert inner['cat'] == 'command'
+        assert outer['args'] == dict(foo='bar')
+        assert outer['ts'] <= inner['ts']
+        assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+        assert inner['tid'] == outer['tid']
+
+    def test_span_records_on_error(self):
+        try:
+            with self.tracer.span('failing'):
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert [s[0] for s in self.tracer.spans] == ['failing']
+
+    def test_bounded(self):
+        tracer = tracing.Tracer(maxlen=2)
+        for i in range(3):
+            tracer.add('span %d' % i, 'task', 1.0, 2.0)
+        assert tracer.dropped == 1
+        assert [s[0] for s in tracer.spans] == ['span 1', 'span 2']
+
+    def test_greenlets_get_own_threads(self):
+        tracing.tracer.clear()
+
+        def work():
+            return tracing.tracer.current_tid()
+
+        with parallel() as p:
+            p.spawn(work)
+            p.spawn(work)
+            tids = set(p)
+        assert len(tids) == 2
+        assert tracing.tracer.current_tid() not in tids
+        names = [s[0] for s in tracing.tracer.spans]
+        assert names == ['work', 'work']
+
+    def test_finished_greenlets_forgotten(self):
+        tracer = tracing.Tracer(maxlen=2)
+        tids = set()
+        for i in range(5):
+            greenlet = gevent.spawn(tracer.current_tid)
+            tids.add(greenlet.get())
+            del greenlet
+            gc.collect()
+        assert len(tids) == 5
+        assert len(tracer._tids) <= 1
+        assert len(tracer.threads) <= 3
+
+    def test_write(self, tmp_path):
+        self.tracer.add('task', 'task', 1.0, 1.5)
+        path = str(tmp_path / 'trace.json')
+        self.tracer.write(path)
+        with open(path) as f:
+            trace = json.load(f)
+        (meta, event) = trace['traceEvents']
+        assert meta['ph'] == 'M'
+        assert meta['args'] == dict(name='main')
+        assert event['ts'] == 1000000
+        assert event['dur'] == 500000
+
+
+class TestTracedManager(object):
+    def test_spans(self):
+        tracing.tracer.clear()
+        manager = MagicMock()
+        manager.__enter__.return_value = 'value'
+        traced = tracing.TracedManager('install', manager)
+        with traced as value:
+            assert value == 'value'
+        names = [s[0] for s in tracing.tracer.spans]
+        assert names == ['install setup', 'install teardown', 'install']
+        manager.__exit__.assert_called_once_with(None, None, None)
@@ -0,0 +1,177 @@
+"""
+Span-based tracing of a job's timeline.
+
+Spans are recorded for tasks (and their setup and teardown), greenlets
+spawned through teuthology.parallel and remote commands, and can be
+written in the Chrome trace-event format. The resulting file can be opened
+with chrome://tracing, https://ui.perfetto.dev or speedscope.
+
+Tasks can add their own spans::
+
+    from teuthology import tracing
+
+    with tracing.span('wait for healthy', cluster='ceph'):
+        wait_until_healthy(ctx, remote)
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import time
+import weakref
+
+import gevent
+
+log = logging.getLogger(__name__)
+
+
+class Tracer(object):
+    """
+    A bounded, in-memory collection of completed spans.
+
+    Each greenlet is shown as a separate thread in the trace so that work
+    running in parallel does not overlap. Once maxlen spans are recorded
+    the oldest ones are dropped, along with the names of threads none of the
+    remaining spans are in.
+    """
+    def __init__(self, maxlen=100000):
+        self.spans = collections.deque(maxlen=maxlen)
+        self.dropped = 0
+        self.threads = dict()
+        # Keyed on the greenlets themselves, so that finished ones are
+        # forgotten and their ids can't be mistaken for new greenlets'
+        self._tids = weakref.WeakKeyDictionary()
+        self._next_tid = 1
+
+    def current_tid(self):
+        """
+        Return the trace thread id of the current greenlet
+        """
+        current = gevent.getcurrent()
+        tid = self._tids.get(current)
+        if tid is None:
+            tid = self._next_tid
+            self._next_tid += 1
+            self._tids[current] = tid
+            if isinstance(current, gevent.Greenlet):
+                self.threads[tid] = current.name
+            else:
+                self.threads[tid] = 'main'
+            if len(self.threads) > self.spans.maxlen:
+                self._prune_threads()
+        return tid
+
+    def _prune_threads(self):
+        live = set(self._tids.values())
+        live.update(span[4] for span in self.spans)
+        for tid in list(self.threads):
+            if tid not in live:
+                del self.threads[tid]
+
+    def add(self, name, category, start, end, tid=None, **args):
+        """
+        Record a completed span
+
+        :param name:     what the span describes
+        :param category: the kind of span, e.g. 'task' or 'command'
+        :param start:    start time in seconds; like from time.time()
+        :param end:      end time in seconds
+        :param tid:      the trace thread to show the span in; defaults to
+                         the current greenlet's
+        :param args:     extra values shown with the span
+        """
+        if len(self.spans) == self.spans.maxlen:
+            self.dropped += 1
+        if tid is None:
+            tid = self.current_tid()
+        self.spans.append((name, category, start, end, tid, args))
+
+    @contextlib.contextmanager
+    def span(self, name, category='task', **args):
+        """
+        Record a span covering the body of the with block
+        """
+        tid = self.current_tid()
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.time(), tid=tid, **args)
+
+    def clear(self):
+        self.spans.clear()
+        self.dropped = 0
+        self.threads.clear()
+        self._tids.clear()
+        self._next_tid = 1
+
+    @property
+    def events(self):
+        """
+        The recorded spans as a list of Chrome trace events
+        """
+        pid = os.getpid()
+        events = [
+            dict(name='thread_name', ph='M', pid=pid, tid=tid,
+                 args=dict(name=name))
+            for tid, name in sorted(self.threads.items())
+        ]
+        for name, category, start, end, tid, args in self.spans:
+            event = dict(
+                name=name,
+                cat=category,
+                ph='X',
+                ts=int(start * 1e6),
+                dur=int((end - start) * 1e6),
+                pid=pid,
+                tid=tid,
+            )
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+    def write(self, path):
+        """
+        Write the recorded spans to path as a Chrome trace JSON object
+        """
+        with open(path, 'w') as f:
+            json.dump(
+                dict(traceEvents=self.events, displayTimeUnit='ms'),
+                f,
+                separators=(',', ':'),
+            )
+        if self.dropped:
+            log.info('Trace dropped the oldest %d spans', self.dropped)
+
+
+tracer = Tracer()
+span = tracer.span
+
+
+class TracedManager(object):
+    """
+    Wrap a task's context manager, recording spans for the whole task and
+    for its setup (__enter__) and teardown (__exit__).
+    """
+    def __init__(self, name, manager):
+        self.name = name
+        self.manager = manager
+        self.start = None
+        self.tid = None
+
+    def __enter__(self):
+        self.tid = tracer.current_tid()
+        self.start = time.time()
+        with span('%s setup' % self.name, 'task.setup'):
+            return self.manager.__enter__()
+
+    def __exit__(self, *exc_info):
+        try:
+            with span('%s teardown' % self.name, 'task.teardown'):
+                return self.manager.__exit__(*exc_info)
+        finally:
+            if self.start is not None:
+                tracer.add(self.name, 'task', self.start, time.time(),
+                           tid=self.tid)
@@ -0,0 +1,57 @@
+"""
+Helpers for the per-user caches teuthology keeps on local disk
+"""
+import hashlib
+import json
+import os
+
+
+def cache_dir(*parts):
+    """
+    The directory teuthology caches things in, below $XDG_CACHE_HOME or
+    ~/.cache; with any parts joined on to it
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'teuthology', *parts)
+
+
+def path_key(path):
+    """
+    A short name for a file or directory elsewhere, for naming the cache of
+    something about it
+    """
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+
+
+def load_json(path):
+    """
+    :returns: What was saved to path by save_json(), or None if it can't be
+              read
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json(path, obj):
+    """
+    Save obj to path atomically, so that readers never see a partial file.
+    Caches are best-effort; failures are ignored.
+
+    :returns: True if it was saved
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
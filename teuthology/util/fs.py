@@ -0,0 +1,54 @@
+"""
+Helpers for measuring and removing directory trees
+"""
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+def dir_size(path):
+    """
+    The total size in bytes of the files below path
+    """
+    size = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size += dir_size(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return size
+
+
+def remove_tree(path):
+    """
+    Recursively remove a directory, adding up the sizes of the files removed
+    as it goes rather than in a separate walk. Files that can't be removed
+    are logged and skipped.
+
+    :returns: The number of bytes removed
+    """
+    removed = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        log.exception("Failed to list %s !" % path)
+        return removed
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                removed += remove_tree(entry.path)
+                continue
+            size = entry.stat(follow_symlinks=False).st_size
+            os.unlink(entry.path)
+            removed += size
+        except OSError:
+            log.exception("Failed to remove %s !" % entry.path)
+    try:
+        os.rmdir(path)
+    except OSError:
+        log.exception("Failed to remove %s !" % path)
+    return removed
@@ -0,0 +1,159 @@
+"""
+A process-wide pooled HTTP client for talking to paddles and the other
+services teuthology queries
+
+Connections are kept alive and reused between requests instead of paying
+for a new TCP (and TLS) handshake each time. Connection failures, and 502,
+503 and 504 responses to idempotent requests, are retried with exponential
+backoff by urllib3; callers still decide what to do with any other failed
+response. How long each endpoint takes to respond is recorded; see stats().
+"""
+import logging
+import os
+import threading
+
+from urllib.parse import urlparse
+
+import requests
+import requests.adapters
+
+from urllib3.util.retry import Retry
+
+from teuthology.config import config
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = (502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# Endpoint -> [request count, total seconds, longest seconds]
+_stats = dict()
+_stats_lock = threading.Lock()
+
+
+def endpoint(method, url):
+    """
+    The name latencies are recorded under: the method, host and the first
+    component of the path, e.g. 'GET paddles:8080/nodes'
+    """
+    parsed = urlparse(url)
+    path = parsed.path.strip('/').split('/', 1)[0]
+    return '%s %s/%s' % (method, parsed.netloc, path)
+
+
+def _record(response, *args, **kwargs):
+    key = endpoint(response.request.method, response.request.url)
+    seconds = response.elapsed.total_seconds()
+    with _stats_lock:
+        entry = _stats.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+    return response
+
+
+def stats():
+    """
+    :returns: A dict mapping each endpoint requested by this process to a
+              dict of its request count and its mean and longest response
+              times in seconds
+    """
+    with _stats_lock:
+        return {
+            key: dict(count=count, mean=total / count, max=longest)
+            for key, (count, total, longest) in _stats.items()
+        }
+
+
+def log_stats():
+    for key, entry in sorted(stats().items()):
+        log.debug("%s: %d requests, mean %.3fs, max %.3fs",
+                  key, entry['count'], entry['mean'], entry['max'])
+
+
+def make_session(pool_size=None, retries=None, statuses=RETRY_STATUSES):
+    """
+    Build a session with its own connection pool, for callers that need
+    more connections than the shared session keeps. Its requests are
+    retried and recorded in the same way.
+
+    :param pool_size: How many connections to keep open to each host.
+                      Defaults to the http_pool_size setting.
+    :param retries:   How many times to retry a failed request. Defaults to
+                      the http_retries setting.
+    :param statuses:  Which response statuses to retry idempotent requests
+                      on
+    """
+    if pool_size is None:
+        pool_size = config.http_pool_size
+    if retries is None:
+        retries = config.http_retries
+    retry = Retry(
+        total=retries,
+        backoff_factor=config.http_backoff,
+        status_forcelist=statuses,
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(_record)
+    return session
+
+
+def get_session():
+    """
+    The session shared by the whole process. A forked child gets a new one
+    rather than sharing the parent's connections.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = make_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def reset():
+    """
+    Close the shared session's connections and forget all latencies
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is not None and _session_pid == os.getpid():
+            _session.close()
+        _session = _session_pid = None
+    with _stats_lock:
+        _stats.clear()
+
+
+def request(method, url, **kwargs):
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return get_session().get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    return get_session().head(url, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    return get_session().post(url, data=data, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return get_session().put(url, data=data, **kwargs)
+
+
+def delete(url, **kwargs):
+    return get_session().delete(url, **kwargs)
@@ -0,0 +1,106 @@
+"""
+A registry of the processes running each job on this host, so that
+teuthology-kill can find them without looking at every process
+
+The dispatcher records each supervisor it starts, and the supervisor the
+teuthology process it runs the job in. Each job has a file of PIDs below
+a directory per run; the supervisor removes the job's file when it exits,
+and the run's directory once it is empty. Registering can fail, and not
+every job is started by a dispatcher, so the registry only says which
+processes are running a job if it has that job at all.
+"""
+import errno
+import logging
+import os
+import tempfile
+
+from teuthology import safepath
+from teuthology.config import config
+
+log = logging.getLogger(__name__)
+
+
+def registry_dir():
+    return config.pid_registry_dir or \
+        os.path.join(tempfile.gettempdir(), 'teuthology-pids')
+
+
+def run_dir(run_name):
+    return os.path.join(registry_dir(), safepath.munge(run_name))
+
+
+def register(run_name, job_id, pid):
+    """
+    Record that pid is running job_id of run_name. Failures are logged and
+    ignored; teuthology-kill falls back to looking at every process.
+    """
+    path = run_dir(run_name)
+    try:
+        if not os.path.isdir(registry_dir()):
+            os.makedirs(registry_dir(), exist_ok=True)
+            # Like /tmp, so that every user's jobs may be registered
+            os.chmod(registry_dir(), 0o1777)
+        for attempt in range(2):
+            os.makedirs(path, exist_ok=True)
+            try:
+                with open(os.path.join(path, str(job_id)), 'a') as f:
+                    f.write('%d\n' % pid)
+                break
+            except OSError as e:
+                # Another job of the run exited, removing the directory
+                if e.errno != errno.ENOENT or attempt:
+                    raise
+    except OSError:
+        log.warning("Could not register PID %s of job %s/%s", pid, run_name,
+                    job_id, exc_info=True)
+
+
+def unregister(run_name, job_id):
+    path = run_dir(run_name)
+    try:
+        os.remove(os.path.join(path, str(job_id)))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            log.warning("Could not unregister job %s/%s", run_name, job_id,
+                        exc_info=True)
+            return
+    try:
+        os.rmdir(path)
+    except OSError:
+        # Other jobs of the run are still registered
+        pass
+
+
+def job_ids(run_name):
+    """
+    :returns: The IDs of run_name's jobs that are registered
+    """
+    try:
+        return set(os.listdir(run_dir(run_name)))
+    except OSError:
+        return set()
+
+
+def find_pids(run_name, job_id=None):
+    """
+    :returns: The PIDs registered for run_name, or for only its job_id; or
+              None if none of the run's jobs are registered on this host
+    """
+    path = run_dir(run_name)
+    if job_id is None:
+        try:
+            job_ids = os.listdir(path)
+        except OSError:
+            return None
+    else:
+        if not os.path.isdir(path):
+            return None
+        job_ids = [str(job_id)]
+    pids = []
+    for name in job_ids:
+        try:
+            with open(os.path.join(path, name)) as f:
+                pids.extend(int(line) for line in f if line.strip())
+        except (OSError, ValueError):
+            continue
+    return pids
@@ -0,0 +1,368 @@
+"""
+A seekable compressed format for logs.
+
+A log is compressed as a series of independent frames, each holding whole
+lines, so the result is still an ordinary (multi-member) gzip or zstd file
+that zcat, zgrep, zless and zstdcat read as usual. Alongside it, a sidecar
+index records each frame's compressed and uncompressed offsets, and the
+first and last timestamps of its lines. With the index, the tail of a log,
+or the lines from a window of time, can be read by decompressing only the
+frames that hold them.
+
+Logs small enough to fit in a single frame get no index; reading them in
+full is already cheap.
+"""
+import bisect
+import collections
+import errno
+import gzip
+import json
+import os
+import re
+import shutil
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FRAME_SIZE = 1024 * 1024
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+# Log lines start with timestamps like 2018-07-27T00:30:55.967
+TIMESTAMP_PATTERN = re.compile(
+    rb'^(\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:\.\d+)?)', re.MULTILINE)
+
+# offset and length are in the compressed file; start and size in the log
+Frame = collections.namedtuple(
+    'Frame', 'offset length start size first_time last_time')
+
+
+def codec_for(path):
+    if path.endswith('.zst'):
+        return 'zstd'
+    return 'gzip'
+
+
+def _check_codec(codec, path):
+    if codec == 'zstd' and zstandard is None:
+        raise IOError(errno.ENOTSUP,
+                      "Reading zstd-compressed logs requires the zstandard "
+                      "module", path)
+
+
+def _compress_frame(data, codec, level):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    # A complete gzip member; zlib releases the GIL while compressing
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        # Frames written by ZstdCompressor.compress() record their size
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def _timestamps(data):
+    first = TIMESTAMP_PATTERN.search(data)
+    if first is None:
+        return None, None
+    last = None
+    # Search backwards from the end for the last timestamped line
+    end = len(data)
+    while last is None and end > 0:
+        start = data.rfind(b'\n', 0, end - 1) + 1
+        last = TIMESTAMP_PATTERN.match(data, start)
+        end = start
+    return first.group(1).decode(), last.group(1).decode()
+
+
+class SeekableLogWriter(object):
+    """
+    Write a log in the seekable compressed format
+
+    :param path:       Where to write the compressed log
+    :param codec:      'gzip' or 'zstd'; defaults to zstd for paths ending
+                       in .zst
+    :param frame_size: Roughly how many bytes of the log go in each frame
+    :param level:      The compression level
+    """
+    def __init__(self, path, codec=None, frame_size=FRAME_SIZE, level=6):
+        self.path = path
+        self.codec = codec or codec_for(path)
+        if self.codec == 'zstd' and zstandard is None:
+            raise RuntimeError("zstd requires the zstandard module")
+        self.frame_size = frame_size
+        self.level = level
+        self.frames = []
+        self.buffer = bytearray()
+        self.offset = 0
+        self.start = 0
+        self.file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.frame_size:
+            # Keep lines whole; a frame only ends mid-line if the line is
+            # longer than a frame
+            cut = self.buffer.rfind(b'\n', 0, self.frame_size) + 1
+            if cut == 0:
+                cut = self.frame_size
+            self._write_frame(bytes(self.buffer[:cut]))
+            del self.buffer[:cut]
+
+    def _write_frame(self, data):
+        compressed = _compress_frame(data, self.codec, self.level)
+        self.file.write(compressed)
+        first_time, last_time = _timestamps(data)
+        self.frames.append(Frame(self.offset, len(compressed), self.start,
+                                 len(data), first_time, last_time))
+        self.offset += len(compressed)
+        self.start += len(data)
+
+    def close(self):
+        if self.buffer or not self.frames:
+            self._write_frame(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.file.close()
+        index_path = self.path + INDEX_SUFFIX
+        if len(self.frames) > 1:
+            tmp_path = index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(
+                    version=INDEX_VERSION,
+                    codec=self.codec,
+                    compressed_size=self.offset,
+                    frames=self.frames,
+                ), f)
+            os.rename(tmp_path, index_path)
+        elif os.path.exists(index_path):
+            os.remove(index_path)
+
+
+def compress(src_path, dest_path, codec=None, **kwargs):
+    """
+    Compress the file at src_path into a seekable log at dest_path, keeping
+    the original's permissions and times. Does not remove the original.
+    """
+    with open(src_path, 'rb') as src, \
+            SeekableLogWriter(dest_path, codec, **kwargs) as dest:
+        copy(src, dest)
+    shutil.copystat(src_path, dest_path)
+
+
+def copy(src, dest, size=FRAME_SIZE):
+    while True:
+        data = src.read(size)
+        if not data:
+            return
+        dest.write(data)
+
+
+class SeekableLogReader(object):
+    """
+    Read a compressed log, using its index if it has one. Logs with no
+    index, or one that doesn't match the log, are read from the start.
+    Either way, they are read a frame (or block) at a time, so only what's
+    asked for is held in memory.
+
+    :raises IOError: If the log can't be decompressed here
+    """
+    def __init__(self, path):
+        self.path = path
+        self.codec = codec_for(path)
+        self.frames = self._load_index()
+        _check_codec(self.codec, path)
+
+    def _load_index(self):
+        try:
+            with open(self.path + INDEX_SUFFIX) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get('version') != INDEX_VERSION or \
+                index.get('compressed_size') != os.path.getsize(self.path):
+            return None
+        self.codec = index.get('codec', self.codec)
+        return [Frame(*frame) for frame in index['frames']]
+
+    @property
+    def indexed(self):
+        return self.frames is not None
+
+    @property
+    def size(self):
+        """
+        The size of the uncompressed log, if the index says; otherwise None
+        """
+        if not self.indexed:
+            return None
+        return sum(frame.size for frame in self.frames)
+
+    def read_frame(self, i):
+        frame = self.frames[i]
+        with open(self.path, 'rb') as f:
+            f.seek(frame.offset)
+            return _decompress(f.read(frame.length), self.codec)
+
+    def chunks(self, size=FRAME_SIZE):
+        """
+        Yield the log a frame at a time or, without an index, in blocks of
+        about size bytes
+        """
+        if self.indexed:
+            for i in range(len(self.frames)):
+                yield self.read_frame(i)
+            return
+        with open(self.path, 'rb') as f:
+            if self.codec == 'zstd':
+                reader = zstandard.ZstdDecompressor().stream_reader(
+                    f, read_across_frames=True)
+            else:
+                reader = gzip.GzipFile(fileobj=f)
+            with reader:
+                while True:
+                    data = reader.read(size)
+                    if not data:
+                        return
+                    yield data
+
+    def read(self):
+        """
+        The whole log. Prefer chunks() for logs that may be large.
+        """
+        return b''.join(self.chunks())
+
+    def lines(self, chunks=None):
+        """
+        Yield the lines of the log, with their line endings
+        """
+        partial = b''
+        for chunk in chunks if chunks is not None else self.chunks():
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if partial:
+            yield partial
+
+    def tail(self, lines=1):
+        """
+        The last lines of the log, reading only as many frames from the end
+        as needed
+        """
+        if not self.indexed:
+            last = collections.deque(maxlen=lines)
+            for line in self.lines():
+                last.append(line.rstrip(b'\n'))
+            return list(last)
+        data = b''
+        for i in reversed(range(len(self.frames))):
+            data = self.read_frame(i) + data
+            # The first line may be incomplete if a frame ended mid-line
+            if len(data.rstrip(b'\n').splitlines()) > lines:
+                break
+        return data.splitlines()[-lines:]
+
+    def between(self, start=None, end=None):
+        """
+        Yield the lines of the log whose timestamps are in [start, end).
+        Lines without a timestamp belong with the line before them.
+
+        :param start: An ISO 8601 timestamp string like those in the log, or
+                      None to start at the beginning
+        :param end:   Likewise, or None to read to the end
+        """
+        if self.indexed:
+            chunks = (self.read_frame(i)
+                      for i in self._frames_between(start, end))
+        else:
+            chunks = self.chunks()
+        in_window = False
+        for line in self.lines(chunks):
+            match = TIMESTAMP_PATTERN.match(line)
+            if match:
+                stamp = match.group(1).decode()
+                if end is not None and stamp >= end:
+                    return
+                in_window = start is None or stamp >= start
+            if in_window:
+                yield line
+
+    def _frames_between(self, start, end):
+        # Timestamps only ever increase through a log, so carry each frame's
+        # last timestamp forward over frames that have none
+        lasts = []
+        last = None
+        for frame in self.frames:
+            last = frame.last_time or last
+            lasts.append(last or '')
+        first = 0
+        if start is not None:
+            first = bisect.bisect_left(lasts, start)
+        frames = []
+        for i in range(first, len(self.frames)):
+            frame_first = self.frames[i].first_time
+            if end is not None and frame_first is not None and \
+                    frame_first >= end:
+                break
+            frames.append(i)
+        return frames
+
+    def grep(self, pattern):
+        """
+        Yield the lines of the log matching the regular expression, one
+        frame at a time
+        """
+        if isinstance(pattern, (str, bytes)):
+            if isinstance(pattern, str):
+                pattern = pattern.encode()
+            pattern = re.compile(pattern)
+        for line in self.lines():
+            line = line.rstrip(b'\n')
+            if pattern.search(line):
+                yield line
+
+
+def find_log(path):
+    """
+    The path of the log at path, or of its compressed version if the log
+    has been compressed; None if neither exist
+    """
+    for candidate in (path, path + '.gz', path + '.zst'):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def tail(path, lines=1):
+    """
+    The last lines of the log at path; compressed or not
+    """
+    if path.endswith(('.gz', '.zst')):
+        return SeekableLogReader(path).tail(lines)
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        block = 4096
+        while True:
+            f.seek(max(size - block, 0))
+            data = f.read()
+            if len(data.rstrip(b'\n').splitlines()) > lines or \
+                    block >= size:
+                return data.splitlines()[-lines:]
+            block *= 4